@@ -0,0 +1,49 @@
+"""In-process domain event bus.
+
+Writers publish small events after their data is committed (a habit was
+completed, a meal logged, XP granted, a focus session finished) and
+subscribers react to them, e.g. the achievement rule engine. Dispatch is
+synchronous on the publisher's thread; a failing subscriber is logged and
+never breaks the write that published the event. Subscribing to "*"
+receives every event.
+"""
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+Handler = Callable[[str, Dict], None]
+
+# Events that stand for something the user did. Follow-up events published
+# by other writers (xp_granted, activity_logged) are not in here, so rules
+# like "active before 7 AM" count one action once.
+USER_ACTION_EVENTS = frozenset({
+    "meal_logged",
+    "mood_logged",
+    "habit_completed",
+    "focus_session_completed",
+    "gita_conversation",
+    "transaction_added",
+    "transactions_imported",
+})
+
+_subscribers: Dict[str, List[Handler]] = defaultdict(list)
+_subscribers_lock = threading.Lock()
+
+
+def subscribe(event_type: str):
+    """Decorator registering `handler(event_type, payload)` for an event type."""
+    def decorator(handler: Handler) -> Handler:
+        with _subscribers_lock:
+            _subscribers[event_type].append(handler)
+        return handler
+    return decorator
+
+
+def publish(event_type: str, payload: Optional[Dict] = None):
+    with _subscribers_lock:
+        handlers = list(_subscribers.get(event_type, [])) + list(_subscribers.get("*", []))
+    for handler in handlers:
+        try:
+            handler(event_type, payload or {})
+        except Exception as e:
+            print(f"⚠️ Event handler {handler.__name__} failed for {event_type}: {e}")
@@ -1,3 +1,5 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from services.diet import diet_service
@@ -5,15 +7,37 @@ from services.finance import finance_service
 from services.emotional import emotional_service
 from services.vision import vision_service
 from services.orchestrator import orchestrator_service, memory_fusion
-from services.dashboard import dashboard_service, risk_engine, life_score_service, nudges_service, statistics_service, report_service
+from services.dashboard import activity_retention, activity_tracker, dashboard_service, risk_engine, life_score_service, nudges_service, statistics_service, report_service
 from services.gamification import gamification_service, challenges_service, achievements_service
 from services.user import user_service, goals_service, profile_service, capsule_service, friends_service
 from services.dreams import dream_service
 from services.habits import habits_service
 from services import ml_predictions
+from services.jobs import jobs_service
+from services.jobs.job_queue import job_queue
 from mlops import mlops_service
+import outbox
 
-app = FastAPI(title="Holistic AI Lifestyle Advisor")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Re-schedule background jobs interrupted by the last shutdown
+    resumed = job_queue.recover()
+    if resumed:
+        print(f"Resumed {resumed} background jobs")
+    rollover = asyncio.create_task(challenges_service.run_rollover_scheduler())
+    compaction = asyncio.create_task(activity_retention.run_compaction_scheduler())
+    # Apply side effects recorded by writes before the last shutdown
+    outbox.start()
+    yield
+    rollover.cancel()
+    compaction.cancel()
+    outbox.stop()
+    activity_tracker.activity_buffer.flush()
+    job_queue.shutdown()
+
+
+app = FastAPI(title="Holistic AI Lifestyle Advisor", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -47,6 +71,7 @@ app.include_router(profile_service.router, prefix="/profile", tags=["Profile"])
 app.include_router(report_service.router, prefix="/report", tags=["Reports"])
 app.include_router(capsule_service.router, prefix="/capsule", tags=["Time Capsule"])
 app.include_router(friends_service.router, prefix="/friends", tags=["Friends"])
+app.include_router(jobs_service.router, prefix="/jobs", tags=["Jobs"])
 
 @app.get("/")
 def read_root():
@@ -1,5 +1,6 @@
 from fastapi import APIRouter
 from mlops.mlflow_config import log_diet_prediction, log_finance_prediction, log_model_metrics
+from prompt_context import get_prompt_stats
 import mlflow
 
 router = APIRouter()
@@ -33,3 +34,8 @@ def log_model(model_name: str, metrics: dict):
     """Log general model metrics."""
     log_model_metrics(model_name, metrics)
     return {"status": "logged", "model": model_name}
+
+@router.get("/prompt-stats")
+def prompt_stats():
+    """Estimated LLM prompt tokens per endpoint (calls, average, max, truncations)."""
+    return {"endpoints": get_prompt_stats()}
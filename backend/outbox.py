@@ -0,0 +1,214 @@
+"""Transactional outbox for side effects of user-facing writes.
+
+A write such as logging a meal records its side effects (XP grant, activity
+feed entry, domain event) as one `outbox` row inside the same transaction as
+the write itself, so the request commits once. A background dispatcher
+drains pending rows in batches: XP grants and activity rows for the whole
+batch are applied in a single transaction that also marks the rows
+processed, then the domain events are published on the event bus
+(achievements, challenges). Rows survive restarts.
+
+Failed rows are retried with exponential backoff (`next_attempt_at`). A
+transient failure (sqlite3.OperationalError, e.g. "database is locked") is
+retried indefinitely; a row that fails on its own (bad payload, handler bug)
+is a poison row and is dead-lettered after OUTBOX_MAX_ATTEMPTS such failures,
+without holding up the rest of its batch.
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from database import get_db_connection
+
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))
+POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "1"))
+MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "300"))
+
+# XP side effects whose payload names no user go to the single app user, like every grant_xp caller
+XP_USER_ID = 1
+
+
+def init_outbox_table():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            processed_at TEXT,
+            attempts INTEGER DEFAULT 0,
+            retries INTEGER DEFAULT 0,
+            next_attempt_at TEXT,
+            error TEXT
+        )
+    """)
+    columns = {row["name"] for row in cursor.execute("PRAGMA table_info(outbox)")}
+    if "retries" not in columns:
+        cursor.execute("ALTER TABLE outbox ADD COLUMN retries INTEGER DEFAULT 0")
+    if "next_attempt_at" not in columns:
+        cursor.execute("ALTER TABLE outbox ADD COLUMN next_attempt_at TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (id) WHERE processed_at IS NULL")
+    conn.commit()
+    conn.close()
+
+
+init_outbox_table()
+
+
+def record(cursor, event_type: str, event: Optional[Dict] = None, xp: Optional[Dict] = None,
+           activity: Optional[Dict] = None):
+    """Record side effects on the caller's cursor; call notify() after the commit.
+
+    xp is {"amount", "source", "reason"} plus an optional "user_id" (else the event's
+    "user_id", else XP_USER_ID); activity is {"type", "description", "metadata"}.
+    """
+    payload = {"event": event or {}, "xp": xp, "activity": activity}
+    cursor.execute(
+        "INSERT INTO outbox (event_type, payload, created_at) VALUES (?, ?, ?)",
+        (event_type, json.dumps(payload), datetime.now().isoformat())
+    )
+
+
+_wakeup = threading.Event()
+_stop = threading.Event()
+_dispatch_lock = threading.Lock()
+_worker_lock = threading.Lock()
+_worker: Dict[str, Optional[threading.Thread]] = {"thread": None}
+
+
+def _apply(rows: List) -> None:
+    from event_bus import publish
+    from services.dashboard.activity_tracker import insert_activities
+    from services.gamification.gamification_service import apply_xp_grants, xp_granted
+
+    entries = [(row, json.loads(row["payload"])) for row in rows]
+    # Side effects are dated by the original write, not by when they are applied
+    grants: Dict[int, List[Dict]] = {}
+    for row, payload in entries:
+        if payload.get("xp"):
+            xp = dict(payload["xp"])
+            user_id = xp.pop("user_id", None) or (payload.get("event") or {}).get("user_id") or XP_USER_ID
+            grants.setdefault(user_id, []).append({**xp, "created_at": row["created_at"]})
+    activities = [{**payload["activity"], "timestamp": row["created_at"]}
+                  for row, payload in entries if payload.get("activity")]
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        applied = {user_id: apply_xp_grants(cursor, user_id, user_grants) for user_id, user_grants in grants.items()}
+        if activities:
+            insert_activities(cursor, activities)
+        cursor.execute(
+            f"UPDATE outbox SET processed_at = ? WHERE id IN ({', '.join('?' for _ in rows)})",
+            [datetime.now().isoformat(), *[row["id"] for row in rows]]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    for user_id, result in applied.items():
+        if result:
+            user_grants = grants[user_id]
+            xp_granted(user_id, result, user_grants[0]["source"] if len(user_grants) == 1 else "batch")
+    for row, payload in entries:
+        publish(row["event_type"], payload["event"])
+
+
+def _defer(row_id: int, error: Exception, poison: bool):
+    """Schedule a retry with exponential backoff; only poison failures count toward MAX_ATTEMPTS."""
+    conn = get_db_connection()
+    retries = conn.execute("SELECT retries FROM outbox WHERE id = ?", (row_id,)).fetchone()["retries"] or 0
+    delay = min(BACKOFF_SECONDS * 2 ** retries, MAX_BACKOFF_SECONDS)
+    conn.execute(
+        "UPDATE outbox SET attempts = attempts + ?, retries = retries + 1, next_attempt_at = ?, error = ? WHERE id = ?",
+        (int(poison), (datetime.now() + timedelta(seconds=delay)).isoformat(), str(error), row_id)
+    )
+    conn.commit()
+    conn.close()
+
+
+def dispatch_pending(limit: int = BATCH_SIZE) -> int:
+    """Apply one batch of due rows; returns how many rows were attempted."""
+    with _dispatch_lock:
+        conn = get_db_connection()
+        rows = conn.execute(
+            """
+            SELECT * FROM outbox
+            WHERE processed_at IS NULL AND attempts < ? AND (next_attempt_at IS NULL OR next_attempt_at <= ?)
+            ORDER BY id LIMIT ?
+            """,
+            (MAX_ATTEMPTS, datetime.now().isoformat(), limit)
+        ).fetchall()
+        conn.close()
+        if not rows:
+            return 0
+
+        try:
+            _apply(rows)
+        except sqlite3.OperationalError as e:
+            # Locked or busy database: nothing is wrong with the rows, back the whole batch off
+            print(f"⚠️ Outbox batch deferred: {e}")
+            for row in rows:
+                _defer(row["id"], e, poison=False)
+        except Exception as e:
+            print(f"⚠️ Outbox batch failed, retrying rows one by one: {e}")
+            for row in rows:
+                try:
+                    _apply([row])
+                except sqlite3.OperationalError as row_error:
+                    _defer(row["id"], row_error, poison=False)
+                except Exception as row_error:
+                    _defer(row["id"], row_error, poison=True)
+        return len(rows)
+
+
+def flush():
+    """Dispatch until nothing is due (tests, shutdown); backed-off rows wait for a later poll."""
+    while dispatch_pending():
+        pass
+
+
+def _run():
+    while not _stop.is_set():
+        _wakeup.wait(POLL_SECONDS)
+        _wakeup.clear()
+        try:
+            flush()
+        except Exception as e:
+            print(f"⚠️ Outbox dispatcher error: {e}")
+
+
+def start():
+    """Start the dispatcher thread (idempotent); it also drains rows left by the last run."""
+    with _worker_lock:
+        thread = _worker["thread"]
+        if thread and thread.is_alive():
+            return
+        _stop.clear()
+        _worker["thread"] = threading.Thread(target=_run, name="outbox-dispatcher", daemon=True)
+        _worker["thread"].start()
+    _wakeup.set()
+
+
+def notify():
+    """Wake the dispatcher after committing a write that recorded side effects."""
+    start()
+    _wakeup.set()
+
+
+def stop(timeout: float = 5.0):
+    _stop.set()
+    _wakeup.set()
+    thread = _worker["thread"]
+    if thread:
+        thread.join(timeout)
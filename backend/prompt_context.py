@@ -0,0 +1,124 @@
+"""Token-budgeted prompt context builder shared by all LLM prompts.
+
+Prompts are assembled from named sections (retrieved docs, chat history,
+findings, ...). Each section has a priority; `build()` fills the token budget
+highest priority first, dropping whole items from list sections and
+truncating text sections at a word boundary. Fixed text (instructions, the
+user's query) is reserved up front and never cut. Token counts are a cheap
+chars/4 estimate, which is close enough for budgeting. Every build records
+its size per endpoint for /mlops/prompt-stats.
+"""
+import math
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARK = " …"
+
+_stats: Dict[str, Dict] = {}
+_stats_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, at a word boundary."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max(max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARK), 0)
+    cut = text[:limit]
+    if " " in cut:
+        cut = cut[:cut.rfind(" ")]
+    return cut.rstrip() + TRUNCATION_MARK if cut else ""
+
+
+class ContextBuilder:
+    """Collects prompt sections and fits them into a token budget."""
+
+    def __init__(self, endpoint: str, budget: Optional[int] = None):
+        # PROMPT_TOKEN_BUDGET_<ENDPOINT> overrides the caller's default budget
+        self.endpoint = endpoint
+        self.budget = int(os.getenv(f"PROMPT_TOKEN_BUDGET_{endpoint.upper()}", budget or DEFAULT_TOKEN_BUDGET))
+        self._reserved = 0
+        self._sections: List[Dict] = []
+
+    def reserve(self, text: str) -> "ContextBuilder":
+        """Count fixed prompt text (template, query) against the budget."""
+        self._reserved += estimate_tokens(text)
+        return self
+
+    def add(self, name: str, text: str, priority: int = 0) -> "ContextBuilder":
+        """A free-text section; truncated if it does not fit."""
+        self._sections.append({"name": name, "text": text or "", "priority": priority, "items": None})
+        return self
+
+    def add_items(self, name: str, items: List[str], priority: int = 0, joiner: str = "\n\n",
+                  keep: str = "first") -> "ContextBuilder":
+        """A list section; whole items are dropped from the end (keep="first") or the start (keep="last")."""
+        self._sections.append({"name": name, "items": [i for i in items if i], "priority": priority,
+                               "joiner": joiner, "keep": keep})
+        return self
+
+    def _fit_items(self, section: Dict, available: int) -> Tuple[str, int]:
+        items = section["items"] if section["keep"] == "first" else list(reversed(section["items"]))
+        kept, used = [], 0
+        joiner_tokens = estimate_tokens(section["joiner"])
+        for item in items:
+            cost = estimate_tokens(item) + (joiner_tokens if kept else 0)
+            if used + cost > available:
+                break
+            kept.append(item)
+            used += cost
+        if not kept and items and available > 0:
+            # Keep a truncated first item rather than nothing
+            kept, used = [truncate_to_tokens(items[0], available)], available
+        dropped = len(items) - len(kept)
+        if section["keep"] == "last":
+            kept.reverse()
+        return section["joiner"].join(kept), dropped
+
+    def build(self) -> Dict[str, str]:
+        """Fit sections into the budget; returns section name -> text."""
+        remaining = self.budget - self._reserved
+        output: Dict[str, str] = {}
+        truncated = False
+
+        for section in sorted(self._sections, key=lambda s: -s["priority"]):
+            available = max(remaining, 0)
+            if section["items"] is None:
+                text = truncate_to_tokens(section["text"], available)
+                truncated = truncated or text != section["text"]
+            else:
+                text, dropped = self._fit_items(section, available)
+                truncated = truncated or dropped > 0
+            output[section["name"]] = text
+            remaining -= estimate_tokens(text)
+
+        record_prompt(self.endpoint, self.budget - remaining, self.budget, truncated)
+        return output
+
+
+def record_prompt(endpoint: str, tokens: int, budget: int, truncated: bool):
+    with _stats_lock:
+        stats = _stats.setdefault(endpoint, {
+            "calls": 0, "total_tokens": 0, "max_tokens": 0, "truncated_calls": 0
+        })
+        stats["calls"] += 1
+        stats["total_tokens"] += tokens
+        stats["max_tokens"] = max(stats["max_tokens"], tokens)
+        stats["truncated_calls"] += int(truncated)
+        stats["last_tokens"] = tokens
+        stats["budget"] = budget
+
+
+def get_prompt_stats() -> Dict[str, Dict]:
+    """Estimated prompt size per endpoint since startup."""
+    with _stats_lock:
+        return {
+            endpoint: {**stats, "avg_tokens": round(stats["total_tokens"] / stats["calls"], 1)}
+            for endpoint, stats in _stats.items()
+        }
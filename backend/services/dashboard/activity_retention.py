@@ -0,0 +1,119 @@
+"""Hot/archive split and retention for the activity feed.
+
+`activities` only holds the last ACTIVITY_HOT_DAYS days, so feed reads,
+watermarks and nudges touch a small table. A daily compaction job rolls
+older rows into per-day/per-type counts (`activity_daily`), moves them to
+`activities_archive` and drops archived rows past ACTIVITY_RETENTION_DAYS,
+except for types in ACTIVITY_RETENTION_KEEP_TYPES (dream journal entries by
+default). The `activities_all` view unions both tables for full-history reads.
+
+The split is by id, not timestamp: every archived id is below every hot id,
+which is what lets the feed's keyset pagination continue from the hot table
+into the archive. The job archives the rows below the first one still inside
+the hot window; a row carrying an older timestamp than its id suggests
+(outbox side effects, backfills) stays hot until the rows before it age out,
+rather than dragging newer rows into the archive with it.
+"""
+import asyncio
+import os
+from datetime import date, timedelta
+from typing import Dict
+
+from database import get_db_connection
+from services.jobs.job_queue import job_queue
+
+HOT_DAYS = int(os.getenv("ACTIVITY_HOT_DAYS", "90"))
+# 0 keeps archived rows forever
+RETENTION_DAYS = int(os.getenv("ACTIVITY_RETENTION_DAYS", "730"))
+RETENTION_KEEP_TYPES = tuple(t for t in os.getenv("ACTIVITY_RETENTION_KEEP_TYPES", "dream_log").split(",") if t)
+COMPACTION_INTERVAL = timedelta(hours=float(os.getenv("ACTIVITY_COMPACTION_HOURS", "24")))
+
+
+def init_activity_archive():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS activities_archive (
+            id INTEGER PRIMARY KEY,
+            type TEXT NOT NULL,
+            description TEXT NOT NULL,
+            icon TEXT,
+            timestamp TEXT NOT NULL,
+            metadata TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_activities_archive_timestamp ON activities_archive (timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_activities_archive_type ON activities_archive (type, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_activities_timestamp ON activities (timestamp)")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS activity_daily (
+            day TEXT NOT NULL,
+            type TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (day, type)
+        )
+    """)
+    cursor.execute("""
+        CREATE VIEW IF NOT EXISTS activities_all AS
+        SELECT id, type, description, icon, timestamp, metadata FROM activities
+        UNION ALL
+        SELECT id, type, description, icon, timestamp, metadata FROM activities_archive
+    """)
+
+    conn.commit()
+    conn.close()
+
+
+init_activity_archive()
+
+
+@job_queue.register("activity_compaction")
+def compact_activities(payload: dict = None, progress=None) -> Dict:
+    """Summarize and archive rows below the first one inside the hot window, then apply retention."""
+    payload = payload or {}
+    hot_days = int(payload.get("hot_days", HOT_DAYS))
+    retention_days = int(payload.get("retention_days", RETENTION_DAYS))
+    cutoff = (date.today() - timedelta(days=hot_days)).isoformat()
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cutoff_id = cursor.execute("""
+            SELECT COALESCE((SELECT MIN(id) - 1 FROM activities WHERE timestamp >= ?), (SELECT MAX(id) FROM activities), 0)
+        """, (cutoff,)).fetchone()[0]
+        cursor.execute("""
+            INSERT INTO activity_daily (day, type, count)
+            SELECT substr(timestamp, 1, 10), type, COUNT(*) FROM activities
+            WHERE id <= ? GROUP BY 1, 2
+            ON CONFLICT(day, type) DO UPDATE SET count = count + excluded.count
+        """, (cutoff_id,))
+        cursor.execute("""
+            INSERT OR REPLACE INTO activities_archive (id, type, description, icon, timestamp, metadata)
+            SELECT id, type, description, icon, timestamp, metadata FROM activities WHERE id <= ?
+        """, (cutoff_id,))
+        archived = cursor.execute("DELETE FROM activities WHERE id <= ?", (cutoff_id,)).rowcount
+
+        expired = 0
+        if retention_days > 0:
+            expire_before = (date.today() - timedelta(days=retention_days)).isoformat()
+            query = "DELETE FROM activities_archive WHERE timestamp < ?"
+            if RETENTION_KEEP_TYPES:
+                query += f" AND type NOT IN ({', '.join('?' for _ in RETENTION_KEEP_TYPES)})"
+            expired = cursor.execute(query, (expire_before, *RETENTION_KEEP_TYPES)).rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return {"cutoff": cutoff, "cutoff_id": cutoff_id, "archived": archived, "expired": expired}
+
+
+async def run_compaction_scheduler():
+    """Enqueue a compaction now and then every ACTIVITY_COMPACTION_HOURS (runs for the app lifetime)."""
+    while True:
+        job_queue.enqueue("activity_compaction")
+        await asyncio.sleep(COMPACTION_INTERVAL.total_seconds())
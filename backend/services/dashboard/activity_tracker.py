@@ -1,78 +1,227 @@
-"""Activity tracking for dashboard using SQLite."""
+"""Activity tracking for dashboard using SQLite.
+
+Buffered writes from log_activity are flushed as one multi-row insert when
+ACTIVITY_FLUSH_SIZE rows are pending or ACTIVITY_FLUSH_SECONDS after the
+first one. Readers (feed pages, the insight watermark, nudges) flush first,
+so a request always sees its own writes.
+Metadata is stored as JSON text and queried with SQLite's JSON1 functions:
+filters run in SQL and a page of activities is serialized by SQLite in one
+string, so Python parses one document instead of one per row. Pages are
+keyset-paginated on id (`before_id`); they read the hot `activities` table
+and only continue into `activities_archive` once it is exhausted.
+"""
 from datetime import datetime
 import json
-from typing import List, Dict
+import os
+import re
+import threading
+from typing import Any, List, Dict, Optional
 from database import get_db_connection
+from . import activity_retention  # creates activities_archive, activity_daily and the activities_all view
+
+FLUSH_SIZE = int(os.getenv("ACTIVITY_FLUSH_SIZE", "50"))
+FLUSH_SECONDS = float(os.getenv("ACTIVITY_FLUSH_SECONDS", "1.0"))
+MAX_PAGE_SIZE = 200
+
+# Metadata filter keys are interpolated into a JSON path, so only plain identifiers are allowed
+METADATA_KEY_PATTERN = re.compile(r"^[A-Za-z0-9_]+$")
 
-def log_activity(activity_type: str, description: str, metadata: Dict = None) -> Dict:
-    """Log a new activity to DB."""
+
+def init_activity_indexes():
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Icon mapping
-    icon_map = {
-        "meal_logged": "🍽️",
-        "diet_plan_generated": "📋",
-        "budget_analyzed": "💰",
-        "expense_added": "💸",
-        "chat_sent": "💬",
-        "insight_generated": "💡",
-    }
-    icon = icon_map.get(activity_type, "📝")
-    timestamp = datetime.now().isoformat()
-    metadata_json = json.dumps(metadata or {})
-    
-    cursor.execute(
-        'INSERT INTO activities (type, description, icon, timestamp, metadata) VALUES (?, ?, ?, ?, ?)',
-        (activity_type, description, icon, timestamp, metadata_json)
-    )
-    
-    activity_id = cursor.lastrowid
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_activities_type ON activities (type, id)")
     conn.commit()
     conn.close()
-    
-    return {
-        "id": activity_id,
+
+
+init_activity_indexes()
+
+# Icon mapping
+ACTIVITY_ICONS = {
+    "meal_logged": "🍽️",
+    "diet_plan_generated": "📋",
+    "budget_analyzed": "💰",
+    "expense_added": "💸",
+    "chat_sent": "💬",
+    "insight_generated": "💡",
+    "habit_completed": "🔥",
+    "mood_logged": "🧘",
+    "dream_log": "🌙",
+}
+
+
+def insert_activities(cursor, items: List[Dict]) -> int:
+    """Insert activities on the caller's cursor in one batch (no commit).
+
+    Each item has type, description and optional metadata / timestamp.
+    """
+    now = datetime.now().isoformat()
+    cursor.executemany(
+        'INSERT INTO activities (type, description, icon, timestamp, metadata) VALUES (?, ?, ?, ?, json(?))',
+        [
+            (item["type"], item["description"], ACTIVITY_ICONS.get(item["type"], "📝"),
+             item.get("timestamp") or now, json.dumps(item.get("metadata") or {}))
+            for item in items
+        ]
+    )
+    return len(items)
+
+
+class ActivityBuffer:
+    """Collects activity rows and writes them in batches."""
+
+    def __init__(self, flush_size: int = FLUSH_SIZE, flush_seconds: float = FLUSH_SECONDS):
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._pending: List[Dict] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def add(self, item: Dict):
+        with self._lock:
+            self._pending.append(item)
+            full = len(self._pending) >= self.flush_size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_seconds, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write everything pending in one transaction; returns the row count."""
+        # Serialized so a reader's flush waits for an in-flight timer flush
+        with self._flush_lock:
+            with self._lock:
+                items, self._pending = self._pending, []
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not items:
+                return 0
+
+            conn = get_db_connection()
+            try:
+                insert_activities(conn.cursor(), items)
+                conn.commit()
+            except Exception as e:
+                # Keep the rows for the next flush rather than dropping them
+                print(f"⚠️ Failed to flush {len(items)} activities: {e}")
+                with self._lock:
+                    self._pending[:0] = items
+                return 0
+            finally:
+                conn.close()
+            return len(items)
+
+
+activity_buffer = ActivityBuffer()
+
+
+def log_activity(activity_type: str, description: str, metadata: Dict = None, buffered: bool = True) -> Dict:
+    """Record an activity.
+
+    Buffered writes return "id": None (the id is assigned when the buffer
+    flushes); buffered=False writes the row now, after anything pending, and
+    returns it with its id.
+    """
+    item = {
         "type": activity_type,
         "description": description,
-        "icon": icon,
-        "timestamp": timestamp,
+        "icon": ACTIVITY_ICONS.get(activity_type, "📝"),
+        "timestamp": datetime.now().isoformat(),
         "metadata": metadata or {}
     }
+    if buffered:
+        activity_buffer.add(item)
+        return {"id": None, **item}
 
-def get_recent_activities(limit: int = 10) -> List[Dict]:
-    """Get recent activities from DB."""
+    activity_buffer.flush()
     conn = get_db_connection()
     cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM activities ORDER BY timestamp DESC LIMIT ?', (limit,))
-    rows = cursor.fetchall()
+    insert_activities(cursor, [item])
+    # executemany leaves cursor.lastrowid unset
+    activity_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+    conn.commit()
     conn.close()
+    return {"id": activity_id, **item}
+
+
+def validate_metadata_filters(metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Check metadata filters before they reach SQL; raises ValueError for unusable ones."""
+    for key, value in (metadata or {}).items():
+        if not METADATA_KEY_PATTERN.match(str(key)):
+            raise ValueError(f"Invalid metadata key: {key!r} (letters, digits and _ only)")
+        if value is not None and not isinstance(value, (str, int, float, bool)):
+            raise ValueError(f"Metadata filter {key!r} must be a string, number, boolean or null")
+    return metadata or {}
+
+
+def get_recent_activities(limit: int = 10, before_id: Optional[int] = None, type: Optional[str] = None,
+                          metadata: Optional[Dict[str, Any]] = None) -> List[Dict]:
+    """Newest activities first; `before_id` continues from the last id of the previous page.
+
+    `metadata` filters match top-level keys, e.g. {"meal_type": "lunch"}; see
+    validate_metadata_filters for what is accepted.
+    """
+    metadata = validate_metadata_filters(metadata)
+    activity_buffer.flush()
+    limit = max(min(limit, MAX_PAGE_SIZE), 1)
     
-    activities = []
-    for row in rows:
-        activity = dict(row)
-        if activity['metadata']:
-            try:
-                activity['metadata'] = json.loads(activity['metadata'])
-            except:
-                activity['metadata'] = {}
-        activities.append(activity)
-        
+    conn = get_db_connection()
+    activities = _read_page(conn, "activities", limit, before_id, type, metadata)
+    if len(activities) < limit:
+        # Hot table exhausted: continue below its oldest id in the archive
+        archive_before = activities[-1]["id"] if activities else before_id
+        activities += _read_page(conn, "activities_archive", limit - len(activities), archive_before, type, metadata)
+    conn.close()
     return activities
 
+
+def _read_page(conn, table: str, limit: int, before_id: Optional[int], type: Optional[str],
+               metadata: Optional[Dict[str, Any]]) -> List[Dict]:
+    conditions, params = [], []
+    if before_id is not None:
+        conditions.append("id < ?")
+        params.append(before_id)
+    if type:
+        conditions.append("type = ?")
+        params.append(type)
+    for key, value in (metadata or {}).items():
+        conditions.append("json_valid(metadata) AND json_extract(metadata, ?) IS ?")
+        params.extend([f'$."{key}"', value])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT json_group_array(json_object(
+            'id', id, 'type', type, 'description', description, 'icon', icon, 'timestamp', timestamp,
+            'metadata', json(CASE WHEN json_valid(metadata) THEN metadata ELSE '{{}}' END)
+        ))
+        FROM (SELECT * FROM {table} {where} ORDER BY id DESC LIMIT ?)
+    """, (*params, limit))
+    
+    # json_group_array over an ordered subquery keeps its order
+    return json.loads(cursor.fetchone()[0])
+
 def calculate_habit_streak() -> Dict:
     """Calculate habit streak from DB activities."""
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Get all unique dates from activities
-    cursor.execute("SELECT DISTINCT substr(timestamp, 1, 10) as date FROM activities")
-    rows = cursor.fetchall()
+    # Active days: compacted days come from the daily summary, only the hot window is scanned
+    activity_buffer.flush()
+    cursor.execute("""
+        SELECT COUNT(*) FROM (
+            SELECT day FROM activity_daily
+            UNION
+            SELECT substr(timestamp, 1, 10) FROM activities
+        )
+    """)
+    unique_dates = cursor.fetchone()[0]
     conn.close()
     
-    unique_dates = len(rows)
-    
     # Simple streak logic (mocked slightly for demo if low data)
     current_streak = unique_dates
     longest_streak = unique_dates + 5 # Mock
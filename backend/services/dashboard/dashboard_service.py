@@ -1,16 +1,27 @@
 """Dashboard service API endpoints."""
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
 from typing import List, Dict, Optional
+import json
 import random
 from datetime import datetime
 
 from .activity_tracker import (
     log_activity,
     get_recent_activities,
-    calculate_habit_streak
+    calculate_habit_streak,
+    validate_metadata_filters
 )
 from .insights_generator import generate_insight
+from .insight_store import (
+    activity_watermark,
+    get_latest_insight,
+    save_insight,
+    schedule_refresh,
+    PLACEHOLDER_INSIGHT
+)
+from services.jobs.job_queue import job_queue, accepted
+from event_bus import publish
 
 router = APIRouter()
 
@@ -50,21 +61,21 @@ def get_dashboard_overview():
         "habit_streak": calculate_habit_streak()
     }
     
-    # Generate AI insight
-    try:
-        insight_context = {
-            "activity_count": len(recent_activities),
-            "recent_activities": recent_activities,
-            "metrics": metrics
-        }
-        ai_insight = generate_insight(insight_context)
-    except Exception as e:
-        print(f"Error generating insight: {e}")
+    # AI insight is precomputed in the background; never wait on the LLM here
+    stored = get_latest_insight()
+    if stored:
         ai_insight = {
-            "message": "Stay healthy and active!",
-            "confidence": 0.0,
-            "tags": ["fallback", "error"]
+            "message": stored["message"],
+            "confidence": stored["confidence"],
+            "tags": stored["tags"],
+            "generated_at": stored["generated_at"]
         }
+    else:
+        ai_insight = dict(PLACEHOLDER_INSIGHT)
+    try:
+        schedule_refresh()
+    except Exception as e:
+        print(f"Error scheduling insight refresh: {e}")
     
     return {
         "metrics": metrics,
@@ -75,14 +86,22 @@ def get_dashboard_overview():
 
 
 @router.post("/log-activity")
-def create_activity_log(activity: ActivityLog):
-    """Log a new activity."""
+def create_activity_log(activity: ActivityLog, buffered: bool = False):
+    """Log a new activity.
+    
+    The row is written immediately and returned with its id. High-volume
+    clients can pass buffered=true to batch the write; the response then has
+    "id": null and the row appears in the feed once the buffer flushes.
+    """
     try:
         logged = log_activity(
             activity.type,
             activity.description,
-            activity.metadata
+            activity.metadata,
+            buffered=buffered
         )
+        schedule_refresh()
+        publish("activity_logged", {"type": activity.type})
         return {
             "success": True,
             "activity": logged
@@ -92,25 +111,60 @@ def create_activity_log(activity: ActivityLog):
 
 
 @router.get("/activities")
-def get_activities(limit: int = 10):
-    """Get recent activities."""
-    activities = get_recent_activities(limit=limit)
+def get_activities(limit: int = 10, before_id: Optional[int] = None, type: Optional[str] = None,
+                   meta: Optional[List[str]] = Query(None)):
+    """Get recent activities, newest first.
+    
+    Pass the returned `next_before_id` as `before_id` for the next page.
+    `meta=key=value` (repeatable) filters on metadata fields.
+    """
+    filters = {}
+    for item in meta or []:
+        key, sep, raw = item.partition("=")
+        if not sep or not key:
+            raise HTTPException(status_code=400, detail=f"Invalid meta filter: {item}")
+        try:
+            filters[key] = json.loads(raw)
+        except ValueError:
+            filters[key] = raw
+    try:
+        validate_metadata_filters(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    activities = get_recent_activities(limit=limit, before_id=before_id, type=type, metadata=filters)
     return {
         "activities": activities,
-        "total": len(activities)
+        "total": len(activities),
+        "next_before_id": activities[-1]["id"] if len(activities) == limit else None
     }
 
 
-@router.post("/refresh-insight")
-def refresh_insight():
-    """Generate a fresh AI insight."""
+@job_queue.register("dashboard_insight")
+def run_insight_refresh(payload: dict = None, progress=None) -> dict:
+    """Generate a fresh AI insight from recent activity and store it."""
+    watermark = activity_watermark()
     recent_activities = get_recent_activities(limit=5)
     context = {
         "activity_count": len(recent_activities),
         "recent_activities": recent_activities
     }
     insight = generate_insight(context)
+    if "fallback" in insight.get("tags", []):
+        # The LLM failed: show the canned message, but don't mark this activity as covered
+        latest = get_latest_insight()
+        watermark = latest["activity_watermark"] if latest else 0
+    insight = save_insight(insight, watermark)
     return {
         "insight": insight,
-        "generated_at": datetime.now().isoformat()
+        "generated_at": insight["generated_at"]
     }
+
+
+@router.post("/refresh-insight")
+def refresh_insight():
+    """Enqueue a fresh AI insight; returns 202 with the job id.
+    
+    The overview picks the new insight up once the job completes.
+    """
+    return accepted(schedule_refresh(force=True))
@@ -0,0 +1,118 @@
+"""Stored dashboard insight, refreshed in the background.
+
+The AI insight is generated by a job and saved together with the activity
+watermark (highest activity id) it was computed from. Readers only ever see
+the stored row; a refresh is enqueued when enough new activity has arrived
+since that watermark, or when the insight is stale and anything changed.
+A canned fallback (LLM unavailable) is stored without advancing the
+watermark and retried after INSIGHT_FALLBACK_RETRY_MINUTES.
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from database import get_db_connection
+from services.jobs.job_queue import job_queue
+from .activity_tracker import activity_buffer
+
+# New activities needed before the insight is regenerated
+REFRESH_MIN_ACTIVITIES = int(os.getenv("INSIGHT_REFRESH_MIN_ACTIVITIES", "3"))
+# After this long any new activity triggers a refresh
+REFRESH_MAX_AGE = timedelta(hours=float(os.getenv("INSIGHT_MAX_AGE_HOURS", "6")))
+# A canned fallback (LLM unavailable) is retried after this long instead of counting as fresh
+FALLBACK_RETRY_AFTER = timedelta(minutes=float(os.getenv("INSIGHT_FALLBACK_RETRY_MINUTES", "5")))
+
+PLACEHOLDER_INSIGHT = {
+    "message": "Stay healthy and active!",
+    "confidence": 0.0,
+    "tags": ["fallback", "pending"]
+}
+
+
+def init_insights_table():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS dashboard_insights (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message TEXT NOT NULL,
+            confidence REAL DEFAULT 0,
+            tags TEXT DEFAULT '[]',
+            activity_watermark INTEGER DEFAULT 0,
+            generated_at TEXT NOT NULL
+        )
+    """)
+
+    conn.commit()
+    conn.close()
+
+
+init_insights_table()
+
+
+def activity_watermark() -> int:
+    """Highest activity id; grows with every logged activity (buffered ones are flushed first)."""
+    activity_buffer.flush()
+    conn = get_db_connection()
+    row = conn.execute("SELECT MAX(id) FROM activities").fetchone()
+    conn.close()
+    return row[0] or 0
+
+
+def get_latest_insight() -> Optional[Dict]:
+    conn = get_db_connection()
+    row = conn.execute("SELECT * FROM dashboard_insights ORDER BY id DESC LIMIT 1").fetchone()
+    conn.close()
+    if not row:
+        return None
+    insight = dict(row)
+    insight["tags"] = json.loads(insight["tags"] or "[]")
+    return insight
+
+
+def save_insight(insight: Dict, watermark: int) -> Dict:
+    generated_at = datetime.now().isoformat()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO dashboard_insights (message, confidence, tags, activity_watermark, generated_at) VALUES (?, ?, ?, ?, ?)",
+        (insight.get("message", ""), insight.get("confidence", 0), json.dumps(insight.get("tags", [])),
+         watermark, generated_at)
+    )
+    # Only the latest few rows are ever read
+    cursor.execute("DELETE FROM dashboard_insights WHERE id <= ?", (cursor.lastrowid - 20,))
+    conn.commit()
+    conn.close()
+    return {**insight, "activity_watermark": watermark, "generated_at": generated_at}
+
+
+def needs_refresh(latest: Optional[Dict], watermark: int) -> bool:
+    if latest is None:
+        return True
+    age = datetime.now() - datetime.fromisoformat(latest["generated_at"])
+    if "fallback" in latest["tags"]:
+        return age > FALLBACK_RETRY_AFTER
+    new_activities = watermark - (latest["activity_watermark"] or 0)
+    if new_activities >= REFRESH_MIN_ACTIVITIES:
+        return True
+    return age > REFRESH_MAX_AGE and new_activities > 0
+
+
+# Makes the pending-job check and the enqueue one step for concurrent requests
+_schedule_lock = threading.Lock()
+
+
+def schedule_refresh(force: bool = False) -> Optional[Dict]:
+    """Enqueue an insight job if activity moved enough and none is already pending."""
+    watermark = activity_watermark()
+    with _schedule_lock:
+        if not force and not needs_refresh(get_latest_insight(), watermark):
+            return None
+        pending = job_queue.list(kind="dashboard_insight", status="queued", limit=1) \
+            or job_queue.list(kind="dashboard_insight", status="running", limit=1)
+        if pending:
+            return pending[0]
+        return job_queue.enqueue("dashboard_insight")
@@ -4,6 +4,7 @@ print("Loading insights_generator...", flush=True)
 import os
 import random
 from dotenv import load_dotenv
+from prompt_context import ContextBuilder
 
 print("Loading dotenv...", flush=True)
 load_dotenv()
@@ -33,25 +34,29 @@ def generate_insight(context: dict) -> dict:
         
         from langchain_core.prompts import ChatPromptTemplate
         
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a friendly AI lifestyle advisor. Generate ONE concise, personalized insight (1-2 sentences) 
+        system_text = """You are a friendly AI lifestyle advisor. Generate ONE concise, personalized insight (1-2 sentences) 
             that is encouraging, actionable, and specific to the user's recent activity. Focus on positive reinforcement 
-            and gentle suggestions for improvement."""),
-            ("user", """Based on user's recent activity:
+            and gentle suggestions for improvement."""
+        user_text = """Based on user's recent activity:
             - Total activities: {activity_count}
             - Recent actions: {recent_activities}
             
-            Generate a friendly, encouraging insight.""")
-        ])
+            Generate a friendly, encouraging insight."""
+        prompt = ChatPromptTemplate.from_messages([("system", system_text), ("user", user_text)])
         
         llm = get_llm()
         if not llm:
             raise ValueError("LLM not initialized")
+        
+        sections = ContextBuilder("dashboard_insight", budget=300) \
+            .reserve(system_text + user_text) \
+            .add_items("recent_activities", [a.get('description', '') for a in recent_activities], joiner=", ") \
+            .build()
             
         chain = prompt | llm
         response = chain.invoke({
             "activity_count": activity_count,
-            "recent_activities": ", ".join([a.get('description', '') for a in recent_activities[:3]])
+            "recent_activities": sections["recent_activities"]
         })
         
         return {
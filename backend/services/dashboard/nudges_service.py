@@ -102,6 +102,8 @@ def generate_nudges(context: dict) -> List[dict]:
     # 2. Energy & Fuel Check (Sleep + Diet)
     # If late activity detected (low sleep) and no breakfast logged
     try:
+        from services.dashboard.activity_tracker import activity_buffer
+        activity_buffer.flush()
         conn = get_db_connection()
         cursor = conn.cursor()
         # Check last activity before 6 AM today
@@ -1,86 +1,279 @@
+"""Lifestyle risk engine.
+
+Per-day series (stress moods, mood valence, spending, net cash flow,
+calories, habit completion) are loaded with one GROUP BY per table into a
+single NumPy matrix. EWMA levels, rolling z-scores against a 28-day
+baseline and least-squares trend slopes are then computed for every series
+in one vectorized pass, and each risk dimension turns them into a score and
+a forecast (days until burnout risk turns high, days until savings run out).
+A request loads the series and computes these stats once (load_risk_inputs)
+and hands them to every risk dimension.
+"""
+import os
+import time
+from datetime import date, timedelta
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
 from fastapi import APIRouter
+
 from database import get_db_connection
-from datetime import datetime, timedelta
+from services.emotional import mood_store
 
 router = APIRouter()
 
-def calculate_burnout_risk():
-    """Calculate burnout risk based on mood logs and activity."""
-    # Simplified logic: Count negative mood logs in last 7 days
+HISTORY_DAYS = int(os.getenv("RISK_HISTORY_DAYS", "365"))
+EWMA_SPAN_DAYS = 7
+BASELINE_DAYS = 28
+TREND_DAYS = 14
+CALORIE_TARGET = float(os.getenv("RISK_CALORIE_TARGET", "2000"))
+
+SERIES = ("stress", "valence", "expense", "net", "calories", "habit_rate")
+
+
+def load_daily_series(days: int = HISTORY_DAYS, end: Optional[date] = None) -> Dict[str, np.ndarray]:
+    """Daily aggregates for the last `days` days, aligned on one index (oldest first)."""
+    end = end or date.today()
+    start = end - timedelta(days=days - 1)
+    start_iso = start.isoformat()
+    series = {name: np.zeros(days) for name in ("stress", "income", "expense", "completions")}
+    series.update({name: np.full(days, np.nan) for name in ("valence", "calories")})
+
+    def fill(rows, columns):
+        for row in rows:
+            try:
+                pos = (date.fromisoformat(row[0]) - start).days
+            except (TypeError, ValueError):
+                continue
+            if 0 <= pos < days:
+                for name, value in zip(columns, row[1:]):
+                    if value is not None:
+                        series[name][pos] = value
+
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    start_date = (datetime.now() - timedelta(days=7)).isoformat()
-    cursor.execute("""
-        SELECT count(*) as count 
-        FROM activities 
-        WHERE timestamp >= ? AND type = 'mood_log' AND (metadata LIKE '%stress%' OR metadata LIKE '%anxious%' OR metadata LIKE '%tired%')
-    """, (start_date,))
-    
-    stress_count = cursor.fetchone()['count']
+    fill(conn.execute("""
+        SELECT substr(date, 1, 10) AS day,
+               SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END),
+               SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END)
+        FROM transactions WHERE date >= ? GROUP BY day
+    """, (start_iso,)), ("income", "expense"))
+    fill(conn.execute(f"""
+        SELECT substr(timestamp, 1, 10) AS day,
+               SUM(CASE WHEN category IN ({', '.join('?' for _ in mood_store.BURNOUT_CATEGORIES)}) THEN 1 ELSE 0 END),
+               AVG(valence)
+        FROM mood_logs WHERE timestamp >= ? GROUP BY day
+    """, (*mood_store.BURNOUT_CATEGORIES, start_iso)), ("stress", "valence"))
+    fill(conn.execute(
+        "SELECT substr(date, 1, 10) AS day, SUM(calories) FROM meals WHERE date >= ? GROUP BY day", (start_iso,)
+    ), ("calories",))
+    try:
+        fill(conn.execute(
+            "SELECT completed_date, COUNT(*) FROM habit_completions WHERE completed_date >= ? GROUP BY completed_date",
+            (start_iso,)
+        ), ("completions",))
+        active_habits = conn.execute("SELECT COUNT(*) FROM habits WHERE active = 1").fetchone()[0]
+    except Exception:
+        active_habits = 0
+    balance_before = conn.execute(
+        "SELECT COALESCE(SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END), 0) FROM transactions WHERE date < ?",
+        (start_iso,)
+    ).fetchone()[0]
     conn.close()
-    
-    # Risk Score (0-100)
-    # If > 5 stress logs in a week, risk is high
-    risk_score = min(stress_count * 15, 100)
-    
+
+    series["net"] = series["income"] - series["expense"]
+    series["habit_rate"] = series["completions"] / active_habits if active_habits else np.full(days, np.nan)
+    series["balance"] = balance_before + np.cumsum(series["net"])
+    return series
+
+
+def trend_stats(matrix: np.ndarray) -> Dict[str, np.ndarray]:
+    """EWMA, rolling z-score and trend slope for every row of a (series x days) matrix at once.
+
+    ``slope_per_day`` is the least-squares slope of the EWMA over the last
+    TREND_DAYS calendar days, fitted against day offsets and only on days that
+    have data, so gaps neither compress the time axis nor count as flat days.
+    """
+    frame = pd.DataFrame(matrix.T)
+    ewma = frame.ewm(span=EWMA_SPAN_DAYS, ignore_na=True).mean()
+    # Baseline excludes the current day so today's spike is measured against the past
+    rolling = frame.rolling(BASELINE_DAYS, min_periods=7)
+    baseline_mean, baseline_std = rolling.mean().shift(1), rolling.std().shift(1)
+    zscore = ((ewma - baseline_mean) / baseline_std.replace(0, np.nan)).to_numpy().T
+
+    recent = ewma.to_numpy().T[:, -TREND_DAYS:]
+    t = np.arange(recent.shape[1], dtype=float)
+    # The EWMA carries its last value through missing days; fit only the days with data
+    mask = ~np.isnan(recent) & ~np.isnan(matrix[:, -TREND_DAYS:])
+    counts = mask.sum(axis=1)
+    t_mean = np.where(counts > 0, (t * mask).sum(axis=1) / np.maximum(counts, 1), 0)
+    y_mean = np.where(counts > 0, np.where(mask, recent, 0).sum(axis=1) / np.maximum(counts, 1), 0)
+    tc = (t - t_mean[:, None]) * mask
+    yc = np.where(mask, recent - y_mean[:, None], 0)
+    denom = (tc ** 2).sum(axis=1)
+    slope = np.where((counts >= 3) & (denom > 0), (tc * yc).sum(axis=1) / np.where(denom > 0, denom, 1), 0.0)
+
     return {
-        "score": risk_score,
-        "level": "High" if risk_score > 70 else "Medium" if risk_score > 30 else "Low",
-        "prediction": "Risk of burnout in 2 weeks if stress continues." if risk_score > 70 else "Stable."
+        "ewma": ewma.to_numpy().T[:, -1],
+        "zscore": zscore[:, -1],
+        "slope_per_day": slope
     }
 
-def calculate_financial_risk():
-    """Calculate financial vulnerability."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get last 30 days income vs expense
-    start_date = (datetime.now() - timedelta(days=30)).isoformat()
-    
-    cursor.execute("SELECT sum(amount) as total FROM transactions WHERE date >= ? AND type = 'income'", (start_date,))
-    income = cursor.fetchone()['total'] or 0
-    
-    cursor.execute("SELECT sum(amount) as total FROM transactions WHERE date >= ? AND type = 'expense'", (start_date,))
-    expenses = cursor.fetchone()['total'] or 0
-    
-    conn.close()
-    
-    if income == 0:
-        return {"score": 50, "level": "Unknown", "prediction": "No income data."}
-        
-    savings_rate = ((income - expenses) / income) * 100
-    
-    # Risk Score: Lower savings rate = Higher risk
-    if savings_rate < 0:
-        risk_score = 90
-    elif savings_rate < 10:
-        risk_score = 60
-    elif savings_rate < 20:
-        risk_score = 30
+
+def _level(score: float, high: int = 70, medium: int = 30) -> str:
+    return "High" if score > high else "Medium" if score > medium else "Low"
+
+
+def _clean(value: float, digits: int = 3) -> Optional[float]:
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def _trend(stats: Dict[str, np.ndarray], row: int) -> Dict:
+    slope = stats["slope_per_day"][row]
+    return {
+        "ewma": _clean(stats["ewma"][row]),
+        "zscore": _clean(stats["zscore"][row], 2),
+        "slope_per_week": _clean(slope * 7),
+        "direction": "rising" if slope > 1e-6 else "falling" if slope < -1e-6 else "flat"
+    }
+
+
+def burnout_risk(series: Dict[str, np.ndarray], stats: Dict[str, np.ndarray]) -> Dict:
+    """Stress moods per week (EWMA), adjusted by mood valence and how unusual the current level is."""
+    row = SERIES.index("stress")
+    weekly_stress = stats["ewma"][row] * 7
+    score = min(weekly_stress * 15, 100)
+    valence = stats["ewma"][SERIES.index("valence")]
+    if not np.isnan(valence):
+        score += -valence * 15
+    zscore = stats["zscore"][row]
+    if not np.isnan(zscore):
+        score += np.clip(zscore * 5, -10, 10)
+    score = float(np.clip(score, 0, 100))
+
+    # Score points per day: stress moods/day slope, scaled like weekly_stress above
+    score_per_day = stats["slope_per_day"][row] * 7 * 15
+    if score > 70:
+        prediction = "Burnout risk is high now; schedule recovery time this week."
+    elif score_per_day > 0.1:
+        days = int(np.ceil((70 - score) / score_per_day))
+        prediction = f"Burnout risk turns high in about {days} days if stress keeps rising."
+    else:
+        prediction = "Stable." if score_per_day >= -0.1 else "Improving: stress is trending down."
+
+    return {
+        "score": round(score),
+        "level": _level(score),
+        "prediction": prediction,
+        "trend": _trend(stats, row)
+    }
+
+
+def financial_risk(series: Dict[str, np.ndarray], stats: Dict[str, np.ndarray]) -> Dict:
+    """Savings rate over 30 days plus spending anomalies and a savings-depletion forecast."""
+    income = series["income"][-30:].sum()
+    expenses = series["expense"][-30:].sum()
+    if income == 0 and expenses == 0:
+        return {"score": 50, "level": "Unknown", "prediction": "No income data.", "trend": _trend(stats, SERIES.index("expense"))}
+
+    savings_rate = ((income - expenses) / income) * 100 if income else -100.0
+    # Continuous version of the old bands: 0% -> 90, 10% -> 50, 20%+ -> 10
+    score = float(np.clip(90 - savings_rate * 4, 10, 90))
+    expense_z = stats["zscore"][SERIES.index("expense")]
+    if not np.isnan(expense_z):
+        score = float(np.clip(score + np.clip(expense_z * 5, 0, 10), 0, 100))
+
+    balance = series["balance"][-1]
+    daily_net = stats["ewma"][SERIES.index("net")]
+    depletion_days = None
+    if daily_net < 0 and balance > 0:
+        depletion_days = int(balance / -daily_net)
+        prediction = f"Savings depleted in about {depletion_days} days at the current burn rate."
+    elif balance <= 0 and daily_net < 0:
+        prediction = "Spending exceeds income and there are no savings left to cover it."
+    else:
+        prediction = "Financial health is stable."
+
+    return {
+        "score": round(score),
+        "level": "Critical" if score > 80 else "Moderate" if score > 40 else "Low",
+        "prediction": prediction,
+        "savings_rate": round(savings_rate, 1),
+        "depletion_days": depletion_days,
+        "trend": _trend(stats, SERIES.index("expense"))
+    }
+
+
+def health_risk(series: Dict[str, np.ndarray], stats: Dict[str, np.ndarray]) -> Dict:
+    """Calorie intake drift from target and habit completion trend."""
+    calories = stats["ewma"][SERIES.index("calories")]
+    habit_rate = stats["ewma"][SERIES.index("habit_rate")]
+    if np.isnan(calories) and np.isnan(habit_rate):
+        return {"score": 20, "level": "Low", "prediction": "Not enough meal or habit data yet."}
+
+    parts = []
+    if not np.isnan(calories):
+        parts.append(min(abs(calories - CALORIE_TARGET) / CALORIE_TARGET * 200, 100))
+    if not np.isnan(habit_rate):
+        parts.append((1 - min(habit_rate, 1)) * 100)
+    score = float(np.mean(parts))
+
+    habit_slope = stats["slope_per_day"][SERIES.index("habit_rate")]
+    if not np.isnan(calories) and abs(calories - CALORIE_TARGET) > 0.25 * CALORIE_TARGET:
+        prediction = f"Average intake ~{int(calories)} kcal/day is far from the {int(CALORIE_TARGET)} kcal target."
+    elif habit_slope < -0.01:
+        prediction = "Habit completion is slipping; expect energy to dip if it continues."
     else:
-        risk_score = 10
-        
+        prediction = "Stable based on recent activity."
+
     return {
-        "score": risk_score,
-        "level": "Critical" if risk_score > 80 else "Moderate" if risk_score > 40 else "Low",
-        "prediction": "Savings depletion in 3 months." if risk_score > 80 else "Financial health is stable."
+        "score": round(score),
+        "level": _level(score),
+        "prediction": prediction,
+        "trend": _trend(stats, SERIES.index("calories"))
     }
 
+
+RiskInputs = Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]
+
+
+def load_risk_inputs(days: int = HISTORY_DAYS) -> RiskInputs:
+    """Daily series and their trend stats, loaded and computed once for all risk dimensions."""
+    series = load_daily_series(days)
+    return series, trend_stats(np.vstack([series[name] for name in SERIES]))
+
+
+def analyze_risks(days: int = HISTORY_DAYS, inputs: Optional[RiskInputs] = None) -> Dict:
+    series, stats = inputs or load_risk_inputs(days)
+    return {
+        "burnout": burnout_risk(series, stats),
+        "financial": financial_risk(series, stats),
+        "health": health_risk(series, stats)
+    }
+
+
+def calculate_burnout_risk(inputs: Optional[RiskInputs] = None):
+    """Calculate burnout risk based on mood logs and activity."""
+    return burnout_risk(*(inputs or load_risk_inputs()))
+
+
+def calculate_financial_risk(inputs: Optional[RiskInputs] = None):
+    """Calculate financial vulnerability."""
+    return financial_risk(*(inputs or load_risk_inputs()))
+
+
 @router.get("/analysis")
-def get_risk_analysis():
+def get_risk_analysis(days: int = HISTORY_DAYS):
     """Get comprehensive lifestyle risk analysis."""
-    burnout = calculate_burnout_risk()
-    financial = calculate_financial_risk()
-    
+    started = time.perf_counter()
+    inputs = load_risk_inputs(max(min(days, 3650), BASELINE_DAYS))
+    risks = analyze_risks(inputs=inputs)
+
     # Overall Risk
-    avg_score = (burnout['score'] + financial['score']) / 2
-    
+    avg_score = np.mean([risk["score"] for risk in risks.values()])
+
     return {
-        "overall_risk_score": round(avg_score),
-        "risks": {
-            "burnout": burnout,
-            "financial": financial,
-            "health": {"score": 20, "level": "Low", "prediction": "Stable based on recent activity."} # Placeholder
-        }
+        "overall_risk_score": round(float(avg_score)),
+        "risks": risks,
+        "computed_in_ms": round((time.perf_counter() - started) * 1000, 1)
     }
@@ -0,0 +1,373 @@
+"""SQLite food catalog store with full-text name search.
+
+Foods live in a plain table with numeric indexes on the macros, mirrored into
+an FTS5 index over name, cuisine and benefit tags. Search does prefix matching
+first and falls back to typo correction against the FTS vocabulary, so a query
+like "panner tika" still finds "Paneer Tikka" without scanning every row.
+"""
+import difflib
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_STORE_PATH = Path(
+    os.getenv("FOOD_CATALOG_DB", Path(__file__).resolve().parents[2] / "food_catalog.db")
+)
+
+# Food rows kept in memory per store-backed catalog; the rest are fetched on demand
+ROW_CACHE_SIZE = int(os.getenv("FOOD_STORE_ROW_CACHE", "512"))
+
+FOOD_COLUMNS = (
+    "name", "calories", "protein", "carbs", "fat", "fiber",
+    "category", "meal_type", "diet_type", "cuisine", "benefits", "warnings"
+)
+
+
+def _tag_text(tags: List[str]) -> str:
+    """Index tags as words ("high_protein" -> "high protein")."""
+    return " ".join(t.replace("_", " ") for t in tags if t and t != "none")
+
+
+class FoodCatalogStore:
+    """Food catalog persisted in SQLite with an FTS5 search index."""
+
+    def __init__(self, path: Path = DEFAULT_STORE_PATH):
+        self.path = Path(path)
+        self._vocab: Optional[Tuple[float, "Vocabulary"]] = None
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_schema(self):
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        # NUMERIC keeps whole numbers as INTEGER, so rows read back with the JSON source's types
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS foods (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                calories NUMERIC DEFAULT 0,
+                protein NUMERIC DEFAULT 0,
+                carbs NUMERIC DEFAULT 0,
+                fat NUMERIC DEFAULT 0,
+                fiber NUMERIC DEFAULT 0,
+                category TEXT,
+                meal_type TEXT,
+                diet_type TEXT,
+                cuisine TEXT,
+                benefits TEXT DEFAULT '[]',
+                warnings TEXT DEFAULT '[]'
+            )
+        """)
+        for column in ("calories", "protein", "carbs", "fat", "diet_type"):
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_foods_{column} ON foods ({column})")
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS health_conditions (
+                condition TEXT PRIMARY KEY,
+                avoid TEXT DEFAULT '[]',
+                recommend TEXT DEFAULT '[]',
+                tips TEXT
+            )
+        """)
+
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS foods_fts USING fts5(
+                name, cuisine, benefits,
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '2 3'
+            )
+        """)
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS foods_vocab USING fts5vocab(foods_fts, 'row')")
+
+        conn.commit()
+        conn.close()
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    @classmethod
+    def rebuild_from_json(cls, json_path: Path, path: Path = DEFAULT_STORE_PATH) -> "FoodCatalogStore":
+        """Build a fresh store next to `path` and atomically replace it.
+
+        Each build gets its own temp file, so concurrent rebuilds never share one.
+        """
+        path = Path(path)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            cls(tmp_path).import_json(json_path)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        return cls(path)
+
+    def import_json(self, json_path: Path) -> int:
+        """Upsert all foods and health conditions from a catalog JSON file in one transaction."""
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return self.import_records(data.get("indian_foods", []), data.get("health_conditions", []))
+
+    def import_records(self, foods: List[Dict], health_conditions: Optional[List[Dict]] = None) -> int:
+        """Upsert foods (and optionally conditions), keeping the FTS index in sync."""
+        self.init_schema()
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            for food in foods:
+                values = [
+                    json.dumps(food.get(col, [])) if col in ("benefits", "warnings") else food.get(col)
+                    for col in FOOD_COLUMNS
+                ]
+                cursor.execute(f"""
+                    INSERT INTO foods ({', '.join(FOOD_COLUMNS)})
+                    VALUES ({', '.join('?' for _ in FOOD_COLUMNS)})
+                    ON CONFLICT(name) DO UPDATE SET
+                    {', '.join(f'{col} = excluded.{col}' for col in FOOD_COLUMNS[1:])}
+                """, values)
+                cursor.execute("SELECT id FROM foods WHERE name = ?", (food["name"],))
+                food_id = cursor.fetchone()["id"]
+
+                cursor.execute("DELETE FROM foods_fts WHERE rowid = ?", (food_id,))
+                cursor.execute(
+                    "INSERT INTO foods_fts (rowid, name, cuisine, benefits) VALUES (?, ?, ?, ?)",
+                    (food_id, food["name"], (food.get("cuisine") or "").replace("_", " "),
+                     _tag_text(food.get("benefits", [])))
+                )
+
+            for entry in health_conditions or []:
+                cursor.execute("""
+                    INSERT OR REPLACE INTO health_conditions (condition, avoid, recommend, tips)
+                    VALUES (?, ?, ?, ?)
+                """, (
+                    entry["condition"],
+                    json.dumps(entry.get("avoid", [])),
+                    json.dumps(entry.get("recommend", [])),
+                    entry.get("tips")
+                ))
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        return len(foods)
+
+    @staticmethod
+    def _row_to_food(row: sqlite3.Row) -> Dict:
+        food = dict(row)
+        food.pop("id", None)
+        food["benefits"] = json.loads(food.get("benefits") or "[]")
+        food["warnings"] = json.loads(food.get("warnings") or "[]")
+        return food
+
+    def iter_foods(self) -> Iterator[Dict]:
+        """Stream every food row; avoids materializing a JSON document."""
+        conn = self.connect()
+        try:
+            cursor = conn.execute(f"SELECT id, {', '.join(FOOD_COLUMNS)} FROM foods ORDER BY id")
+            for row in cursor:
+                yield self._row_to_food(row)
+        finally:
+            conn.close()
+
+    def fetch_foods(self, ids: List[int]) -> Dict[int, Dict]:
+        """Food rows by id."""
+        foods = {}
+        conn = self.connect()
+        try:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT id, {', '.join(FOOD_COLUMNS)} FROM foods WHERE id IN ({', '.join('?' for _ in chunk)})",
+                    chunk
+                )
+                foods.update((row["id"], self._row_to_food(row)) for row in rows)
+        finally:
+            conn.close()
+        return foods
+
+    def get_health_conditions(self) -> List[Dict]:
+        conn = self.connect()
+        rows = conn.execute("SELECT * FROM health_conditions").fetchall()
+        conn.close()
+        return [
+            {
+                "condition": row["condition"],
+                "avoid": json.loads(row["avoid"] or "[]"),
+                "recommend": json.loads(row["recommend"] or "[]"),
+                "tips": row["tips"]
+            }
+            for row in rows
+        ]
+
+    def _vocabulary(self, conn: sqlite3.Connection) -> "Vocabulary":
+        """FTS vocabulary, cached until the store file changes."""
+        mtime = self.path.stat().st_mtime
+        if self._vocab is None or self._vocab[0] != mtime:
+            terms = [row["term"] for row in conn.execute("SELECT term FROM foods_vocab")]
+            self._vocab = (mtime, Vocabulary(terms))
+        return self._vocab[1]
+
+    def _correct_token(self, token: str, vocabulary: "Vocabulary") -> List[str]:
+        """Vocabulary terms within a small edit distance of a misspelled token.
+
+        Tokens that already prefix-match a term are left alone. Only terms with
+        the same first letter and a length within 2 are scored.
+        """
+        if vocabulary.has_prefix(token):
+            return [token]
+        return difflib.get_close_matches(token, vocabulary.candidates(token, 2), n=3, cutoff=0.7)
+
+    def search(self, query: str, limit: int = 20, diet_type: Optional[str] = None,
+               max_calories: Optional[float] = None, min_protein: Optional[float] = None) -> List[Dict]:
+        """Search foods by name, cuisine or benefit; prefix matches first, then typo-corrected matches."""
+        tokens = re.findall(r"\w+", query.lower())
+        if not tokens:
+            return []
+
+        filters = []
+        params: List = []
+        if diet_type:
+            # Same label handling as plan generation ("Vegetarian" -> veg, non-veg also allows veg)
+            from .food_database import FoodDatabase
+            diet_types = FoodDatabase.allowed_diet_types(diet_type)
+            filters.append(f"f.diet_type IN ({', '.join('?' for _ in diet_types)})")
+            params.extend(diet_types)
+        if max_calories is not None:
+            filters.append("f.calories <= ?")
+            params.append(max_calories)
+        if min_protein is not None:
+            filters.append("f.protein >= ?")
+            params.append(min_protein)
+        where = "".join(f" AND {clause}" for clause in filters)
+
+        sql = f"""
+            SELECT f.id, {', '.join(f'f.{col}' for col in FOOD_COLUMNS)}
+            FROM foods_fts
+            JOIN foods f ON f.id = foods_fts.rowid
+            WHERE foods_fts MATCH ?{where}
+            ORDER BY bm25(foods_fts, 10.0, 2.0, 1.0)
+            LIMIT ?
+        """
+
+        conn = self.connect()
+        try:
+            prefix_query = " ".join(f'"{t}"*' for t in tokens)
+            rows = conn.execute(sql, [prefix_query, *params, limit]).fetchall()
+            results = [{**self._row_to_food(row), "match": "prefix"} for row in rows]
+
+            if len(results) < limit:
+                vocabulary = self._vocabulary(conn)
+                groups = []
+                for token in tokens:
+                    options = self._correct_token(token, vocabulary) or [token]
+                    groups.append("(" + " OR ".join(f'"{o}"*' for o in options) + ")")
+                fuzzy_query = " AND ".join(groups)
+                if fuzzy_query != " AND ".join(f'("{t}"*)' for t in tokens):
+                    seen = {r["name"] for r in results}
+                    for row in conn.execute(sql, [fuzzy_query, *params, limit]).fetchall():
+                        if row["name"] not in seen and len(results) < limit:
+                            results.append({**self._row_to_food(row), "match": "fuzzy"})
+        finally:
+            conn.close()
+
+        return results
+
+
+class Vocabulary:
+    """Search terms sorted for prefix checks and bucketed by (first letter, length) for typo candidates."""
+
+    def __init__(self, terms: Iterable[str]):
+        self.terms = sorted(terms)
+        self._buckets: Dict[Tuple[str, int], List[str]] = defaultdict(list)
+        for term in self.terms:
+            self._buckets[(term[0], len(term))].append(term)
+
+    def has_prefix(self, prefix: str) -> bool:
+        i = bisect_left(self.terms, prefix)
+        return i < len(self.terms) and self.terms[i].startswith(prefix)
+
+    def candidates(self, token: str, max_length_diff: int) -> List[str]:
+        return [
+            term
+            for length in range(len(token) - max_length_diff, len(token) + max_length_diff + 1)
+            for term in self._buckets.get((token[0], length), ())
+        ]
+
+
+class StoreFoods(Sequence):
+    """Read-only, position-indexed view of a store's foods table.
+
+    Only the row ids are held in memory; rows are fetched on demand and kept in
+    a bounded LRU cache, so a large catalog does not have to fit in RAM.
+    """
+
+    def __init__(self, store: FoodCatalogStore, cache_size: int = ROW_CACHE_SIZE):
+        self.store = store
+        conn = store.connect()
+        try:
+            self._ids = np.fromiter((row[0] for row in conn.execute("SELECT id FROM foods ORDER BY id")), dtype=np.int64)
+        finally:
+            conn.close()
+        self._cache: "OrderedDict[int, Dict]" = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(range(len(self))[index])
+        return self.take([index])[0]
+
+    def __iter__(self) -> Iterator[Dict]:
+        # One streaming pass; rows are not cached
+        return self.store.iter_foods()
+
+    def take(self, positions: Iterable[int]) -> List[Dict]:
+        """Foods at the given positions, in order."""
+        ids = [int(self._ids[p]) for p in positions]
+        with self._lock:
+            found = {}
+            for food_id in ids:
+                if food_id in self._cache:
+                    self._cache.move_to_end(food_id)
+                    found[food_id] = self._cache[food_id]
+        missing = [food_id for food_id in dict.fromkeys(ids) if food_id not in found]
+        if missing:
+            fetched = self.store.fetch_foods(missing)
+            found.update(fetched)
+            with self._lock:
+                self._cache.update(fetched)
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return [found[food_id] for food_id in ids]
+
+
+if __name__ == "__main__":
+    # Bulk import: python -m services.diet.catalog_store path/to/foods.json [store.db]
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Usage: python -m services.diet.catalog_store <catalog.json> [store.db]")
+        sys.exit(1)
+    store = FoodCatalogStore(Path(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_STORE_PATH)
+    count = store.import_json(Path(sys.argv[1]))
+    print(f"Imported {count} foods into {store.path}")
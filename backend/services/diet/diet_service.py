@@ -1,11 +1,14 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 import chromadb
 import os
 from dotenv import load_dotenv
-from .food_database import FoodDatabase, MealPlanner
-from services.gamification.gamification_service import grant_xp
+from typing import List, Optional
+from .food_catalog import food_catalog
+from prompt_context import ContextBuilder
+from database import get_db_connection
+import outbox
 
 load_dotenv()
 
@@ -25,20 +28,9 @@ def get_llm():
         api_key=api_key
     )
 
-# Initialize food database and meal planner lazily
-_food_db = None
-_meal_planner = None
-
 def get_meal_planner():
-    global _food_db, _meal_planner
-    if _meal_planner is None:
-        try:
-            _food_db = FoodDatabase()
-            _meal_planner = MealPlanner(_food_db)
-        except Exception as e:
-            print(f"Warning: Could not load food database: {e}")
-            return None
-    return _meal_planner
+    """Meal planner backed by the shared, hot-reloadable food catalog."""
+    return food_catalog.get_planner()
 
 
 def get_diet_rag_response(query: str, diet_type: str = "veg", health_conditions: list = None):
@@ -59,27 +51,33 @@ def get_diet_rag_response(query: str, diet_type: str = "veg", health_conditions:
             n_results=5
         )
         
-        # Extract context
-        context = "\n\n".join(results["documents"][0]) if results["documents"] else "No relevant data found."
+        documents = results["documents"][0] if results["documents"] else []
         
         # Create prompt template
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an expert Indian dietitian. Use the provided nutrition data to give personalized diet advice.
-            Be specific about food items, portions, and timing. Consider the user's diet type and health conditions."""),
-            ("user", """Context from nutrition database:
+        system_text = """You are an expert Indian dietitian. Use the provided nutrition data to give personalized diet advice.
+            Be specific about food items, portions, and timing. Consider the user's diet type and health conditions."""
+        user_text = """Context from nutrition database:
 {context}
 
 User Query: {query}
 Diet Type: {diet_type}
 Health Conditions: {health_conditions}
 
-Provide a detailed, actionable diet plan or recommendation.""")
-        ])
+Provide a detailed, actionable diet plan or recommendation."""
+        prompt = ChatPromptTemplate.from_messages([("system", system_text), ("user", user_text)])
         
         # Generate response
         llm = get_llm()
         if not llm:
             raise ValueError("LLM not initialized")
+
+        # Retrieved docs arrive ranked; lowest-ranked ones are dropped first
+        sections = ContextBuilder("diet_rag") \
+            .reserve(system_text + user_text + query + " ".join(health_conditions or [])) \
+            .add_items("context", documents) \
+            .build()
+        context = sections["context"] or "No relevant data found."
+
         chain = prompt | llm
         response = chain.invoke({
             "context": context,
@@ -91,7 +89,7 @@ Provide a detailed, actionable diet plan or recommendation.""")
         return {
             "response": response.content,
             "sources": results["metadatas"][0] if results["metadatas"] else [],
-            "retrieved_docs": len(results["documents"][0]) if results["documents"] else 0
+            "retrieved_docs": len(documents)
         }
         
     except Exception as e:
@@ -121,13 +119,16 @@ def get_rag_diet_plan(
 
 
 @router.get("/plan")
-def get_diet_plan(calories: int = 2000, type: str = "veg"):
-    """Get a comprehensive diet plan using the Indian foods database."""
+def get_diet_plan(calories: int = 2000, type: str = "veg", conditions: Optional[List[str]] = Query(None)):
+    """Get a comprehensive diet plan using the Indian foods database.
+    
+    `conditions` (e.g. diabetes, high_bp) filters out foods to avoid without an LLM call.
+    """
     try:
         # Use the meal planner if available
         meal_planner = get_meal_planner()
         if meal_planner:
-            plan = meal_planner.generate_plan(calories, type)
+            plan = meal_planner.generate_plan(calories, type, conditions)
             return plan
         else:
             # Fallback if database failed to load
@@ -143,10 +144,70 @@ def get_diet_plan(calories: int = 2000, type: str = "veg"):
                     {"name": "Vegetable Curry with Roti", "calories": int(calories * 0.30), "protein": 20},
                 ]
             }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating plan: {str(e)}")
 
 
+@router.get("/catalog")
+def get_catalog_status():
+    """Food catalog version and size; the version changes whenever the catalog is reloaded."""
+    return food_catalog.status()
+
+
+@router.post("/catalog/reload")
+def reload_catalog():
+    """Force a catalog reload from disk (normally picked up automatically on file change)."""
+    if not food_catalog.reload():
+        raise HTTPException(status_code=500, detail=f"Catalog reload failed: {food_catalog.last_error}")
+    return food_catalog.status()
+
+
+@router.get("/foods/search")
+def search_foods(q: str, limit: int = 20, diet_type: Optional[str] = None,
+                 max_calories: Optional[float] = None, min_protein: Optional[float] = None):
+    """Search the food catalog by name, cuisine or benefit (prefix and typo tolerant)."""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q must not be empty")
+    
+    store = food_catalog.get_store()
+    if not store:
+        raise HTTPException(status_code=503, detail="Food catalog unavailable")
+    
+    results = store.search(q, min(max(limit, 1), 100), diet_type, max_calories, min_protein)
+    return {
+        "query": q,
+        "results": results,
+        "count": len(results),
+        "catalog_version": food_catalog.version
+    }
+
+
+MAX_BATCH_DAYS = 31
+
+@router.get("/plan/batch")
+def get_diet_plan_batch(days: int = 7, calories: int = 2000, type: str = "veg", variety_window: int = 3,
+                        conditions: Optional[List[str]] = Query(None)):
+    """Generate a multi-day plan in one call, without repeating mains within `variety_window` days."""
+    if not 1 <= days <= MAX_BATCH_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {MAX_BATCH_DAYS}")
+    if variety_window < 0:
+        raise HTTPException(status_code=400, detail="variety_window must be non-negative")
+    
+    meal_planner = get_meal_planner()
+    if not meal_planner:
+        raise HTTPException(status_code=503, detail="Food database unavailable")
+    
+    try:
+        batch = meal_planner.generate_batch(days, calories, type, variety_window, conditions)
+        return {**batch, "catalog_version": food_catalog.version}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating batch plan: {str(e)}")
+
+
 # Meal logging
 from pydantic import BaseModel
 from typing import Optional
@@ -168,9 +229,32 @@ _logged_meals = []
 def log_meal(meal: MealLog):
     """Log a consumed meal for tracking."""
     try:
-        # Store the meal
+        logged_at = datetime.now().isoformat()
+        
+        # Store the meal and its side effects (XP, activity feed, achievements) in one commit
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO meals (name, calories, protein, carbs, fat, date) VALUES (?, ?, ?, ?, ?, ?)",
+            (meal.food_name, meal.calories, meal.protein, meal.carbs, meal.fat, logged_at)
+        )
+        meal_id = cursor.lastrowid
+        outbox.record(
+            cursor, "meal_logged",
+            event={"calories": meal.calories, "meal_type": meal.meal_type},
+            xp={"amount": 15, "source": "meal_logged", "reason": f"Logged {meal.food_name}"},  # Award 15 XP for logging a meal
+            activity={
+                "type": "meal_logged",
+                "description": f"Logged {meal.food_name} ({meal.calories} cal)",
+                "metadata": {"calories": meal.calories, "meal_type": meal.meal_type}
+            }
+        )
+        conn.commit()
+        conn.close()
+        outbox.notify()
+        
         logged = {
-            "id": len(_logged_meals) + 1,
+            "id": meal_id,
             "food_name": meal.food_name,
             "calories": meal.calories,
             "protein": meal.protein,
@@ -178,28 +262,10 @@ def log_meal(meal: MealLog):
             "fat": meal.fat,
             "health_score": meal.health_score,
             "meal_type": meal.meal_type,
-            "logged_at": datetime.now().isoformat()
+            "logged_at": logged_at
         }
         
         _logged_meals.append(logged)
-
-        # Log activity for dashboard
-        try:
-            from services.dashboard.activity_tracker import log_activity
-            log_activity(
-                "meal_logged",
-                f"Logged {meal.food_name} ({meal.calories} cal)",
-                {"calories": meal.calories, "meal_type": meal.meal_type}
-            )
-        except Exception:
-            pass  # Activity logging is optional
-
-        # Gamification Trigger
-        try:
-            grant_xp(1, 15)  # Award 15 XP for logging a meal
-            print(f"🥗 XP Awarded for Meal: {meal.food_name}")
-        except Exception as e:
-            print(f"⚠️ Failed to award XP for meal: {e}")
         
         return {
             "success": True,
@@ -0,0 +1,135 @@
+"""Shared, hot-reloadable food catalog.
+
+One process-wide FoodDatabase/MealPlanner pair serves the diet API and the
+orchestrator. The source file's mtime is checked at most every
+``FOOD_CATALOG_CHECK_SECONDS``; when it changes, a new database and its
+indexes are built off to the side and swapped in with a single reference
+assignment, so readers never see a half-built catalog. ``version`` is
+bumped on every swap so callers can key caches on it.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from .catalog_store import DEFAULT_STORE_PATH, FoodCatalogStore
+from .food_database import FoodDatabase, MealPlanner
+
+CHECK_INTERVAL_SECONDS = float(os.getenv("FOOD_CATALOG_CHECK_SECONDS", "5"))
+
+
+class FoodCatalog:
+    """Process-wide food catalog with mtime-based reload and atomic swap."""
+    
+    def __init__(self, path: Optional[Path] = None, check_interval: float = CHECK_INTERVAL_SECONDS):
+        self._path = Path(path) if path else None
+        self.check_interval = check_interval
+        self._snapshot: Optional[Tuple[FoodDatabase, MealPlanner]] = None
+        self._mtime: Optional[float] = None
+        self._last_check = 0.0
+        self._reload_lock = threading.Lock()
+        self.version = 0
+        self.loaded_at: Optional[str] = None
+        self.last_error: Optional[str] = None
+        # Derived search store for a JSON catalog, tied to the database it was built for
+        self._store: Optional[Tuple[FoodDatabase, FoodCatalogStore]] = None
+    
+    @property
+    def path(self) -> Path:
+        if self._path is None:
+            env_path = os.getenv("FOOD_DB_PATH")
+            self._path = Path(env_path) if env_path else FoodDatabase.find_database_path()
+        return self._path
+    
+    def _maybe_reload(self):
+        """Reload if the source file changed since the last load (throttled)."""
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        try:
+            mtime = self.path.stat().st_mtime
+        except OSError as e:
+            self.last_error = str(e)
+            return
+        if self._snapshot is None or mtime != self._mtime:
+            self.reload(mtime, only_if_changed=True)
+    
+    def reload(self, mtime: Optional[float] = None, only_if_changed: bool = False) -> bool:
+        """Build a fresh database from disk and swap it in; keeps the old one on failure.
+        
+        This is the only place ``version`` changes. With only_if_changed, a
+        reload that another thread already did for this mtime is skipped.
+        """
+        with self._reload_lock:
+            if only_if_changed and self._snapshot is not None and mtime == self._mtime:
+                return True
+            try:
+                if mtime is None:
+                    mtime = self.path.stat().st_mtime
+                food_db = FoodDatabase(self.path)
+                snapshot = (food_db, MealPlanner(food_db))
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Warning: Could not load food database: {e}")
+                return False
+            
+            # Single reference assignment: readers see either the old or the new catalog
+            self._snapshot = snapshot
+            self._mtime = mtime
+            self.version += 1
+            self.loaded_at = datetime.now().isoformat()
+            self.last_error = None
+            return True
+    
+    def get_database(self) -> Optional[FoodDatabase]:
+        self._maybe_reload()
+        return self._snapshot[0] if self._snapshot else None
+    
+    def get_planner(self) -> Optional[MealPlanner]:
+        self._maybe_reload()
+        return self._snapshot[1] if self._snapshot else None
+    
+    def get_store(self) -> Optional[FoodCatalogStore]:
+        """SQLite search store for the current catalog version.
+        
+        When the catalog is a .db store, the loaded database's own store is used
+        (one instance per version, so its vocabulary cache survives between
+        searches); when it is JSON, a derived store is rebuilt whenever the JSON
+        is newer than it. The rebuild runs outside the reload lock and replaces
+        the store file atomically, so reloads and searches never wait on it.
+        """
+        food_db = self.get_database()
+        if food_db is None:
+            return None
+        if food_db.store is not None:
+            return food_db.store
+        
+        current = self._store
+        if current is not None and current[0] is food_db:
+            return current[1]
+        
+        source_mtime = self._mtime or 0
+        store = FoodCatalogStore(DEFAULT_STORE_PATH)
+        if not store.exists() or store.path.stat().st_mtime < source_mtime:
+            store = FoodCatalogStore.rebuild_from_json(self.path, DEFAULT_STORE_PATH)
+        # Single reference assignment, like the catalog snapshot itself
+        self._store = (food_db, store)
+        return store
+    
+    def status(self) -> Dict:
+        food_db = self.get_database()
+        return {
+            "version": self.version,
+            "path": str(self._path) if self._path else None,
+            "foods": len(food_db.foods) if food_db else 0,
+            "health_conditions": len(food_db.health_conditions) if food_db else 0,
+            "loaded_at": self.loaded_at,
+            "last_error": self.last_error
+        }
+
+
+# Global instance
+food_catalog = FoodCatalog()
@@ -1,22 +1,46 @@
 """Food database loader and meal selection utilities for diet planning."""
+import difflib
 import json
 import random
+import re
+import numpy as np
+from collections import defaultdict
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Sequence
+from .catalog_store import FoodCatalogStore, StoreFoods
+
+STORE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+
+# backend/services/diet/food_database.py -> <repo>/data/
+DEFAULT_DATABASE_PATH = Path(__file__).resolve().parents[3] / "data" / "indian_foods_expanded.json"
 
 
 class FoodDatabase:
     """Load and manage Indian food database."""
     
-    def __init__(self):
-        self.foods = []
+    MEAL_TIMES = ('breakfast', 'lunch', 'snack', 'dinner')
+    
+    # For vegan, only vegan foods; for non-veg, both veg and non-veg; for veg, only veg
+    ALLOWED_DIET_TYPES = {
+        'veg': ('veg',),
+        'non_veg': ('veg', 'non_veg'),
+        'vegan': ('vegan',),
+    }
+
+    def __init__(self, path: Optional[Path] = None):
+        self.foods: Sequence[Dict] = []
         self.health_conditions = []
+        self.store: Optional[FoodCatalogStore] = None
+        self.source_path = path or self.find_database_path()
         self._load_database()
+        self._build_indexes()
     
-    def _load_database(self):
-        """Load the Indian foods JSON database."""
+    @staticmethod
+    def find_database_path() -> Path:
+        """Locate indian_foods_expanded.json, independent of the working directory if possible."""
         # Try multiple possible paths
         possible_paths = [
+            DEFAULT_DATABASE_PATH,
             Path("../data/indian_foods_expanded.json"),
             Path("../../data/indian_foods_expanded.json"),
             Path("data/indian_foods_expanded.json"),
@@ -24,16 +48,178 @@ class FoodDatabase:
         
         for path in possible_paths:
             if path.exists():
-                with open(path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.foods = data.get('indian_foods', [])
-                    self.health_conditions = data.get('health_conditions', [])
-                return
+                return path
         
         raise FileNotFoundError("Could not find indian_foods_expanded.json")
     
-    def filter_by_diet_type(self, diet_type: str) -> List[Dict]:
-        """Filter foods by diet type (veg/non-veg/vegan)."""
+    def _load_database(self):
+        """Load the Indian foods database from JSON or, for .db paths, open a lazy view of the SQLite store."""
+        if Path(self.source_path).suffix in STORE_SUFFIXES:
+            self.store = FoodCatalogStore(self.source_path)
+            self.foods = StoreFoods(self.store)
+            self.health_conditions = self.store.get_health_conditions()
+            return
+        
+        with open(self.source_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+            self.foods = data.get('indian_foods', [])
+            self.health_conditions = data.get('health_conditions', [])
+    
+    def _build_indexes(self):
+        """Precompute boolean masks over the catalog so plan generation never rescans it.
+        
+        Diet types, meal times and health conditions each get one mask per key;
+        a selection is the AND of the relevant masks; its positions are cached.
+        """
+        n = len(self.foods)
+        
+        # One pass over the catalog (a stream for store-backed catalogs), keeping only the indexed fields
+        diet_types, meal_types, names, tags = [], [], [], []
+        for f in self.foods:
+            diet_types.append(f.get('diet_type'))
+            meal_types.append(f.get('meal_type') or '')
+            names.append(f.get('name', ''))
+            tags.append({t.lower() for t in f.get('benefits', []) + f.get('warnings', [])})
+        
+        self._diet_masks = {
+            diet: np.fromiter((d in types for d in diet_types), dtype=bool, count=n)
+            for diet, types in self.ALLOWED_DIET_TYPES.items()
+        }
+        # Handle underscore-separated meal types like "lunch_dinner"
+        self._meal_time_masks = {
+            meal_time: np.fromiter(
+                (meal_time in m or m == 'any' for m in meal_types),
+                dtype=bool, count=n
+            )
+            for meal_time in self.MEAL_TIMES
+        }
+        
+        # Condition avoid/recommend lists mix item names ("Rice (White, Cooked)")
+        # with tags ("high_glycemic_index"); resolve both against every food.
+        # Names match with or without their serving note ("Brown Rice" ~ "Brown Rice (Cooked)").
+        self._names = names
+        lower_names = [name.lower() for name in names]
+        base_names = [name.split(' (')[0] for name in lower_names]
+        
+        def resolve(terms: List[str]) -> np.ndarray:
+            terms = {t.lower() for t in terms}
+            return np.fromiter(
+                (name in terms or base in terms or not terms.isdisjoint(food_tags)
+                 for name, base, food_tags in zip(lower_names, base_names, tags)),
+                dtype=bool, count=n
+            )
+        
+        self._condition_masks = {}
+        self._condition_tips = {}
+        for entry in self.health_conditions:
+            condition = self.normalize_condition(entry['condition'])
+            self._condition_masks[condition] = {
+                'deny': resolve(entry.get('avoid', [])),
+                'recommend': resolve(entry.get('recommend', [])),
+            }
+            self._condition_tips[condition] = entry.get('tips', '')
+        
+        # Selection key -> catalog positions; rows are materialized per call
+        self._selection_cache = {}
+        
+        # Normalized name -> catalog position, for fuzzy lookups of free-text dish names,
+        # plus the names bucketed by (first letter, length) so fuzzy scoring sees only plausible candidates
+        self._name_lookup = {}
+        self._name_buckets = defaultdict(list)
+        for position, name in enumerate(names):
+            key = self.normalize_name(name)
+            if key and key not in self._name_lookup:
+                self._name_lookup[key] = position
+                self._name_buckets[(key[0], len(key))].append(key)
+    
+    def _take(self, positions) -> List[Dict]:
+        if isinstance(self.foods, StoreFoods):
+            return self.foods.take(positions)
+        return [self.foods[i] for i in positions]
+    
+    @staticmethod
+    def normalize_name(name: str) -> str:
+        """Lowercase, drop serving notes in parentheses and punctuation ("Dosa (Plain)" -> "dosa")."""
+        name = re.sub(r'\(.*?\)', ' ', name.lower())
+        return ' '.join(re.findall(r'[a-z0-9]+', name))
+    
+    def match_food(self, name: str, cutoff: float = 0.8) -> Optional[Dict]:
+        """Find the catalog food best matching a free-text dish name, or None.
+        
+        Tries an exact normalized match, then the longest catalog name contained
+        in the text ("paneer butter masala with naan"), then difflib similarity
+        against names with the same first letter and a compatible length.
+        """
+        key = self.normalize_name(name or '')
+        if not key:
+            return None
+        if key in self._name_lookup:
+            return self.foods[self._name_lookup[key]]
+        
+        # A contained name must cover most of the text, so "fried rice" doesn't become plain rice.
+        # Candidates are the text's word runs, each one dict lookup.
+        words = key.split()
+        runs = (' '.join(words[i:j]) for i in range(len(words)) for j in range(i + 1, len(words) + 1))
+        contained = [k for k in runs if k in self._name_lookup and len(k) >= 0.6 * len(key)]
+        if contained:
+            return self.foods[self._name_lookup[max(contained, key=len)]]
+        
+        # difflib's ratio is at most 2 * shorter / (a + b), which bounds the lengths worth scoring
+        low, high = int(len(key) * cutoff / (2 - cutoff)), int(len(key) * (2 - cutoff) / cutoff)
+        candidates = [k for length in range(low, high + 1) for k in self._name_buckets.get((key[0], length), ())]
+        close = difflib.get_close_matches(key, candidates, n=1, cutoff=cutoff)
+        return self.foods[self._name_lookup[close[0]]] if close else None
+    
+    @staticmethod
+    def normalize_condition(condition: str) -> str:
+        """Normalize a health condition label ("High BP" -> "high_bp")."""
+        return condition.strip().lower().replace('-', '_').replace(' ', '_')
+    
+    def resolve_conditions(self, conditions: Optional[List[str]]) -> tuple:
+        """Normalize and validate condition labels; raises ValueError for unknown ones."""
+        resolved = tuple(sorted({self.normalize_condition(c) for c in conditions or [] if c.strip()}))
+        unknown = [c for c in resolved if c not in self._condition_masks]
+        if unknown:
+            raise ValueError(
+                f"Unknown health condition(s): {', '.join(unknown)}. "
+                f"Known: {', '.join(sorted(self._condition_masks))}"
+            )
+        return resolved
+    
+    def _condition_mask(self, conditions: tuple, kind: str) -> np.ndarray:
+        """OR together the deny or recommend masks of the given conditions."""
+        mask = np.zeros(len(self.foods), dtype=bool)
+        for condition in conditions:
+            mask |= self._condition_masks[condition][kind]
+        return mask
+    
+    def _select(self, diet_type: str, meal_time: Optional[str] = None, conditions: Optional[List[str]] = None) -> List[Dict]:
+        """Foods matching a diet type, optional meal time and health conditions."""
+        key = (self.normalize_diet_type(diet_type), meal_time, self.resolve_conditions(conditions))
+        if key not in self._selection_cache:
+            diet, meal_time, conditions = key
+            mask = self._diet_masks[diet]
+            if meal_time:
+                mask = mask & self._meal_time_masks.get(meal_time, np.zeros(len(self.foods), dtype=bool))
+            if conditions:
+                mask = mask & ~self._condition_mask(conditions, 'deny')
+            self._selection_cache[key] = np.flatnonzero(mask)
+        return self._take(self._selection_cache[key])
+    
+    def recommended_names(self, conditions: Optional[List[str]]) -> set:
+        """Names of foods recommended for any of the given conditions."""
+        resolved = self.resolve_conditions(conditions)
+        if not resolved:
+            return set()
+        return {self._names[i] for i in np.flatnonzero(self._condition_mask(resolved, 'recommend'))}
+    
+    def condition_tips(self, conditions: Optional[List[str]]) -> Dict[str, str]:
+        """Dietary tips for each of the given conditions."""
+        return {c: self._condition_tips[c] for c in self.resolve_conditions(conditions)}
+    
+    @staticmethod
+    def normalize_diet_type(diet_type: str) -> str:
+        """Map user-facing diet labels onto the catalog's diet_type values."""
         diet_map = {
             'veg': 'veg',
             'non-veg': 'non_veg',
@@ -41,18 +227,20 @@ class FoodDatabase:
             'vegetarian': 'veg',
             'non_vegetarian': 'non_veg'
         }
-        target_diet = diet_map.get(diet_type.lower(), 'veg')
-        
-        # For vegan, only return vegan foods
-        if target_diet == 'vegan':
-            return [f for f in self.foods if f.get('diet_type') == 'vegan']
-        
-        # For non-veg, return both veg and non-veg
-        if target_diet == 'non_veg':
-            return [f for f in self.foods if f.get('diet_type') in ['veg', 'non_veg']]
-        
-        # For veg, only return veg
-        return [f for f in self.foods if f.get('diet_type') == 'veg']
+        return diet_map.get(diet_type.lower(), 'veg')
+    
+    @classmethod
+    def allowed_diet_types(cls, diet_type: str) -> tuple:
+        """Catalog diet_type values a user-facing diet label may eat."""
+        return cls.ALLOWED_DIET_TYPES[cls.normalize_diet_type(diet_type)]
+    
+    def filter_by_diet_type(self, diet_type: str, conditions: Optional[List[str]] = None) -> List[Dict]:
+        """Filter foods by diet type (veg/non-veg/vegan), excluding foods to avoid for any condition."""
+        return self._select(diet_type, None, conditions)
+    
+    def foods_for(self, diet_type: str, meal_time: str, conditions: Optional[List[str]] = None) -> List[Dict]:
+        """Precomputed foods for a diet type and meal time."""
+        return self._select(diet_type, meal_time, conditions)
     
     def filter_by_meal_time(self, foods: List[Dict], meal_time: str) -> List[Dict]:
         """Filter foods suitable for a specific meal time."""
@@ -68,79 +256,131 @@ class FoodDatabase:
 class MealPlanner:
     """Generate balanced meal plans."""
     
+    # (meal_time, share of daily calories, label)
+    MEAL_SLOTS = [
+        ('breakfast', 0.25, 'Breakfast'),
+        ('lunch', 0.35, 'Lunch'),
+        ('snack', 0.10, 'Snack'),
+        ('dinner', 0.30, 'Dinner'),
+    ]
+    
     def __init__(self, food_db: FoodDatabase):
         self.food_db = food_db
     
-    def generate_plan(self, calories: int, diet_type: str) -> Dict:
-        """Generate a complete meal plan based on calorie target and diet type."""
+    def generate_plan(self, calories: int, diet_type: str, health_conditions: Optional[List[str]] = None) -> Dict:
+        """Generate a complete meal plan based on calorie target, diet type and health conditions.
+        
+        Foods a condition says to avoid are masked out; foods it recommends are
+        favoured when picking. Raises ValueError for unknown conditions.
+        """
         # Filter foods by diet type
-        available_foods = self.food_db.filter_by_diet_type(diet_type)
+        available_foods = self.food_db.filter_by_diet_type(diet_type, health_conditions)
         
         if not available_foods:
             return self._fallback_plan(calories, diet_type)
         
-        # Target calorie distribution
-        breakfast_cal = int(calories * 0.25)  # 25%
-        lunch_cal = int(calories * 0.35)      # 35%
-        snack_cal = int(calories * 0.10)      # 10%
-        dinner_cal = int(calories * 0.30)     # 30%
+        meals, _ = self._compose_day(available_foods, calories, diet_type, health_conditions=health_conditions)
         
-        # Generate meals with multiple food items
+        plan = {
+            'plan_name': f"Custom {calories} Cal {diet_type.title()} Plan",
+            **self._totals(meals),
+            'meals': meals
+        }
+        if health_conditions:
+            plan['health_conditions'] = self.food_db.condition_tips(health_conditions)
+        return plan
+    
+    def generate_batch(self, days: int, calories: int, diet_type: str, variety_window: int = 3,
+                       health_conditions: Optional[List[str]] = None) -> Dict:
+        """Generate a multi-day plan in one pass.
+        
+        A main course used on one day is not repeated within the next
+        ``variety_window`` days; if the catalog is too small to honour that,
+        the constraint is relaxed for the affected meal. Output is compact:
+        item names and totals only.
+        """
+        available_foods = self.food_db.filter_by_diet_type(diet_type, health_conditions)
+        
+        plan_days = []
+        recent_mains: List[set] = []
+        
+        for day in range(1, days + 1):
+            if available_foods:
+                avoid_mains = set().union(*recent_mains[-variety_window:]) if variety_window > 0 else set()
+                meals, mains = self._compose_day(available_foods, calories, diet_type, avoid_mains, health_conditions)
+                recent_mains.append(mains)
+            else:
+                meals = self._fallback_plan(calories, diet_type)['meals']
+            
+            plan_days.append({
+                'day': day,
+                **self._totals(meals),
+                'meals': [
+                    {
+                        'meal_type': meal.get('meal_type') or meal['name'].split(':')[0],
+                        'items': meal.get('items') or meal['name'].split(': ', 1)[-1].split(', '),
+                        'calories': meal['calories']
+                    }
+                    for meal in meals
+                ]
+            })
+        
+        batch = {
+            'plan_name': f"{days}-Day {calories} Cal {diet_type.title()} Plan",
+            'days': plan_days,
+            'variety_window': variety_window,
+            'avg_calories': round(sum(d['total_calories'] for d in plan_days) / days) if days else 0,
+            'avg_protein': round(sum(d['protein'] for d in plan_days) / days, 1) if days else 0
+        }
+        if health_conditions:
+            batch['health_conditions'] = self.food_db.condition_tips(health_conditions)
+        return batch
+    
+    def _compose_day(self, available_foods: List[Dict], calories: int, diet_type: str, avoid_mains: Optional[set] = None,
+                     health_conditions: Optional[List[str]] = None):
+        """Compose every meal slot for one day; returns (meals, main course names used)."""
         meals = []
-        total_cal = 0
-        total_protein = 0
-        total_carbs = 0
-        total_fat = 0
-        
-        # Breakfast
-        breakfast = self._compose_meal(available_foods, 'breakfast', breakfast_cal, 'Breakfast')
-        if breakfast:
-            meals.append(breakfast)
-            total_cal += breakfast['calories']
-            total_protein += breakfast['protein']
-            total_carbs += breakfast.get('carbs', 0)
-            total_fat += breakfast.get('fat', 0)
-        
-        # Lunch
-        lunch = self._compose_meal(available_foods, 'lunch', lunch_cal, 'Lunch')
-        if lunch:
-            meals.append(lunch)
-            total_cal += lunch['calories']
-            total_protein += lunch['protein']
-            total_carbs += lunch.get('carbs', 0)
-            total_fat += lunch.get('fat', 0)
-        
-        # Snack
-        snack = self._compose_meal(available_foods, 'snack', snack_cal, 'Snack')
-        if snack:
-            meals.append(snack)
-            total_cal += snack['calories']
-            total_protein += snack['protein']
-            total_carbs += snack.get('carbs', 0)
-            total_fat += snack.get('fat', 0)
-        
-        # Dinner
-        dinner = self._compose_meal(available_foods, 'dinner', dinner_cal, 'Dinner')
-        if dinner:
-            meals.append(dinner)
-            total_cal += dinner['calories']
-            total_protein += dinner['protein']
-            total_carbs += dinner.get('carbs', 0)
-            total_fat += dinner.get('fat', 0)
+        mains = set()
+        avoid = set(avoid_mains or ())
+        preferred = self.food_db.recommended_names(health_conditions)
+        
+        for meal_time, share, label in self.MEAL_SLOTS:
+            suitable = self.food_db.foods_for(diet_type, meal_time, health_conditions)
+            meal = self._compose_meal(available_foods, meal_time, int(calories * share), label, suitable, avoid, preferred)
+            if meal:
+                main = meal.pop('main', None)
+                if main:
+                    mains.add(main)
+                    avoid.add(main)
+                meals.append(meal)
         
+        return meals, mains
+    
+    @staticmethod
+    def _totals(meals: List[Dict]) -> Dict:
+        """Sum calories and macros over a list of composed meals."""
         return {
-            'plan_name': f"Custom {calories} Cal {diet_type.title()} Plan",
-            'total_calories': round(total_cal),
-            'protein': round(total_protein, 1),
-            'carbs': round(total_carbs, 1),
-            'fat': round(total_fat, 1),
-            'meals': meals
+            'total_calories': round(sum(m['calories'] for m in meals)),
+            'protein': round(sum(m.get('protein', 0) for m in meals), 1),
+            'carbs': round(sum(m.get('carbs', 0) for m in meals), 1),
+            'fat': round(sum(m.get('fat', 0) for m in meals), 1)
         }
     
-    def _compose_meal(self, available_foods: List[Dict], meal_time: str, target_calories: int, meal_label: str) -> Optional[Dict]:
+    @staticmethod
+    def _pick(candidates: List[Dict], preferred: Optional[set] = None) -> Dict:
+        """Pick a food at random, weighting condition-recommended foods 3x."""
+        if not preferred:
+            return random.choice(candidates)
+        weights = [3 if f['name'] in preferred else 1 for f in candidates]
+        return random.choices(candidates, weights=weights)[0]
+    
+    def _compose_meal(self, available_foods: List[Dict], meal_time: str, target_calories: int, meal_label: str,
+                      suitable: Optional[List[Dict]] = None, avoid_mains: Optional[set] = None,
+                      preferred: Optional[set] = None) -> Optional[Dict]:
         """Compose a meal from multiple food items to match target calories."""
         # Get foods suitable for this meal time
-        suitable = self.food_db.filter_by_meal_time(available_foods, meal_time)
+        if suitable is None:
+            suitable = self.food_db.filter_by_meal_time(available_foods, meal_time)
         
         if not suitable:
             # Try to find foods that work for lunch_dinner or any
@@ -167,24 +407,29 @@ class MealPlanner:
         tolerance = 50  # Allow ±50 cal from target
         
         # Add main course
+        main_name = None
         if main_courses:
             available_mains = [f for f in main_courses if f['name'] not in used_names]
+            if avoid_mains:
+                # Cross-day variety: skip recently used mains unless nothing else is left
+                available_mains = [f for f in available_mains if f['name'] not in avoid_mains] or available_mains
             if available_mains:
-                main = random.choice(available_mains)
+                main = self._pick(available_mains, preferred)
                 selected_foods.append(main)
                 current_calories += main['calories']
                 current_protein += main.get('protein', 0)
                 current_carbs += main.get('carbs', 0)
                 current_fat += main.get('fat', 0)
                 used_names.add(main['name'])
+                main_name = main['name']
         
         # Add grain/bread if calories allow
         if grains and current_calories < target_calories - 100:
             available_grains = [f for f in grains if f['name'] not in used_names and f['calories'] <= target_calories - current_calories + tolerance]
             if available_grains:
-                grain = random.choice(available_grains)
+                grain = self._pick(available_grains, preferred)
                 # Add 1-2 servings based on need
-                servings = min(2, (target_calories - current_calories) // grain['calories'])
+                servings = int(min(2, (target_calories - current_calories) // grain['calories']))
                 if servings > 0:
                     for _ in range(servings):
                         selected_foods.append(grain)
@@ -198,7 +443,7 @@ class MealPlanner:
         if sides and current_calories < target_calories - tolerance:
             available_sides = [f for f in sides if f['name'] not in used_names and f['calories'] <= target_calories - current_calories + tolerance]
             if available_sides:
-                side = random.choice(available_sides)
+                side = self._pick(available_sides, preferred)
                 selected_foods.append(side)
                 current_calories += side['calories']
                 current_protein += side.get('protein', 0)
@@ -210,7 +455,7 @@ class MealPlanner:
         if snacks and current_calories < target_calories - tolerance:
             available_snacks = [f for f in snacks if f['name'] not in used_names and f['calories'] <= target_calories - current_calories + tolerance]
             if available_snacks:
-                snack = random.choice(available_snacks)
+                snack = self._pick(available_snacks, preferred)
                 selected_foods.append(snack)
                 current_calories += snack['calories']
                 current_protein += snack.get('protein', 0)
@@ -231,7 +476,8 @@ class MealPlanner:
             'carbs': round(current_carbs, 1),
             'fat': round(current_fat, 1),
             'items': food_names,
-            'meal_type': meal_label
+            'meal_type': meal_label,
+            'main': main_name
         }
     
     def _fallback_plan(self, calories: int, diet_type: str) -> Dict:
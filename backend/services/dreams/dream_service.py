@@ -2,9 +2,12 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
+from starlette.concurrency import run_in_threadpool
 import os
+import json
 from database import get_db_connection
-from datetime import datetime
+from services.dashboard.activity_tracker import log_activity
+from services.jobs.job_queue import job_queue, accepted
 
 router = APIRouter()
 
@@ -20,44 +23,58 @@ def get_llm():
         api_key=api_key
     )
 
-@router.post("/interpret")
-async def interpret_dream(dream: DreamLog):
-    """Interpret a dream using Jungian analysis."""
+FALLBACK_INTERPRETATION = {
+    "interpretation": "I sense this dream is significant, but I cannot connect to the cosmic consciousness (API Key missing).",
+    "symbols": ["Unknown"],
+    "theme": "Mystery"
+}
+
+
+@job_queue.register("dream_interpretation")
+def run_dream_interpretation(payload: dict, progress=None) -> dict:
+    """Interpret a dream with the LLM and save it to the dream log."""
+    llm = get_llm()
+    if not llm:
+        # Fallback if no API key
+        return dict(FALLBACK_INTERPRETATION)
+
+    description = payload["description"]
+    prompt = f"""
+    You are a mystical Dream Weaver and Jungian Analyst.
+    Interpret the following dream: "{description}"
+    
+    Provide a response in JSON format with:
+    - "interpretation": A deep, mystical, yet psychological interpretation (max 3 sentences).
+    - "symbols": A list of key symbols found in the dream.
+    - "theme": The overarching emotional theme (e.g., "Transformation", "Anxiety").
+    """
+    
+    response = llm.invoke([HumanMessage(content=prompt)])
+    content = response.content.replace('```json', '').replace('```', '').strip()
     try:
-        llm = get_llm()
-        if not llm:
-            # Fallback if no API key
-            return {
-                "interpretation": "I sense this dream is significant, but I cannot connect to the cosmic consciousness (API Key missing).",
-                "symbols": ["Unknown"],
-                "theme": "Mystery"
-            }
+        interpretation = json.loads(content)
+    except json.JSONDecodeError as e:
+        # Fails the job with a readable error instead of a bare decode traceback
+        raise ValueError(f"Dream interpretation was not valid JSON: {e}") from e
+    
+    # Save to the dream log (unbuffered, so /history sees it right away)
+    log_activity("dream_log", description, interpretation, buffered=False)
+    
+    return interpretation
 
-        prompt = f"""
-        You are a mystical Dream Weaver and Jungian Analyst.
-        Interpret the following dream: "{dream.description}"
-        
-        Provide a response in JSON format with:
-        - "interpretation": A deep, mystical, yet psychological interpretation (max 3 sentences).
-        - "symbols": A list of key symbols found in the dream.
-        - "theme": The overarching emotional theme (e.g., "Transformation", "Anxiety").
-        """
-        
-        response = llm.invoke([HumanMessage(content=prompt)])
-        content = response.content.replace('```json', '').replace('```', '').strip()
-        
-        # Save to DB
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO activities (type, description, metadata, timestamp) VALUES (?, ?, ?, ?)",
-            ("dream_log", dream.description, content, datetime.now().isoformat())
-        )
-        conn.commit()
-        conn.close()
-        
-        import json
-        return json.loads(content)
+
+@router.post("/interpret")
+async def interpret_dream(dream: DreamLog, background: bool = False):
+    """Interpret a dream using Jungian analysis.
+    
+    With background=true the interpretation runs on the job queue and a
+    202 with the job id is returned immediately.
+    """
+    if background:
+        return accepted(job_queue.enqueue("dream_interpretation", {"description": dream.description}))
+
+    try:
+        return await run_in_threadpool(run_dream_interpretation, {"description": dream.description})
 
     except Exception as e:
         print(f"Dream Error: {e}")
@@ -69,7 +86,7 @@ def get_dream_history():
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
-        "SELECT description, metadata, timestamp FROM activities WHERE type = 'dream_log' ORDER BY timestamp DESC LIMIT 10"
+        "SELECT description, metadata, timestamp FROM activities_all WHERE type = 'dream_log' ORDER BY timestamp DESC LIMIT 10"
     )
     dreams = [dict(row) for row in cursor.fetchall()]
     conn.close()
@@ -4,6 +4,7 @@ from langchain_core.prompts import ChatPromptTemplate
 import chromadb
 import os
 from dotenv import load_dotenv
+from prompt_context import ContextBuilder
 
 load_dotenv()
 
@@ -53,22 +54,16 @@ async def get_scripture_rag_response(mood: str, situation: str = None, history:
             n_results=3
         )
         
-        # Extract context
-        context = "\n\n".join(results["documents"][0]) if results["documents"] else "No relevant scriptures found."
-        
-        # Format history for prompt
-        history_text = ""
-        if history:
-            history_text = "Chat History:\n" + "\n".join([f"{msg['role'].title()}: {msg['content']}" for msg in history[-5:]]) # Last 5 messages
+        verses = results["documents"][0] if results["documents"] else []
+        history_lines = [f"{msg['role'].title()}: {msg['content']}" for msg in history]
 
         # Create prompt template
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a compassionate spiritual guide with deep knowledge of Hindu scriptures.
+        system_text = """You are a compassionate spiritual guide with deep knowledge of Hindu scriptures.
             Use the provided verses to offer comfort, wisdom, and practical guidance.
             Be empathetic, non-judgmental, and provide actionable steps.
             
-            If the user asks a follow-up question, use the Chat History to understand the context."""),
-            ("user", """Relevant scriptures:
+            If the user asks a follow-up question, use the Chat History to understand the context."""
+        user_text = """Relevant scriptures:
 {context}
 
 {history}
@@ -80,14 +75,24 @@ Provide gentle, compassionate guidance that:
 1. Acknowledges their feelings/question
 2. Shares the scriptural wisdom (if relevant) or explains previous wisdom
 3. Offers practical steps
-4. Ends with encouragement""")
-        ])
+4. Ends with encouragement"""
+        prompt = ChatPromptTemplate.from_messages([("system", system_text), ("user", user_text)])
         
         # Generate response
         try:
             llm = get_llm()
             if not llm:
                 raise ValueError("LLM not initialized")
+
+            # Verses outrank history; the most recent messages are kept first
+            sections = ContextBuilder("emotional_guidance") \
+                .reserve(system_text + user_text + mood + (situation or "")) \
+                .add_items("context", verses, priority=2) \
+                .add_items("history", history_lines, priority=1, joiner="\n", keep="last") \
+                .build()
+            context = sections["context"] or "No relevant scriptures found."
+            history_text = "Chat History:\n" + sections["history"] if sections["history"] else ""
+
             chain = prompt | llm
             # Use ainvoke with timeout (increased to 30s for reliability)
             response = await asyncio.wait_for(
@@ -126,8 +131,8 @@ Provide gentle, compassionate guidance that:
     }
 
 
-from database import get_db_connection
-from services.gamification.gamification_service import grant_xp
+from event_bus import publish
+from . import mood_store
 
 class MoodLog(BaseModel):
     mood: str
@@ -138,23 +143,10 @@ class MoodLog(BaseModel):
 def log_mood(log: MoodLog):
     """Log user mood."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO mood_logs (mood, intensity, note) VALUES (?, ?, ?)",
-            (log.mood, log.intensity, log.note)
-        )
-        conn.commit()
-        conn.close()
-        
         # Award XP for emotional awareness
-        try:
-            grant_xp(1, 10)
-        except:
-            pass
+        entry = mood_store.log_mood(log.mood, log.intensity, log.note, xp=10)
             
-        return {"success": True, "message": "Mood logged successfully"}
+        return {"success": True, "message": "Mood logged successfully", "mood": entry}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -166,18 +158,12 @@ async def get_rag_emotional_guidance(
     try:
         # Auto-log the mood from the request if it's not just a query
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO mood_logs (mood, intensity) VALUES (?, ?)",
-                (request.mood, 7) # Default intensity for guidance requests
-            )
-            conn.commit()
-            conn.close()
+            mood_store.log_mood(request.mood, 7)  # Default intensity for guidance requests
         except:
             pass
 
         result = await get_scripture_rag_response(request.mood, request.situation, request.history)
+        publish("gita_conversation", {"mood": request.mood})
         return {
             "mood": request.mood,
             "situation": request.situation,
@@ -0,0 +1,178 @@
+"""Typed mood store on top of `mood_logs`.
+
+Free-text moods are normalized into a small set of categories with a
+numeric valence (-1 very negative .. +1 very positive) at write time, and
+the table is indexed by timestamp and (category, timestamp). Readers such as
+the risk engine and Memory Fusion use range scans instead of LIKE matching
+over JSON text.
+"""
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import outbox
+from database import get_db_connection
+
+# Category -> (valence, keywords). Keywords match whole words (no stems, so
+# "joyless" is not "joy"), and multi-word keywords match as a phrase. Words
+# with a common unrelated sense ("down", "broke", "mad") are left out or only
+# used in a phrase. Negative categories are matched first so "stressed but
+# hopeful" counts toward burnout signals.
+MOOD_CATEGORIES = {
+    "stressed": (-0.8, ("stress", "stressed", "stressful", "pressure", "pressured", "burnout", "burnt out",
+                        "burned out", "frustrated", "frustrating", "frustration", "overworked", "tense")),
+    "angry": (-0.8, ("angry", "anger", "irritated", "irritable", "annoyed", "furious", "rage", "livid")),
+    "anxious": (-0.7, ("anxious", "anxiety", "worried", "worry", "worrying", "fear", "fearful", "afraid",
+                       "scared", "nervous", "panic", "panicked", "panicking", "overwhelmed", "overwhelming",
+                       "uneasy")),
+    "sad": (-0.7, ("sad", "feeling down", "lonely", "depressed", "depressing", "depression", "grief", "grieving",
+                   "upset", "guilt", "guilty", "hopeless", "cry", "crying", "cried", "heartbroken", "miserable",
+                   "unhappy")),
+    "tired": (-0.4, ("tired", "exhausted", "exhaustion", "sleepy", "drained", "fatigue", "fatigued", "bored")),
+    "neutral": (0.0, ("okay", "ok", "fine", "neutral", "meh", "normal")),
+    "calm": (0.6, ("calm", "calmer", "calmed", "peace", "peaceful", "relaxed", "relaxing", "content", "hopeful",
+                   "confident", "motivated", "energetic", "focused")),
+    "happy": (0.8, ("happy", "joy", "joyful", "excited", "great", "good", "love", "loved", "loving", "cheerful",
+                    "grateful", "amazing")),
+}
+
+# A keyword within NEGATION_WINDOW words after a negator, in the same clause, flips its category
+NEGATORS = {"not", "no", "never", "hardly", "barely", "isn't", "isnt", "wasn't", "wasnt", "don't", "dont",
+            "doesn't", "doesnt", "didn't", "didnt", "aren't", "arent", "can't", "cant", "nor"}
+CLAUSE_BREAKS = {"but", "and", "yet", "though", "although", ".", ",", ";", "!", "?"}
+NEGATION_WINDOW = 3
+NEGATED = {"happy": "sad", "calm": "anxious", "neutral": "sad"}
+
+# Categories that count as burnout signals
+BURNOUT_CATEGORIES = ("stressed", "anxious", "tired")
+
+
+def _keyword_positions(tokens: List[str], keyword: str) -> List[int]:
+    phrase = keyword.split()
+    return [i for i in range(len(tokens) - len(phrase) + 1) if tokens[i:i + len(phrase)] == phrase]
+
+
+def _negated(tokens: List[str], position: int) -> bool:
+    for token in reversed(tokens[max(0, position - NEGATION_WINDOW):position]):
+        if token in CLAUSE_BREAKS:
+            return False
+        if token in NEGATORS:
+            return True
+    return False
+
+
+def categorize(mood: str) -> Tuple[str, Optional[float]]:
+    """Map free-text mood to (category, valence); unknown moods are ("other", None).
+
+    "not good" counts as sad and "not stressed" as neutral; a negated negative
+    word only decides the category when nothing else matched.
+    """
+    tokens = re.findall(r"[a-z']+|[.,;!?]", str(mood or "").lower())
+    matched = set()
+    negated_negative = False
+    for category, (valence, keywords) in MOOD_CATEGORIES.items():
+        for keyword in keywords:
+            for position in _keyword_positions(tokens, keyword):
+                if not _negated(tokens, position):
+                    matched.add(category)
+                elif valence < 0:
+                    negated_negative = True
+                else:
+                    matched.add(NEGATED[category])
+
+    for category in MOOD_CATEGORIES:
+        if category in matched:
+            return category, MOOD_CATEGORIES[category][0]
+    if negated_negative:
+        return "neutral", MOOD_CATEGORIES["neutral"][0]
+    return "other", None
+
+
+def init_mood_store():
+    """Add category/valence columns and indexes to mood_logs, backfilling old rows."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    columns = {row["name"] for row in cursor.execute("PRAGMA table_info(mood_logs)")}
+    if "category" not in columns:
+        cursor.execute("ALTER TABLE mood_logs ADD COLUMN category TEXT")
+    if "valence" not in columns:
+        cursor.execute("ALTER TABLE mood_logs ADD COLUMN valence REAL")
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mood_logs_timestamp ON mood_logs (timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mood_logs_category ON mood_logs (category, timestamp)")
+
+    # Backfill rows written before the categorizer
+    stale = cursor.execute("SELECT id, mood FROM mood_logs WHERE category IS NULL").fetchall()
+    cursor.executemany(
+        "UPDATE mood_logs SET category = ?, valence = ? WHERE id = ?",
+        [(*categorize(row["mood"]), row["id"]) for row in stale]
+    )
+
+    conn.commit()
+    conn.close()
+
+
+init_mood_store()
+
+
+def log_mood(mood: str, intensity: int = 5, note: Optional[str] = None, xp: int = 0) -> Dict:
+    """Store a mood; `xp` > 0 awards XP through the outbox in the same commit.
+
+    The timestamp comes from the column default (UTC), like every mood row before it.
+    """
+    category, valence = categorize(mood)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    row = cursor.execute(
+        """
+        INSERT INTO mood_logs (mood, intensity, note, category, valence)
+        VALUES (?, ?, ?, ?, ?)
+        RETURNING id, timestamp
+        """,
+        (mood, intensity, note, category, valence)
+    ).fetchone()
+    entry = {
+        "id": row["id"],
+        "mood": mood,
+        "intensity": intensity,
+        "note": note,
+        "category": category,
+        "valence": valence,
+        "timestamp": row["timestamp"]
+    }
+    outbox.record(
+        cursor, "mood_logged", event=entry,
+        xp={"amount": xp, "source": "mood_log", "reason": f"Logged mood: {mood}"} if xp > 0 else None
+    )
+    conn.commit()
+    conn.close()
+    outbox.notify()
+
+    return entry
+
+
+def get_moods(start: str, end: Optional[str] = None) -> List[Dict]:
+    """Mood logs in [start, end), oldest first."""
+    query = "SELECT * FROM mood_logs WHERE timestamp >= ?"
+    params: List = [start]
+    if end:
+        query += " AND timestamp < ?"
+        params.append(end)
+    query += " ORDER BY timestamp"
+
+    conn = get_db_connection()
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def count_by_category(start: str, categories: Sequence[str]) -> int:
+    """Moods in the given categories since `start` (index range scan per category)."""
+    conn = get_db_connection()
+    row = conn.execute(
+        f"SELECT COUNT(*) FROM mood_logs WHERE category IN ({', '.join('?' for _ in categories)}) AND timestamp >= ?",
+        [*categories, start]
+    ).fetchone()
+    conn.close()
+    return row[0]
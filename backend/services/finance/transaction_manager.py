@@ -2,7 +2,24 @@ import sqlite3
 from datetime import datetime
 from typing import List, Dict
 from database import get_db_connection
-from services.gamification.gamification_service import grant_xp
+import outbox
+
+
+def init_transaction_refs():
+    """`source_ref` marks imported rows (e.g. one receipt of a batch) so re-running an import skips them."""
+    conn = get_db_connection()
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(transactions)")}
+    if "source_ref" not in columns:
+        conn.execute("ALTER TABLE transactions ADD COLUMN source_ref TEXT")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_source_ref ON transactions (source_ref) WHERE source_ref IS NOT NULL"
+    )
+    conn.commit()
+    conn.close()
+
+
+init_transaction_refs()
+
 
 class TransactionManager:
     def add_transaction(self, amount: float, type: str, category: str, description: str) -> Dict:
@@ -17,15 +34,15 @@ class TransactionManager:
         )
         
         tx_id = cursor.lastrowid
+        # Gamification Trigger, committed with the transaction and applied by the outbox dispatcher
+        outbox.record(
+            cursor, "transaction_added",
+            event={"id": tx_id, "amount": amount, "type": type, "category": category},
+            xp={"amount": 20, "source": "transaction", "reason": f"Logged transaction {tx_id}"}  # Award 20 XP for tracking finances
+        )
         conn.commit()
         conn.close()
-        
-        # Gamification Trigger
-        try:
-            grant_xp(1, 20)  # Award 20 XP for tracking finances
-            print(f"💰 XP Awarded for Transaction {tx_id}")
-        except Exception as e:
-            print(f"⚠️ Failed to award XP: {e}")
+        outbox.notify()
 
         
         return {
@@ -37,6 +54,64 @@ class TransactionManager:
             "date": date
         }
 
+    def add_transactions(self, items: List[Dict]) -> List[Dict]:
+        """Insert many transactions in a single DB transaction.
+
+        Each item needs amount, type, category and description; an optional
+        `date` (e.g. the date printed on a receipt) overrides the current time.
+        Either every row is written or none is. An item with a `source_ref`
+        already in the table is not inserted again; the stored row is returned
+        in its place and earns no XP, so a re-run import is idempotent.
+        """
+        if not items:
+            return []
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        now = datetime.now().isoformat()
+        created = []
+        new_ids = []
+
+        try:
+            for item in items:
+                row = {
+                    "amount": item["amount"],
+                    "type": item.get("type", "expense"),
+                    "category": item.get("category") or "Other",
+                    "description": item.get("description") or "",
+                    "date": item.get("date") or now
+                }
+                inserted = cursor.execute(
+                    'INSERT INTO transactions (amount, type, category, description, date, source_ref) '
+                    'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING RETURNING id',
+                    (row["amount"], row["type"], row["category"], row["description"], row["date"], item.get("source_ref"))
+                ).fetchone()
+                if inserted:
+                    new_ids.append(inserted["id"])
+                    created.append({"id": inserted["id"], **row})
+                else:
+                    existing = cursor.execute(
+                        "SELECT id, amount, type, category, description, date FROM transactions WHERE source_ref = ?",
+                        (item["source_ref"],)
+                    ).fetchone()
+                    created.append(dict(existing))
+            if new_ids:
+                outbox.record(
+                    cursor, "transactions_imported",
+                    event={"ids": new_ids},
+                    xp={"amount": 20 * len(new_ids), "source": "transaction", "reason": f"Imported {len(new_ids)} transactions"}
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        if new_ids:
+            outbox.notify()
+
+        return created
+
     def get_transactions(self, limit: int = 20) -> List[Dict]:
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -71,6 +146,7 @@ class TransactionManager:
             "total_income": total_income,
             "total_expenses": total_expenses,
             "remaining_budget": remaining_budget,
+            "budget_limit": total_budget,
             "savings_rate": round(savings_rate, 1),
             "currency": "INR"
         }
@@ -1,14 +1,27 @@
-"""Achievement System - Badges and milestones."""
+"""Achievement System - Badges and milestones.
+
+Achievements are unlocked by a rule engine subscribed to domain events
+(see event_bus): each event only evaluates the rules registered for its
+type, against in-memory counters seeded once from the database.
+"""
 
 from fastapi import APIRouter
+from collections import defaultdict
 from datetime import datetime, date
 import sqlite3
 import os
+import threading
+from typing import Optional
+
+from event_bus import USER_ACTION_EVENTS, subscribe
 
 router = APIRouter()
 
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "app.db")
 
+# Achievement XP goes to the single app user
+XP_USER_ID = 1
+
 
 def get_db():
     conn = sqlite3.connect(DB_PATH)
@@ -28,6 +41,11 @@ def init_achievements_table():
         )
     """)
     
+    # Rule-engine unlocks wait here (notified = 0) until /check reports them
+    columns = {row["name"] for row in cursor.execute("PRAGMA table_info(user_achievements)")}
+    if "notified" not in columns:
+        cursor.execute("ALTER TABLE user_achievements ADD COLUMN notified INTEGER DEFAULT 1")
+    
     conn.commit()
     conn.close()
 
@@ -67,6 +85,115 @@ ACHIEVEMENTS = [
 ]
 
 
+# Catalog indexes, built once at import
+ACHIEVEMENTS_BY_ID = {a["id"]: a for a in ACHIEVEMENTS}
+ACHIEVEMENTS_BY_CATEGORY = defaultdict(list)
+for _achievement in ACHIEVEMENTS:
+    ACHIEVEMENTS_BY_CATEGORY[_achievement["category"]].append(_achievement)
+# Display order within the unlocked / locked groups (stable sort by category)
+CATALOG_ORDER = sorted(ACHIEVEMENTS, key=lambda a: a["category"])
+
+
+def _today_key(counter: str) -> str:
+    return f"{counter}:{date.today().isoformat()}"
+
+
+# Achievement id -> (event type or set of types, predicate(counters, payload)).
+# Time-of-day rules run on user actions only (see event_bus.USER_ACTION_EVENTS).
+# life_score_80, all_modules and calorie_master have no event source yet.
+ACHIEVEMENT_RULES = {
+    "first_habit": ("habit_completed", lambda c, p: c["habit_completions"] >= 1),
+    "habit_streak_7": ("habit_completed", lambda c, p: p.get("streak", 0) >= 7),
+    "habit_streak_30": ("habit_completed", lambda c, p: p.get("streak", 0) >= 30),
+    "habit_perfectionist": ("habit_completed",
+                            lambda c, p: 0 < p.get("active_habits", 0) <= p.get("completed_today", 0)),
+    "first_focus": ("focus_session_completed", lambda c, p: c["focus_sessions"] >= 1),
+    "focus_5_sessions": ("focus_session_completed", lambda c, p: c["focus_sessions"] >= 5),
+    "focus_marathon": ("focus_session_completed", lambda c, p: c[_today_key("focus_sessions")] >= 3),
+    "first_meal": ("meal_logged", lambda c, p: c["meals_logged"] >= 1),
+    "meal_tracker": ("meal_logged", lambda c, p: c["meals_logged"] >= 10),
+    "level_5": ("xp_granted", lambda c, p: p.get("new_level", 0) >= 5),
+    "level_10": ("xp_granted", lambda c, p: p.get("new_level", 0) >= 10),
+    "xp_1000": ("xp_granted", lambda c, p: p.get("new_xp", 0) >= 1000),
+    "xp_5000": ("xp_granted", lambda c, p: p.get("new_xp", 0) >= 5000),
+    "early_bird": (USER_ACTION_EVENTS, lambda c, p: datetime.now().hour < 6),
+    "night_owl": (USER_ACTION_EVENTS, lambda c, p: datetime.now().hour >= 23),
+}
+
+RULES_BY_EVENT = defaultdict(list)
+for _achievement_id, (_event_types, _rule) in ACHIEVEMENT_RULES.items():
+    for _event_type in ([_event_types] if isinstance(_event_types, str) else _event_types):
+        RULES_BY_EVENT[_event_type].append(_achievement_id)
+
+# Event type -> counter it increments (plus a per-day copy)
+COUNTED_EVENTS = {
+    "habit_completed": "habit_completions",
+    "focus_session_completed": "focus_sessions",
+    "meal_logged": "meals_logged",
+}
+
+_engine_lock = threading.Lock()
+_engine = {"loaded": False, "unlocked": set(), "counters": defaultdict(int)}
+
+
+def _count(conn, query: str, params=()) -> int:
+    try:
+        return conn.execute(query, params).fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+
+
+def _load_engine_state() -> list:
+    """Seed unlocked ids and counters from the database once; returns backfill unlocks."""
+    today = date.today().isoformat()
+    conn = get_db()
+    unlocked = {row["achievement_id"] for row in conn.execute("SELECT achievement_id FROM user_achievements")}
+    counters = defaultdict(int, {
+        "habit_completions": _count(conn, "SELECT COUNT(*) FROM habit_completions"),
+        "meals_logged": _count(conn, "SELECT COUNT(*) FROM meals"),
+        "focus_sessions": _count(conn, "SELECT COUNT(*) FROM xp_events WHERE source = 'focus_session'"),
+        f"focus_sessions:{today}": _count(
+            conn, "SELECT COUNT(*) FROM xp_events WHERE source = 'focus_session' AND created_at >= ?", (today,)
+        ),
+    })
+    conn.close()
+
+    _engine.update(loaded=True, unlocked=unlocked, counters=counters)
+
+    # Progress made before the engine existed (only rules that need no event payload, plus XP)
+    from services.gamification.gamification_service import get_xp_status
+    xp = get_xp_status()
+    xp_payload = {"new_xp": xp["total_xp"], "new_level": xp["level"]}
+    backfill = []
+    for achievement_id, (event_type, rule) in ACHIEVEMENT_RULES.items():
+        if event_type == USER_ACTION_EVENTS or achievement_id in unlocked:
+            continue
+        if rule(counters, xp_payload if event_type == "xp_granted" else {}):
+            backfill.append(achievement_id)
+    return backfill
+
+
+@subscribe("*")
+def evaluate_event(event_type: str, payload: dict):
+    """Run the rules subscribed to this event and unlock whatever they grant."""
+    with _engine_lock:
+        to_unlock = [] if _engine["loaded"] else _load_engine_state()
+        counters = _engine["counters"]
+        counter = COUNTED_EVENTS.get(event_type)
+        if counter:
+            counters[counter] += 1
+            counters[_today_key(counter)] += 1
+
+        for achievement_id in RULES_BY_EVENT.get(event_type, []):
+            if achievement_id not in _engine["unlocked"] and ACHIEVEMENT_RULES[achievement_id][1](counters, payload):
+                to_unlock.append(achievement_id)
+
+    # Persist outside the lock: awarding XP publishes xp_granted back into this handler.
+    # The in-memory set is only updated once the rows are stored, so a failed write is
+    # evaluated again on the next event (INSERT OR IGNORE absorbs concurrent repeats).
+    unlock_achievements(to_unlock, notified=False)
+
+
 def get_unlocked_achievements() -> list:
     """Get all unlocked achievements."""
     conn = get_db()
@@ -77,37 +204,60 @@ def get_unlocked_achievements() -> list:
     return {row["achievement_id"]: row["unlocked_at"] for row in rows}
 
 
-def unlock_achievement(achievement_id: str) -> dict:
-    """Unlock an achievement and award XP."""
+def unlock_achievements(achievement_ids: list, notified: bool = True) -> list:
+    """Unlock several achievements in one transaction; returns the newly unlocked ones.
+
+    Already-unlocked ids are skipped by INSERT OR IGNORE. The XP for all new
+    unlocks is one ledger event committed together with the unlock rows, so a
+    failed grant rolls the unlock back and it is retried on a later event.
+    """
+    from services.gamification.gamification_service import apply_xp_grants, xp_granted
+    ids = list(dict.fromkeys(a for a in achievement_ids if a in ACHIEVEMENTS_BY_ID))
+    if not ids:
+        return []
+    
     conn = get_db()
     cursor = conn.cursor()
-    
-    # Check if already unlocked
-    cursor.execute("SELECT id FROM user_achievements WHERE achievement_id = ?", (achievement_id,))
-    if cursor.fetchone():
+    try:
+        rows = cursor.execute(
+            f"INSERT OR IGNORE INTO user_achievements (achievement_id, notified) VALUES "
+            f"{', '.join('(?, ?)' for _ in ids)} RETURNING achievement_id",
+            [value for achievement_id in ids for value in (achievement_id, 1 if notified else 0)]
+        ).fetchall()
+        unlocked = [ACHIEVEMENTS_BY_ID[row["achievement_id"]] for row in rows]
+        
+        # Award XP
+        xp = sum(a["xp"] for a in unlocked)
+        applied = None
+        if xp > 0:
+            applied = apply_xp_grants(cursor, XP_USER_ID, [{
+                "amount": xp,
+                "source": "achievement",
+                "reason": "Unlocked: " + ", ".join(a["name"] for a in unlocked if a["xp"] > 0)
+            }])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
         conn.close()
-        return {"already_unlocked": True}
     
-    # Find achievement
-    achievement = next((a for a in ACHIEVEMENTS if a["id"] == achievement_id), None)
+    with _engine_lock:
+        _engine["unlocked"].update(ids)
+    if applied:
+        xp_granted(XP_USER_ID, applied, "achievement")
+    
+    return unlocked
+
+
+def unlock_achievement(achievement_id: str, notified: bool = True) -> dict:
+    """Unlock an achievement and award XP."""
+    achievement = ACHIEVEMENTS_BY_ID.get(achievement_id)
     if not achievement:
-        conn.close()
         return {"error": "Achievement not found"}
     
-    # Unlock
-    cursor.execute("""
-        INSERT INTO user_achievements (achievement_id) VALUES (?)
-    """, (achievement_id,))
-    conn.commit()
-    conn.close()
-    
-    # Award XP
-    if achievement["xp"] > 0:
-        try:
-            from services.gamification.gamification_service import add_xp
-            add_xp(achievement["xp"], "achievement", f"Unlocked: {achievement['name']}")
-        except:
-            pass
+    if not unlock_achievements([achievement_id], notified):
+        return {"already_unlocked": True}
     
     return {
         "success": True,
@@ -117,26 +267,23 @@ def unlock_achievement(achievement_id: str) -> dict:
 
 
 @router.get("/")
-def get_achievements():
+def get_achievements(category: Optional[str] = None):
     """Get all achievements with unlock status."""
     unlocked = get_unlocked_achievements()
+    catalog = ACHIEVEMENTS_BY_CATEGORY.get(category, []) if category else CATALOG_ORDER
     
-    result = []
-    for ach in ACHIEVEMENTS:
-        result.append({
-            **ach,
-            "unlocked": ach["id"] in unlocked,
-            "unlocked_at": unlocked.get(ach["id"])
-        })
-    
-    # Sort: unlocked first, then by category
-    result.sort(key=lambda x: (not x["unlocked"], x["category"]))
+    # Unlocked first, then by category (catalog is pre-sorted, so one pass per group)
+    unlocked_items, locked_items = [], []
+    for ach in catalog:
+        unlocked_at = unlocked.get(ach["id"])
+        item = {**ach, "unlocked": unlocked_at is not None, "unlocked_at": unlocked_at}
+        (unlocked_items if item["unlocked"] else locked_items).append(item)
     
-    unlocked_count = len(unlocked)
-    total_count = len(ACHIEVEMENTS)
+    unlocked_count = len(unlocked_items) if category else len(unlocked)
+    total_count = len(catalog)
     
     return {
-        "achievements": result,
+        "achievements": unlocked_items + locked_items,
         "unlocked_count": unlocked_count,
         "total_count": total_count,
         "completion_percentage": round(unlocked_count / total_count * 100) if total_count > 0 else 0
@@ -151,59 +298,20 @@ def unlock(achievement_id: str):
 
 @router.get("/check")
 def check_achievements():
-    """Check and auto-unlock any earned achievements."""
-    newly_unlocked = []
-    
-    # Check habit achievements
-    try:
-        from services.habits.habits_service import get_db as get_habits_db
-        conn = get_habits_db()
-        cursor = conn.cursor()
-        
-        # First habit
-        cursor.execute("SELECT COUNT(*) as count FROM habit_completions")
-        if cursor.fetchone()["count"] >= 1:
-            result = unlock_achievement("first_habit")
-            if result.get("success"):
-                newly_unlocked.append(result["achievement"])
-        
-        conn.close()
-    except:
-        pass
+    """Report achievements unlocked by the rule engine since the last check."""
+    with _engine_lock:
+        backfill = [] if _engine["loaded"] else _load_engine_state()
+    unlock_achievements(backfill, notified=False)
     
-    # Check XP achievements
-    try:
-        from services.gamification.gamification_service import get_xp_status
-        xp_data = get_xp_status()
-        
-        if xp_data.get("level", 0) >= 5:
-            result = unlock_achievement("level_5")
-            if result.get("success"):
-                newly_unlocked.append(result["achievement"])
-        
-        if xp_data.get("level", 0) >= 10:
-            result = unlock_achievement("level_10")
-            if result.get("success"):
-                newly_unlocked.append(result["achievement"])
-        
-        if xp_data.get("total_xp", 0) >= 1000:
-            result = unlock_achievement("xp_1000")
-            if result.get("success"):
-                newly_unlocked.append(result["achievement"])
-    except:
-        pass
-    
-    # Check time-based achievements
-    hour = datetime.now().hour
-    if hour < 6:
-        result = unlock_achievement("early_bird")
-        if result.get("success"):
-            newly_unlocked.append(result["achievement"])
-    elif hour >= 23:
-        result = unlock_achievement("night_owl")
-        if result.get("success"):
-            newly_unlocked.append(result["achievement"])
+    conn = get_db()
+    rows = conn.execute(
+        "UPDATE user_achievements SET notified = 1 WHERE notified = 0 RETURNING achievement_id"
+    ).fetchall()
+    conn.commit()
+    conn.close()
     
+    newly_unlocked = [ACHIEVEMENTS_BY_ID[row["achievement_id"]] for row in rows
+                      if row["achievement_id"] in ACHIEVEMENTS_BY_ID]
     return {
         "checked": True,
         "newly_unlocked": newly_unlocked,
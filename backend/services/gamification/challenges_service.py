@@ -1,16 +1,35 @@
-"""Challenges Service - Weekly challenges and achievements."""
+"""Challenges Service - Weekly challenges and achievements.
+
+Progress rows are partitioned by week (`week_start`, the Monday), so a new
+week simply starts with empty partitions and past weeks stay as history.
+Progress advances from domain events (see event_bus) rather than client
+calls; `/increment` remains for manual adjustments.
+"""
 
 from fastapi import APIRouter
 from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime, date, timedelta
+import asyncio
+import copy
 import sqlite3
 import os
+import threading
+
+from event_bus import USER_ACTION_EVENTS, subscribe
+from services.jobs.job_queue import job_queue
 
 router = APIRouter()
 
+# /weekly view cache, dropped on every increment/reset and when the week changes
+_weekly_cache = {"generation": 0}
+_weekly_cache_lock = threading.Lock()
+
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "app.db")
 
+# Challenge XP goes to the single app user
+XP_USER_ID = 1
+
 
 def get_db():
     conn = sqlite3.connect(DB_PATH)
@@ -18,21 +37,46 @@ def get_db():
     return conn
 
 
+def week_start_for(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def current_week_start() -> str:
+    return week_start_for(date.today()).isoformat()
+
+
+PROGRESS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        challenge_id TEXT NOT NULL,
+        week_start TEXT NOT NULL,
+        progress INTEGER DEFAULT 0,
+        completed INTEGER DEFAULT 0,
+        started_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        completed_at TEXT,
+        last_counted_on TEXT,
+        UNIQUE(challenge_id, week_start)
+    )
+"""
+
+
 def init_challenges_table():
     conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS challenge_progress (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            challenge_id TEXT NOT NULL,
-            progress INTEGER DEFAULT 0,
-            completed INTEGER DEFAULT 0,
-            started_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            completed_at TEXT,
-            UNIQUE(challenge_id)
-        )
-    """)
+    columns = {row["name"] for row in cursor.execute("PRAGMA table_info(challenge_progress)")}
+    if columns and "week_start" not in columns:
+        # Old single-row-per-challenge table: rebuild with the (challenge, week) key,
+        # keeping existing progress as the current week
+        cursor.execute(PROGRESS_TABLE_SQL.format(table="challenge_progress_weekly"))
+        cursor.execute("""
+            INSERT INTO challenge_progress_weekly (challenge_id, week_start, progress, completed, started_at, completed_at)
+            SELECT challenge_id, ?, progress, completed, started_at, completed_at FROM challenge_progress
+        """, (current_week_start(),))
+        cursor.execute("DROP TABLE challenge_progress")
+        cursor.execute("ALTER TABLE challenge_progress_weekly RENAME TO challenge_progress")
+    else:
+        cursor.execute(PROGRESS_TABLE_SQL.format(table="challenge_progress"))
     
     conn.commit()
     conn.close()
@@ -96,35 +140,54 @@ WEEKLY_CHALLENGES = [
 ]
 
 
+def _progress_from_row(row) -> dict:
+    if row:
+        return {
+            "progress": row["progress"],
+            "completed": bool(row["completed"]),
+            "started_at": row["started_at"],
+            "completed_at": row["completed_at"]
+        }
+    return {"progress": 0, "completed": False, "started_at": None, "completed_at": None}
+
+
+def get_all_progress(week_start: Optional[str] = None) -> dict:
+    """Progress for every challenge in a week, keyed by challenge id (one query)."""
+    conn = get_db()
+    rows = conn.execute(
+        "SELECT * FROM challenge_progress WHERE week_start = ?", (week_start or current_week_start(),)
+    ).fetchall()
+    conn.close()
+    by_id = {row["challenge_id"]: row for row in rows}
+    return {c["id"]: _progress_from_row(by_id.get(c["id"])) for c in WEEKLY_CHALLENGES}
+
+
 def get_challenge_progress(challenge_id: str) -> dict:
-    """Get current progress for a challenge."""
+    """Get this week's progress for a challenge."""
     conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute("""
-        SELECT * FROM challenge_progress WHERE challenge_id = ?
-    """, (challenge_id,))
+        SELECT * FROM challenge_progress WHERE challenge_id = ? AND week_start = ?
+    """, (challenge_id, current_week_start()))
     
     row = cursor.fetchone()
     conn.close()
     
-    if row:
-        return {
-            "progress": row["progress"],
-            "completed": bool(row["completed"]),
-            "started_at": row["started_at"],
-            "completed_at": row["completed_at"]
-        }
-    return {"progress": 0, "completed": False, "started_at": None, "completed_at": None}
+    return _progress_from_row(row)
 
 
-@router.get("/weekly")
-def get_weekly_challenges():
-    """Get all weekly challenges with progress."""
+def invalidate_weekly_cache():
+    with _weekly_cache_lock:
+        _weekly_cache.update(generation=_weekly_cache["generation"] + 1, week_start=None, view=None)
+
+
+def _build_weekly_view(week_start: date) -> dict:
+    progress = get_all_progress(week_start.isoformat())
     challenges = []
     
     for challenge in WEEKLY_CHALLENGES:
-        progress_data = get_challenge_progress(challenge["id"])
+        progress_data = progress[challenge["id"]]
         
         challenges.append({
             **challenge,
@@ -138,89 +201,196 @@ def get_weekly_challenges():
     
     return {
         "challenges": challenges,
-        "week_start": (date.today() - timedelta(days=date.today().weekday())).isoformat(),
-        "week_end": (date.today() + timedelta(days=6-date.today().weekday())).isoformat(),
-        "total_xp_available": sum(c["xp_reward"] for c in WEEKLY_CHALLENGES if not get_challenge_progress(c["id"])["completed"])
+        "week_start": week_start.isoformat(),
+        "week_end": (week_start + timedelta(days=6)).isoformat(),
+        "total_xp_available": sum(c["xp_reward"] for c in challenges if not c["completed"])
     }
 
 
-@router.post("/{challenge_id}/increment")
-def increment_challenge(challenge_id: str, amount: int = 1):
-    """Increment progress on a challenge."""
+@router.get("/weekly")
+def get_weekly_challenges():
+    """Get all weekly challenges with progress."""
+    week_start = week_start_for(date.today())
+    with _weekly_cache_lock:
+        if _weekly_cache.get("week_start") == week_start:
+            return copy.deepcopy(_weekly_cache["view"])
+        generation = _weekly_cache["generation"]
+    
+    view = _build_weekly_view(week_start)
+    with _weekly_cache_lock:
+        # Don't cache a view that an increment made stale while it was being built
+        if _weekly_cache["generation"] == generation:
+            _weekly_cache.update(week_start=week_start, view=view)
+    return copy.deepcopy(view)
+
+
+CHALLENGES_BY_ID = {c["id"]: c for c in WEEKLY_CHALLENGES}
+
+# Challenge id -> (event types, condition(payload), counts at most once per day)
+CHALLENGE_TRIGGERS = {
+    "focus_master": ({"focus_session_completed"}, None, False),
+    "nutrition_pro": ({"meal_logged"}, None, False),
+    "mindful_soul": ({"gita_conversation"}, None, False),
+    "habit_streak": ({"habit_completed"},
+                     lambda p: 0 < p.get("active_habits", 0) <= p.get("completed_today", 0), True),
+    "early_bird": (USER_ACTION_EVENTS, lambda p: datetime.now().hour < 7, True),
+}
+
+
+def advance_challenge(challenge_id: str, amount: int = 1, per_day: bool = False) -> Optional[dict]:
+    """Add progress to this week's row in one upsert; awards XP when it completes.
+
+    With per_day=True the challenge counts at most once per calendar day, and
+    None is returned when today was already counted; other increments leave
+    the day's per-day count untouched. The XP is committed with the
+    completion, so a failed grant leaves the challenge incomplete.
+    """
+    from services.gamification.gamification_service import apply_xp_grants, xp_granted
+    challenge = CHALLENGES_BY_ID[challenge_id]
+    week_start = current_week_start()
+    counted_on = date.today().isoformat() if per_day else None
+    
     conn = get_db()
     cursor = conn.cursor()
+    try:
+        row = cursor.execute("""
+            INSERT INTO challenge_progress (challenge_id, week_start, progress, last_counted_on)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(challenge_id, week_start) DO UPDATE
+            SET progress = progress + excluded.progress,
+                last_counted_on = COALESCE(excluded.last_counted_on, last_counted_on)
+            WHERE excluded.last_counted_on IS NULL OR last_counted_on IS NOT excluded.last_counted_on
+            RETURNING progress, completed
+        """, (challenge_id, week_start, amount, counted_on)).fetchone()
+        
+        just_completed = False
+        applied = None
+        if row and not row["completed"] and row["progress"] >= challenge["target"]:
+            cursor.execute("""
+                UPDATE challenge_progress SET completed = 1, completed_at = ?
+                WHERE challenge_id = ? AND week_start = ? AND completed = 0
+            """, (datetime.now().isoformat(), challenge_id, week_start))
+            just_completed = cursor.rowcount == 1
+            # Award XP if just completed
+            if just_completed:
+                applied = apply_xp_grants(cursor, XP_USER_ID, [{
+                    "amount": challenge["xp_reward"],
+                    "source": "challenge_complete",
+                    "reason": f"Completed: {challenge['name']}"
+                }])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
     
-    # Get current progress
-    cursor.execute("SELECT * FROM challenge_progress WHERE challenge_id = ?", (challenge_id,))
-    existing = cursor.fetchone()
+    if row is None:
+        return None
+    invalidate_weekly_cache()
+    if applied:
+        xp_granted(XP_USER_ID, applied, "challenge_complete")
     
+    return {
+        "progress": row["progress"],
+        "completed": bool(row["completed"]) or just_completed,
+        "just_completed": just_completed,
+        "xp_awarded": challenge["xp_reward"] if applied else 0
+    }
+
+
+@subscribe("*")
+def track_challenges(event_type: str, payload: dict):
+    """Advance the challenges triggered by a domain event."""
+    for challenge_id, (triggers, condition, per_day) in CHALLENGE_TRIGGERS.items():
+        if event_type in triggers and (condition is None or condition(payload)):
+            advance_challenge(challenge_id, per_day=per_day)
+
+
+@router.post("/{challenge_id}/increment")
+def increment_challenge(challenge_id: str, amount: int = 1):
+    """Manually add progress to a challenge."""
     # Find challenge definition
-    challenge = next((c for c in WEEKLY_CHALLENGES if c["id"] == challenge_id), None)
+    challenge = CHALLENGES_BY_ID.get(challenge_id)
     if not challenge:
-        conn.close()
         return {"error": "Challenge not found"}
     
-    if existing:
-        new_progress = existing["progress"] + amount
-        completed = new_progress >= challenge["target"]
-        
-        cursor.execute("""
-            UPDATE challenge_progress 
-            SET progress = ?, completed = ?, completed_at = ?
-            WHERE challenge_id = ?
-        """, (
-            new_progress, 
-            1 if completed else 0,
-            datetime.now().isoformat() if completed and not existing["completed"] else existing["completed_at"],
-            challenge_id
-        ))
-        
-        # Award XP if just completed
-        if completed and not existing["completed"]:
-            try:
-                from services.gamification.gamification_service import add_xp
-                add_xp(challenge["xp_reward"], "challenge_complete", f"Completed: {challenge['name']}")
-            except:
-                pass
-    else:
-        new_progress = amount
-        completed = new_progress >= challenge["target"]
-        
-        cursor.execute("""
-            INSERT INTO challenge_progress (challenge_id, progress, completed, completed_at)
-            VALUES (?, ?, ?, ?)
-        """, (
-            challenge_id, 
-            new_progress, 
-            1 if completed else 0,
-            datetime.now().isoformat() if completed else None
-        ))
-        
-        if completed:
-            try:
-                from services.gamification.gamification_service import add_xp
-                add_xp(challenge["xp_reward"], "challenge_complete", f"Completed: {challenge['name']}")
-            except:
-                pass
-    
-    conn.commit()
-    conn.close()
+    result = advance_challenge(challenge_id, amount)
     
     return {
         "success": True,
         "challenge_id": challenge_id,
-        "new_progress": new_progress,
-        "completed": completed,
-        "xp_awarded": challenge["xp_reward"] if completed else 0
+        "new_progress": result["progress"],
+        "completed": result["completed"],
+        "xp_awarded": result["xp_awarded"]
     }
 
 
+@router.get("/history")
+def get_challenge_history(weeks: int = 8):
+    """Completed challenges and progress per past week (index range read)."""
+    since = week_start_for(date.today() - timedelta(weeks=max(weeks, 1) - 1)).isoformat()
+    conn = get_db()
+    rows = conn.execute("""
+        SELECT week_start, challenge_id, progress, completed, completed_at
+        FROM challenge_progress WHERE week_start >= ? ORDER BY week_start DESC
+    """, (since,)).fetchall()
+    conn.close()
+    
+    history = {}
+    for row in rows:
+        week = history.setdefault(row["week_start"], {"week_start": row["week_start"], "completed": 0, "xp_earned": 0, "challenges": []})
+        challenge = CHALLENGES_BY_ID.get(row["challenge_id"], {})
+        week["challenges"].append(dict(row))
+        if row["completed"]:
+            week["completed"] += 1
+            week["xp_earned"] += challenge.get("xp_reward", 0)
+    return {"weeks": list(history.values())}
+
+
 @router.post("/reset-weekly")
 def reset_weekly_challenges():
-    """Reset all challenges for new week."""
+    """Reset this week's challenges (past weeks are kept)."""
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM challenge_progress")
+    cursor.execute("""
+        UPDATE challenge_progress
+        SET progress = 0, completed = 0, completed_at = NULL, last_counted_on = NULL
+        WHERE week_start = ?
+    """, (current_week_start(),))
     conn.commit()
     conn.close()
+    invalidate_weekly_cache()
     return {"success": True, "message": "Weekly challenges reset"}
+
+
+@job_queue.register("challenge_rollover")
+def rollover_week(payload: dict = None, progress=None) -> dict:
+    """Open the current week's partition and summarize the week that just ended."""
+    week_start = current_week_start()
+    previous = (date.fromisoformat(week_start) - timedelta(days=7)).isoformat()
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT OR IGNORE INTO challenge_progress (challenge_id, week_start) VALUES (?, ?)",
+        [(c["id"], week_start) for c in WEEKLY_CHALLENGES]
+    )
+    summary = cursor.execute("""
+        SELECT COUNT(*) AS tracked, COALESCE(SUM(completed), 0) AS completed
+        FROM challenge_progress WHERE week_start = ?
+    """, (previous,)).fetchone()
+    conn.commit()
+    conn.close()
+    invalidate_weekly_cache()
+    
+    return {"week_start": week_start, "previous_week": previous, "previous_completed": summary["completed"]}
+
+
+async def run_rollover_scheduler():
+    """Enqueue a rollover now and then at the start of every week (runs for the app lifetime)."""
+    while True:
+        job_queue.enqueue("challenge_rollover")
+        now = datetime.now()
+        next_week = datetime.combine(week_start_for(now.date()) + timedelta(days=7), datetime.min.time())
+        await asyncio.sleep((next_week - now).total_seconds() + 1)
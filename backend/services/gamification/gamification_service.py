@@ -1,106 +1,325 @@
 from fastapi import APIRouter, HTTPException
 from database import get_db_connection
-from datetime import datetime
+from event_bus import publish
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+from bisect import bisect_right
+import os
+import threading
+import time
 
 router = APIRouter()
 
-LEVEL_THRESHOLDS = {
-    1: 0,
-    2: 100,
-    3: 300,
-    4: 600,
-    5: 1000,
-    6: 1500,
-    7: 2100,
-    8: 2800,
-    9: 3600,
-    10: 5000
-}
+# get_xp_status() cache; grant_xp invalidates it, the TTL covers writes from other processes
+XP_STATUS_TTL = float(os.getenv("XP_STATUS_TTL", "60"))
+_xp_status_cache: Dict[int, Dict] = {}
+_xp_status_lock = threading.Lock()
+
+# Leveling curve: reaching level L takes LEVEL_XP_BASE * (L - 1) * L / 2 XP
+# (100, 300, 600, 1000, ... with the default base). Level 10 keeps the original
+# table's 5000 XP, so from there on every threshold sits 5 * LEVEL_XP_BASE higher.
+# Thresholds are precomputed once, so lookups are a bisect no matter how many
+# levels there are.
+LEVEL_XP_BASE = int(os.getenv("LEVEL_XP_BASE", "100"))
+MAX_LEVEL = int(os.getenv("MAX_LEVEL", "100"))
+
+LEVEL_THRESHOLDS = [
+    LEVEL_XP_BASE * ((level - 1) * level // 2 + (5 if level >= 10 else 0))
+    for level in range(1, MAX_LEVEL + 1)
+]
+
 
 def get_level_from_xp(xp):
-    current_level = 1
-    for level, threshold in LEVEL_THRESHOLDS.items():
-        if xp >= threshold:
-            current_level = level
-        else:
-            break
-    return current_level
+    return max(bisect_right(LEVEL_THRESHOLDS, xp), 1)
 
-@router.get("/stats")
-def get_user_stats():
-    """Get user's gamification stats."""
+
+def xp_for_level(level: int) -> int:
+    """Total XP needed to reach `level`."""
+    return LEVEL_THRESHOLDS[min(max(level, 1), MAX_LEVEL) - 1]
+
+
+def xp_to_next_level(xp: int) -> int:
+    """XP still missing for the next level (0 at MAX_LEVEL)."""
+    level = get_level_from_xp(xp)
+    if level >= MAX_LEVEL:
+        return 0
+    return xp_for_level(level + 1) - xp
+
+
+def init_xp_ledger():
+    """Append-only XP ledger; user_stats.xp is the running total of its events."""
     conn = get_db_connection()
     cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM user_stats WHERE id = 1")
-    stats = dict(cursor.fetchone())
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS xp_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL DEFAULT 1,
+            amount INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            reason TEXT,
+            created_at TEXT NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_xp_events_user_time ON xp_events (user_id, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_xp_events_source_time ON xp_events (source, created_at)")
+
+    # XP earned before the ledger existed becomes one opening event, so the
+    # ledger always sums to user_stats.xp
+    cursor.execute("""
+        INSERT INTO xp_events (user_id, amount, source, reason, created_at)
+        SELECT id, xp, 'opening_balance', 'XP earned before the ledger', '1970-01-01T00:00:00'
+        FROM user_stats
+        WHERE xp > 0 AND NOT EXISTS (SELECT 1 FROM xp_events WHERE xp_events.user_id = user_stats.id)
+    """)
+    conn.commit()
     conn.close()
-    
+
+
+init_xp_ledger()
+
+
+def xp_since(start: str, user_id: int = 1, end: Optional[str] = None) -> int:
+    """XP earned in [start, end) - an index range sum over the ledger."""
+    query = "SELECT COALESCE(SUM(amount), 0) FROM xp_events WHERE user_id = ? AND created_at >= ?"
+    params = [user_id, start]
+    if end:
+        query += " AND created_at < ?"
+        params.append(end)
+    conn = get_db_connection()
+    total = conn.execute(query, params).fetchone()[0]
+    conn.close()
+    return total
+
+
+def xp_today(user_id: int = 1) -> int:
+    return xp_since(date.today().isoformat(), user_id)
+
+
+def xp_this_week(user_id: int = 1) -> int:
+    """XP since Monday."""
+    today = date.today()
+    return xp_since((today - timedelta(days=today.weekday())).isoformat(), user_id)
+
+
+def _load_xp_status(user_id: int) -> Optional[Dict]:
+    today = date.today()
+    week_start = today - timedelta(days=today.weekday())
+    conn = get_db_connection()
+    stats = conn.execute("SELECT xp, level FROM user_stats WHERE id = ?", (user_id,)).fetchone()
+    # One index range scan over this week's events covers both sums
+    ranges = conn.execute("""
+        SELECT COALESCE(SUM(CASE WHEN created_at >= ? THEN amount ELSE 0 END), 0) AS today,
+               COALESCE(SUM(amount), 0) AS week
+        FROM xp_events WHERE user_id = ? AND created_at >= ?
+    """, (today.isoformat(), user_id, week_start.isoformat())).fetchone()
+    conn.close()
+    if not stats:
+        return None
+
     # Calculate progress to next level
-    current_level = stats['level']
     current_xp = stats['xp']
-    next_level_xp = LEVEL_THRESHOLDS.get(current_level + 1, 10000)
-    prev_level_xp = LEVEL_THRESHOLDS.get(current_level, 0)
-    
-    progress = 0
+    current_level = get_level_from_xp(current_xp)
+    next_level_xp = xp_for_level(current_level + 1)
+    prev_level_xp = xp_for_level(current_level)
+
+    progress = 100.0
     if next_level_xp > prev_level_xp:
         progress = (current_xp - prev_level_xp) / (next_level_xp - prev_level_xp) * 100
-        
+
     return {
-        **stats,
+        "level": current_level,
+        "title": get_title_for_level(current_level),
+        "total_xp": current_xp,
+        "current_xp": current_xp,
         "next_level_xp": next_level_xp,
+        "xp_to_next_level": xp_to_next_level(current_xp),
         "progress": round(progress, 1),
-        "title": get_title_for_level(current_level)
+        "xp_today": ranges["today"],
+        "xp_this_week": ranges["week"]
     }
 
-def grant_xp(user_id: int, amount: int):
-    """Internal function to grant XP to a user."""
+
+def get_xp_status(user_id: int = 1) -> Dict:
+    """Level, total XP, XP today / this week and level progress.
+
+    Served from memory until the next grant_xp (or the TTL / day rolls over),
+    so the dashboard, report and profile services read it for free.
+    """
+    now = time.monotonic()
+    today = date.today().isoformat()
+    with _xp_status_lock:
+        cached = _xp_status_cache.get(user_id)
+        if cached and cached["day"] == today and now - cached["at"] < XP_STATUS_TTL:
+            return dict(cached["status"])
+
+    status = _load_xp_status(user_id)
+    if status is None:
+        return {"level": 1, "title": get_title_for_level(1), "total_xp": 0, "current_xp": 0,
+                "next_level_xp": xp_for_level(2), "xp_to_next_level": xp_for_level(2), "progress": 0, "xp_today": 0, "xp_this_week": 0}
+    with _xp_status_lock:
+        _xp_status_cache[user_id] = {"status": status, "day": today, "at": now}
+    return dict(status)
+
+
+def invalidate_xp_status(user_id: int = 1):
+    with _xp_status_lock:
+        _xp_status_cache.pop(user_id, None)
+
+
+@router.get("/stats")
+def get_user_stats():
+    """Get user's gamification stats."""
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute("SELECT xp, level FROM user_stats WHERE id = ?", (user_id,))
-    row = cursor.fetchone()
+    cursor.execute("SELECT * FROM user_stats WHERE id = 1")
+    stats = dict(cursor.fetchone())
+    conn.close()
     
-    # Handle case where user_stats might not exist yet (though init_db should handle it)
+    status = get_xp_status()
+    return {
+        **stats,
+        "next_level_xp": status["next_level_xp"],
+        "xp_to_next_level": status["xp_to_next_level"],
+        "progress": status["progress"],
+        "title": status["title"],
+        "xp_today": status["xp_today"],
+        "xp_this_week": status["xp_this_week"]
+    }
+
+def apply_xp_grants(cursor, user_id: int, grants: List[Dict]) -> Optional[Dict]:
+    """Append ledger events and bump the total on the caller's cursor (no commit).
+
+    Each grant is {"amount", "source", "reason", "created_at"}. The total moves by
+    a single `xp = xp + ?`, so concurrent writers never overwrite each other.
+    Returns None if the user has no stats row.
+    """
+    now = datetime.now().isoformat()
+    total = 0
+    for grant in grants:
+        cursor.execute(
+            "INSERT INTO xp_events (user_id, amount, source, reason, created_at) VALUES (?, ?, ?, ?, ?)",
+            (user_id, grant["amount"], grant.get("source") or "general", grant.get("reason"), grant.get("created_at") or now)
+        )
+        total += grant["amount"]
+    event_id = cursor.lastrowid
+    row = cursor.execute(
+        "UPDATE user_stats SET xp = xp + ? WHERE id = ? RETURNING xp, level", (total, user_id)
+    ).fetchone()
     if not row:
-        conn.close()
         return None
 
-    current_xp = row['xp']
-    current_level = row['level']
-    
-    new_xp = current_xp + amount
+    new_xp, current_level = row["xp"], row["level"]
     new_level = get_level_from_xp(new_xp)
-    
-    cursor.execute("UPDATE user_stats SET xp = ?, level = ? WHERE id = ?", (new_xp, new_level, user_id))
-    conn.commit()
-    conn.close()
-    
+    if new_level != current_level:
+        cursor.execute("UPDATE user_stats SET level = ? WHERE id = ?", (new_level, user_id))
     return {
+        "amount": total,
         "new_xp": new_xp,
         "new_level": new_level,
-        "leveled_up": new_level > current_level
+        "leveled_up": new_level > current_level,
+        "event_id": event_id
     }
 
+
+def xp_granted(user_id: int, result: Dict, source: str):
+    """Post-commit bookkeeping for a grant: drop the status cache and publish the event."""
+    invalidate_xp_status(user_id)
+    publish("xp_granted", {"user_id": user_id, "source": source, **result})
+
+
+def grant_xp(user_id: int, amount: int, source: str = "general", reason: Optional[str] = None):
+    """Internal function to grant XP to a user.
+
+    Appends a ledger event and increments the total with `xp = xp + ?` in the
+    same transaction, so concurrent grants never overwrite each other.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        applied = apply_xp_grants(cursor, user_id, [{"amount": amount, "source": source, "reason": reason}])
+
+        # Handle case where user_stats might not exist yet (though init_db should handle it)
+        if not applied:
+            conn.rollback()
+            return None
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    result = {key: applied[key] for key in ("new_xp", "new_level", "leveled_up", "event_id")}
+    xp_granted(user_id, {"amount": amount, **result}, source)
+    return result
+
+
+def add_xp(amount: int, source: str = "manual", reason: Optional[str] = None, user_id: int = 1):
+    """Grant XP to the default user with a ledger source/reason (used across services)."""
+    return grant_xp(user_id, amount, source, reason)
+
+
 @router.post("/add-xp")
-def add_xp(amount: int = 10):
+def add_xp_endpoint(amount: int = 10, source: str = "manual", reason: Optional[str] = None):
     """Add XP to user (API Endpoint)."""
-    result = grant_xp(1, amount)
+    result = add_xp(amount, source, reason)
     if not result:
-         raise HTTPException(status_code=404, detail="User stats not found")
+        raise HTTPException(status_code=404, detail="User stats not found")
     return result
 
+
+@router.post("/focus-session")
+def complete_focus_session(minutes: int = 25, mode: str = "focus"):
+    """Record a finished focus timer; breaks earn less XP and do not count as sessions."""
+    is_focus = mode == "focus"
+    result = add_xp(
+        50 if is_focus else 10,
+        "focus_session" if is_focus else "focus_break",
+        f"Completed {minutes}-min {'Focus' if is_focus else 'Break'} session"
+    )
+    if not result:
+        raise HTTPException(status_code=404, detail="User stats not found")
+    if is_focus:
+        publish("focus_session_completed", {"minutes": minutes})
+    return result
+
+
+@router.get("/xp-history")
+def get_xp_history(limit: int = 50, source: Optional[str] = None):
+    """Most recent XP ledger events, newest first."""
+    query = "SELECT * FROM xp_events WHERE user_id = 1"
+    params = []
+    if source:
+        query += " AND source = ?"
+        params.append(source)
+    query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(max(min(limit, 500), 1))
+
+    conn = get_db_connection()
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    return {"events": [dict(row) for row in rows]}
+
+# (first level, title); levels past the last entry keep the highest title
+LEVEL_TITLES = [
+    (1, "Novice"),
+    (2, "Apprentice"),
+    (3, "Seeker"),
+    (4, "Achiever"),
+    (5, "Pro"),
+    (6, "Master"),
+    (7, "Grandmaster"),
+    (8, "Legend"),
+    (9, "Demi-God"),
+    (10, "God Level"),
+    (20, "Mythic"),
+    (30, "Immortal"),
+    (50, "Cosmic"),
+    (75, "Transcendent"),
+]
+_TITLE_LEVELS = [level for level, _ in LEVEL_TITLES]
+
+
 def get_title_for_level(level):
-    titles = {
-        1: "Novice",
-        2: "Apprentice",
-        3: "Seeker",
-        4: "Achiever",
-        5: "Pro",
-        6: "Master",
-        7: "Grandmaster",
-        8: "Legend",
-        9: "Demi-God",
-        10: "God Level"
-    }
-    return titles.get(level, "Novice")
+    return LEVEL_TITLES[max(bisect_right(_TITLE_LEVELS, level) - 1, 0)][1]
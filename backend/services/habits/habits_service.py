@@ -7,6 +7,8 @@ from datetime import datetime, date
 import sqlite3
 import os
 
+import outbox
+
 router = APIRouter()
 
 # Database path
@@ -74,9 +76,10 @@ class HabitUpdate(BaseModel):
     active: Optional[bool] = None
 
 
-def calculate_streak(habit_id: int) -> int:
-    """Calculate current streak for a habit."""
-    conn = get_db()
+def calculate_streak(habit_id: int, conn=None) -> int:
+    """Calculate current streak for a habit (on `conn` if given, e.g. inside an open transaction)."""
+    own_conn = conn is None
+    conn = conn or get_db()
     cursor = conn.cursor()
     
     cursor.execute("""
@@ -86,7 +89,8 @@ def calculate_streak(habit_id: int) -> int:
     """, (habit_id,))
     
     completions = [row["completed_date"] for row in cursor.fetchall()]
-    conn.close()
+    if own_conn:
+        conn.close()
     
     if not completions:
         return 0
@@ -202,18 +206,31 @@ def toggle_habit(habit_id: int):
         """, (habit_id, today))
         completed = True
         message = "Habit completed! 🔥"
-        
-        # Award XP for completing a habit
-        try:
-            from services.gamification.gamification_service import add_xp
-            add_xp(25, "habit_complete", f"Completed daily habit")
-        except Exception:
-            pass
     
-    conn.commit()
+    new_streak = calculate_streak(habit_id, conn)
     
-    new_streak = calculate_streak(habit_id)
+    # XP and achievement/challenge updates go through the outbox, committed with the completion
+    if completed:
+        cursor.execute("""
+            SELECT (SELECT COUNT(*) FROM habits WHERE active = 1) AS active_habits,
+                   (SELECT COUNT(DISTINCT habit_id) FROM habit_completions WHERE completed_date = ?) AS completed_today
+        """, (today,))
+        day = cursor.fetchone()
+        outbox.record(
+            cursor, "habit_completed",
+            event={
+                "habit_id": habit_id,
+                "streak": new_streak,
+                "active_habits": day["active_habits"],
+                "completed_today": day["completed_today"]
+            },
+            xp={"amount": 25, "source": "habit_complete", "reason": "Completed daily habit"}
+        )
+    
+    conn.commit()
     conn.close()
+    if completed:
+        outbox.notify()
     
     return {
         "success": True,
@@ -0,0 +1,244 @@
+"""SQLite-persisted background job queue.
+
+Slow LLM work (dream interpretation, memory fusion, dashboard insights,
+vision parsing) is enqueued here instead of running inside the request.
+Jobs are rows in the `jobs` table and executed by an in-process worker pool;
+handlers are plain functions registered per job kind. Because state lives in
+SQLite, status survives restarts and jobs interrupted mid-run are re-queued
+by `recover()` on startup.
+"""
+import json
+import os
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from fastapi.responses import JSONResponse
+
+DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "app.db")
+
+# Uploaded files handed to jobs are spooled here (e.g. images for vision jobs)
+JOB_FILES_DIR = os.getenv(
+    "JOB_FILES_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "job_files")
+)
+
+WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+TERMINAL_STATUSES = ("completed", "failed")
+
+# A handler receives the job payload and a progress callback, and returns a JSON-serializable result
+Handler = Callable[[Dict, Callable[[Dict], None]], Dict]
+
+
+def get_db():
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init_jobs_table():
+    conn = get_db()
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            payload TEXT,
+            progress TEXT,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER DEFAULT 0,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_kind ON jobs (kind, created_at)")
+
+    conn.commit()
+    conn.close()
+
+
+init_jobs_table()
+
+
+def spooled_paths(payload) -> List[str]:
+    """Spooled input files referenced by a payload ("path" values under JOB_FILES_DIR)."""
+    if isinstance(payload, list):
+        return [path for item in payload for path in spooled_paths(item)]
+    if not isinstance(payload, dict):
+        return []
+    paths = []
+    for key, value in payload.items():
+        if key == "path" and isinstance(value, str):
+            if os.path.dirname(os.path.abspath(value)) == os.path.abspath(JOB_FILES_DIR):
+                paths.append(value)
+        else:
+            paths.extend(spooled_paths(value))
+    return paths
+
+
+def _row_to_job(row: sqlite3.Row) -> Dict:
+    job = dict(row)
+    for field in ("payload", "progress", "result"):
+        job[field] = json.loads(job[field]) if job[field] else None
+    return job
+
+
+class JobQueue:
+    """Runs registered job handlers on a thread pool, tracking state in SQLite."""
+
+    def __init__(self, workers: int = WORKERS):
+        self.workers = workers
+        self._handlers: Dict[str, Handler] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def register(self, kind: str):
+        """Decorator registering the handler for a job kind."""
+        def decorator(func: Handler) -> Handler:
+            self._handlers[kind] = func
+            return func
+        return decorator
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job-worker")
+        return self._executor
+
+    def enqueue(self, kind: str, payload: Optional[Dict] = None) -> Dict:
+        """Persist a job and schedule it; returns the job record."""
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+
+        job_id = uuid.uuid4().hex
+        conn = get_db()
+        conn.execute(
+            "INSERT INTO jobs (id, kind, status, payload, created_at) VALUES (?, ?, 'queued', ?, ?)",
+            (job_id, kind, json.dumps(payload or {}), datetime.now().isoformat())
+        )
+        conn.commit()
+        conn.close()
+
+        self._get_executor().submit(self._run, job_id)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        conn = get_db()
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        conn.close()
+        return _row_to_job(row) if row else None
+
+    def list(self, kind: Optional[str] = None, status: Optional[str] = None, limit: int = 20) -> List[Dict]:
+        query = "SELECT * FROM jobs WHERE 1 = 1"
+        params: List = []
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+
+        conn = get_db()
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+        return [_row_to_job(row) for row in rows]
+
+    def _update(self, job_id: str, **fields):
+        for field in ("progress", "result"):
+            if field in fields:
+                fields[field] = json.dumps(fields[field], default=str)
+        conn = get_db()
+        conn.execute(
+            f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+            [*fields.values(), job_id]
+        )
+        conn.commit()
+        conn.close()
+
+    def _run(self, job_id: str):
+        job = self.get(job_id)
+        if not job or job["status"] in TERMINAL_STATUSES:
+            return
+
+        handler = self._handlers.get(job["kind"])
+        if handler is None:
+            self._update(job_id, status="failed", error=f"Unknown job kind '{job['kind']}'",
+                         finished_at=datetime.now().isoformat())
+            self._remove_spooled(job)
+            return
+
+        self._update(job_id, status="running", attempts=job["attempts"] + 1,
+                     started_at=datetime.now().isoformat())
+        try:
+            result = handler(job["payload"] or {}, lambda progress: self._update(job_id, progress=progress))
+            self._update(job_id, status="completed", result=result, finished_at=datetime.now().isoformat())
+        except Exception as e:
+            print(f"Job {job['kind']} {job_id} failed: {e}")
+            self._update(job_id, status="failed", error=str(e), finished_at=datetime.now().isoformat())
+        # Only a terminal job gives up its input; an interrupted one is re-run by recover()
+        self._remove_spooled(job)
+
+    @staticmethod
+    def _remove_spooled(job: Dict):
+        for path in spooled_paths(job["payload"]):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def recover(self) -> int:
+        """Re-schedule jobs left queued or running by a previous process."""
+        conn = get_db()
+        rows = conn.execute(
+            "SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+        ).fetchall()
+        conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+        conn.commit()
+        conn.close()
+
+        for row in rows:
+            self._get_executor().submit(self._run, row["id"])
+        return len(rows)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def spool_path(suffix: str = "") -> str:
+    """A fresh path in JOB_FILES_DIR for job input.
+
+    Pass it in the payload under a "path" key: the queue removes the file once
+    the job is completed or failed, so it survives restarts until then.
+    """
+    os.makedirs(JOB_FILES_DIR, exist_ok=True)
+    return os.path.join(JOB_FILES_DIR, f"{uuid.uuid4().hex}{suffix}")
+
+
+def spool_file(data: bytes, suffix: str = "") -> str:
+    """Write job input bytes to a spool_path()."""
+    path = spool_path(suffix)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def accepted(job: Dict) -> JSONResponse:
+    """202 response pointing the client at the job status endpoints."""
+    return JSONResponse(status_code=202, content={
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['id']}",
+        "events_url": f"/jobs/{job['id']}/events"
+    })
+
+
+# Global instance
+job_queue = JobQueue()
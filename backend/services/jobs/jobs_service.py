@@ -0,0 +1,52 @@
+"""Job status endpoints: polling and Server-Sent Events."""
+import asyncio
+import json
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+
+from .job_queue import job_queue, TERMINAL_STATUSES
+
+router = APIRouter()
+
+SSE_POLL_SECONDS = 0.5
+
+
+@router.get("/")
+def list_jobs(kind: Optional[str] = None, status: Optional[str] = None, limit: int = 20):
+    """Recent jobs, optionally filtered by kind and status."""
+    jobs = job_queue.list(kind=kind, status=status, limit=min(limit, 100))
+    return {"jobs": jobs, "total": len(jobs)}
+
+
+@router.get("/{job_id}")
+def get_job(job_id: str):
+    """Current status, progress and result of a job."""
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/{job_id}/events")
+async def stream_job(job_id: str):
+    """Push job status changes as Server-Sent Events until the job finishes."""
+    if not job_queue.get(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        last = None
+        while True:
+            job = job_queue.get(job_id)
+            snapshot = (job["status"], json.dumps(job["progress"], default=str))
+            if snapshot != last:
+                last = snapshot
+                event = "done" if job["status"] in TERMINAL_STATUSES else "status"
+                yield f"event: {event}\ndata: {json.dumps(job, default=str)}\n\n"
+            if job["status"] in TERMINAL_STATUSES:
+                break
+            await asyncio.sleep(SSE_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
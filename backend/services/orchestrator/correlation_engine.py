@@ -0,0 +1,249 @@
+"""Statistical correlation stage for Memory Fusion.
+
+Aligns finance, diet, mood and habit logs into a daily feature matrix and
+computes lagged Pearson correlations between features from different
+domains. Significance uses the Fisher z-transform, with Benjamini-Hochberg
+correction across all tested pairs, so `confidence` is 1 - q rather than a
+number invented by the LLM. Only the top findings leave this module.
+"""
+import math
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from database import get_db_connection
+from services.emotional import mood_store
+
+MAX_LAG_DAYS = int(os.getenv("FUSION_MAX_LAG_DAYS", "2"))
+MIN_OVERLAP_DAYS = int(os.getenv("FUSION_MIN_OVERLAP_DAYS", "7"))
+MAX_Q_VALUE = float(os.getenv("FUSION_MAX_Q_VALUE", "0.1"))
+# Spending categories need this many active days to get their own feature
+MIN_CATEGORY_DAYS = 3
+
+DIET_COLUMNS = ("calories", "protein", "carbs", "fat")
+
+FEATURE_LABELS = {
+    "spend_total": "total spending",
+    "calories": "calorie intake",
+    "protein": "protein intake",
+    "carbs": "carb intake",
+    "fat": "fat intake",
+    "mood_score": "mood",
+    "habit_rate": "habit completion"
+}
+
+DOMAIN_ACTIONS = {
+    frozenset(("Finance", "Emotional")): "Pause before non-essential purchases on low-mood days; a short walk or breathing break helps.",
+    frozenset(("Diet", "Emotional")): "Plan balanced meals ahead for the days this pattern shows up.",
+    frozenset(("Finance", "Diet")): "Batch-cook or plan meals to keep food spending predictable.",
+    frozenset(("Habits", "Emotional")): "Protect your habit routine; it moves with your mood.",
+    frozenset(("Habits", "Finance")): "Use your habit streak as a cue to review spending.",
+    frozenset(("Habits", "Diet")): "Pair a habit with meal prep to reinforce both."
+}
+
+
+def feature_domain(feature: str) -> str:
+    if feature.startswith("spend_"):
+        return "Finance"
+    if feature in DIET_COLUMNS:
+        return "Diet"
+    if feature == "mood_score":
+        return "Emotional"
+    return "Habits"
+
+
+def feature_label(feature: str) -> str:
+    if feature in FEATURE_LABELS:
+        return FEATURE_LABELS[feature]
+    return f"{feature[len('spend_'):]} spending"
+
+
+def load_daily_features(days: int = 28, end: Optional[datetime] = None) -> pd.DataFrame:
+    """One row per day, one column per feature. Missing logs are NaN (spend defaults to 0)."""
+    end_date = (end or datetime.now()).date()
+    start_date = end_date - timedelta(days=days - 1)
+    index = pd.date_range(start_date, end_date, freq="D")
+    start = start_date.isoformat()
+
+    conn = get_db_connection()
+    tx = pd.read_sql_query(
+        "SELECT substr(date, 1, 10) AS day, category, amount FROM transactions WHERE type = 'expense' AND date >= ?",
+        conn, params=(start,)
+    )
+    meals = pd.read_sql_query(
+        f"SELECT substr(date, 1, 10) AS day, {', '.join(f'SUM({c}) AS {c}' for c in DIET_COLUMNS)} "
+        "FROM meals WHERE date >= ? GROUP BY day",
+        conn, params=(start,)
+    )
+    try:
+        habits = pd.read_sql_query(
+            "SELECT completed_date AS day, COUNT(*) AS completions FROM habit_completions "
+            "WHERE completed_date >= ? GROUP BY completed_date",
+            conn, params=(start,)
+        )
+        active_habits = conn.execute("SELECT COUNT(*) FROM habits WHERE active = 1").fetchone()[0]
+    except (sqlite3.OperationalError, pd.errors.DatabaseError):
+        habits, active_habits = None, 0
+    conn.close()
+
+    features = pd.DataFrame(index=index)
+
+    if not tx.empty:
+        tx["day"] = pd.to_datetime(tx["day"], errors="coerce")
+        tx = tx.dropna(subset=["day"])
+        features["spend_total"] = tx.groupby("day")["amount"].sum().reindex(index, fill_value=0.0)
+        by_category = tx.pivot_table(index="day", columns="category", values="amount", aggfunc="sum")
+        for category in by_category.columns:
+            column = by_category[category].reindex(index)
+            if column.notna().sum() >= MIN_CATEGORY_DAYS:
+                features[f"spend_{category}"] = column.fillna(0.0)
+
+    if not meals.empty:
+        meals["day"] = pd.to_datetime(meals["day"], errors="coerce")
+        meals = meals.dropna(subset=["day"]).set_index("day")
+        for column in DIET_COLUMNS:
+            features[column] = meals[column].reindex(index).astype(float)
+
+    # Valence is normalized by the mood store at write time
+    moods = pd.DataFrame(mood_store.get_moods(start), columns=["timestamp", "valence", "intensity"])
+    moods = moods.dropna(subset=["valence"])
+    if not moods.empty:
+        moods["day"] = pd.to_datetime(moods["timestamp"].str[:10], errors="coerce")
+        moods["score"] = moods["valence"] * moods["intensity"].fillna(5) / 10
+        features["mood_score"] = moods.groupby("day")["score"].mean().reindex(index)
+
+    if habits is not None and active_habits:
+        habits["day"] = pd.to_datetime(habits["day"], errors="coerce")
+        features["habit_rate"] = (
+            habits.groupby("day")["completions"].sum().reindex(index, fill_value=0) / active_habits
+        )
+
+    return features
+
+
+def fisher_p_value(r: float, n: int) -> float:
+    """Two-sided p-value for a Pearson r over n samples (Fisher z approximation)."""
+    if n <= 3:
+        return 1.0
+    r = max(min(r, 0.999999), -0.999999)
+    z = math.atanh(r) * math.sqrt(n - 3)
+    return math.erfc(abs(z) / math.sqrt(2))
+
+
+def benjamini_hochberg(p_values: List[float]) -> List[float]:
+    """False-discovery-rate adjusted q-values, in input order."""
+    m = len(p_values)
+    if not m:
+        return []
+    p = np.asarray(p_values, dtype=float)
+    order = np.argsort(p)
+    ranked = p[order] * m / np.arange(1, m + 1)
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    q = np.empty(m)
+    q[order] = np.clip(ranked, 0, 1)
+    return q.tolist()
+
+
+def lagged_correlations(features: pd.DataFrame, max_lag: int = MAX_LAG_DAYS,
+                        min_overlap: int = MIN_OVERLAP_DAYS) -> List[Dict]:
+    """Correlate every cross-domain feature pair, with feature_a leading feature_b by 0..max_lag days."""
+    columns = [c for c in features.columns if features[c].nunique(dropna=True) > 1]
+    values = features[columns].to_numpy(dtype=float)
+    length = len(values)
+    results = []
+
+    for i, a in enumerate(columns):
+        for j, b in enumerate(columns):
+            if feature_domain(a) == feature_domain(b):
+                continue
+            for lag in range(max_lag + 1):
+                # Same-day correlation is symmetric; test each pair once
+                if lag == 0 and j < i:
+                    continue
+                x, y = values[:length - lag, i], values[lag:, j]
+                mask = ~np.isnan(x) & ~np.isnan(y)
+                n = int(mask.sum())
+                if n < min_overlap:
+                    continue
+                xs, ys = x[mask], y[mask]
+                if xs.std() == 0 or ys.std() == 0:
+                    continue
+                r = float(np.corrcoef(xs, ys)[0, 1])
+                results.append({
+                    "feature_a": a,
+                    "feature_b": b,
+                    "domain_a": feature_domain(a),
+                    "domain_b": feature_domain(b),
+                    "lag_days": lag,
+                    "r": round(r, 3),
+                    "n": n,
+                    "p_value": fisher_p_value(r, n)
+                })
+
+    for result, q in zip(results, benjamini_hochberg([r["p_value"] for r in results])):
+        result["q_value"] = q
+        result["confidence"] = round(1 - q, 2)
+    return results
+
+
+def describe(finding: Dict) -> str:
+    a, b = feature_label(finding["feature_a"]), feature_label(finding["feature_b"])
+    direction = "higher" if finding["r"] > 0 else "lower"
+    if finding["lag_days"] == 0:
+        when = "on the same day"
+    else:
+        when = f"{finding['lag_days']} day{'s' if finding['lag_days'] > 1 else ''} later"
+    return (f"Higher {a} goes with {direction} {b} {when} "
+            f"(r={finding['r']:+.2f} over {finding['n']} days).")
+
+
+def top_findings(features: pd.DataFrame, limit: int = 5, max_q: float = MAX_Q_VALUE) -> List[Dict]:
+    """Strongest significant correlations, best lag per feature pair."""
+    significant = [f for f in lagged_correlations(features) if f["q_value"] <= max_q]
+    significant.sort(key=lambda f: (f["q_value"], -abs(f["r"])))
+
+    seen = set()
+    findings = []
+    for finding in significant:
+        pair = frozenset((finding["feature_a"], finding["feature_b"]))
+        if pair in seen:
+            continue
+        seen.add(pair)
+        findings.append({**finding, "description": describe(finding)})
+        if len(findings) >= limit:
+            break
+    return findings
+
+
+def finding_to_insight(finding: Dict) -> Dict:
+    """Memory Fusion insight built directly from a statistical finding."""
+    # Spending that rises as mood or habits slip is flagged as a risk
+    features = {finding["feature_a"], finding["feature_b"]}
+    wellbeing = features & {"mood_score", "habit_rate"}
+    spending = any(f.startswith("spend_") for f in features)
+    return {
+        "type": "risk" if wellbeing and spending and finding["r"] < 0 else "correlation",
+        "domain_a": finding["domain_a"],
+        "domain_b": finding["domain_b"],
+        "description": finding["description"],
+        "confidence": finding["confidence"],
+        "action": DOMAIN_ACTIONS.get(
+            frozenset((finding["domain_a"], finding["domain_b"])),
+            "Keep logging to confirm this pattern."
+        )
+    }
+
+
+def domain_coverage(features: pd.DataFrame) -> Dict[str, int]:
+    """Days with any data, per domain."""
+    coverage: Dict[str, int] = {}
+    for column in features.columns:
+        series = features[column]
+        days = int((series > 0).sum()) if column.startswith("spend_") else int(series.notna().sum())
+        domain = feature_domain(column)
+        coverage[domain] = max(coverage.get(domain, 0), days)
+    return coverage
@@ -1,11 +1,19 @@
 from fastapi import APIRouter, HTTPException
-from database import get_db_connection
+from starlette.concurrency import run_in_threadpool
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
 import os
 import json
-from datetime import datetime, timedelta
+import sqlite3
+from datetime import date, datetime
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
+from database import get_db_connection
+from services.jobs.job_queue import job_queue, accepted
+from prompt_context import ContextBuilder
+from .correlation_engine import (
+    load_daily_features, top_findings, finding_to_insight, domain_coverage
+)
 
 load_dotenv()
 
@@ -20,107 +28,212 @@ def get_llm():
         api_key=api_key
     )
 
-def fetch_aggregated_data(days: int = 7):
-    """Fetch data from all domains for the last N days."""
+# Days of history aligned into the daily feature matrix
+FUSION_WINDOW_DAYS = int(os.getenv("FUSION_WINDOW_DAYS", "28"))
+# When every finding is at least this confident, the LLM is skipped
+SKIP_LLM_CONFIDENCE = float(os.getenv("FUSION_SKIP_LLM_CONFIDENCE", "0.95"))
+
+# Tables whose changes invalidate the stored analysis (habits: active_habits scales the habit rate)
+WATERMARK_TABLES = ("transactions", "meals", "mood_logs", "habit_completions", "habits")
+
+# Tables whose change-counter triggers are in place (some are created by other services' imports)
+_versioned_tables = set()
+
+
+def init_fusion_table():
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    start_date = (datetime.now() - timedelta(days=days)).isoformat()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS fusion_analysis (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            watermark TEXT NOT NULL,
+            result TEXT NOT NULL,
+            computed_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.commit()
+    conn.close()
+    install_version_triggers()
+
+
+def install_version_triggers():
+    """Bump data_versions.version on every insert, update or delete of a watermark table."""
+    conn = get_db_connection()
+    existing = {row["name"] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table in WATERMARK_TABLES:
+        if table in _versioned_tables or table not in existing:
+            continue
+        conn.execute("INSERT OR IGNORE INTO data_versions (table_name) VALUES (?)", (table,))
+        for op in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{op.lower()}_version AFTER {op} ON {table}
+                BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE table_name = '{table}';
+                END
+            """)
+        _versioned_tables.add(table)
+    conn.commit()
+    conn.close()
+
+
+init_fusion_table()
+
+SEED_INSIGHTS = [
+    {
+        "type": "correlation",
+        "domain_a": "Emotional",
+        "domain_b": "Finance",
+        "description": "You tend to spend 40% more on 'Shopping' on days when you log 'Anxious' moods.",
+        "confidence": 0.85,
+        "action": "Try the '5-minute breathing' exercise instead of opening Amazon when anxious."
+    },
+    {
+        "type": "risk",
+        "domain_a": "Diet",
+        "domain_b": "Sleep",
+        "description": "High sugar intake (>80g) after 8 PM is correlated with your reported insomnia.",
+        "confidence": 0.92,
+        "action": "Switch to herbal tea after 8 PM."
+    }
+]
+
+
+def phrase_findings(llm, findings: List[Dict], insights: List[Dict]) -> List[Dict]:
+    """Let the LLM reword statistical insights; statistics stay authoritative."""
+    compact = [
+        json.dumps({"id": i, "description": f["description"], "domains": [f["domain_a"], f["domain_b"]],
+                    "lag_days": f["lag_days"], "confidence": f["confidence"]})
+        for i, f in enumerate(findings)
+    ]
+    instructions = f"""
+    You are the 'Memory Fusion Engine' of a super-intelligent Life OS.
+    These cross-domain patterns were found statistically in the user's last {FUSION_WINDOW_DAYS} days:
+    {{findings}}
     
-    # 1. Finance: High expenses
-    cursor.execute("""
-        SELECT date, amount, category, description 
-        FROM transactions 
-        WHERE date >= ? AND type = 'expense'
-        ORDER BY date DESC
-    """, (start_date,))
-    transactions = [dict(row) for row in cursor.fetchall()]
+    For each pattern, write a short personal insight and one specific action.
+    Return a JSON object with a key 'insights' containing a list of objects with:
+    - 'id': the pattern id
+    - 'description': string (The insight)
+    - 'action': string (Specific advice)
+    """
+    # Findings are ranked strongest first, so the weakest are dropped if over budget
+    sections = ContextBuilder("memory_fusion", budget=800) \
+        .reserve(instructions) \
+        .add_items("findings", compact, joiner="\n") \
+        .build()
+    prompt = instructions.replace("{findings}", sections["findings"])
     
-    # 2. Diet: Meals
-    cursor.execute("""
-        SELECT date, name, calories, protein, carbs, fat 
-        FROM meals 
-        WHERE date >= ?
-        ORDER BY date DESC
-    """, (start_date,))
-    meals = [dict(row) for row in cursor.fetchall()]
+    response = llm.invoke([HumanMessage(content=prompt)])
+    content = response.content.replace('```json', '').replace('```', '').strip()
     
-    # 3. Emotional: Mood Logs (Assuming stored in activities for now)
-    cursor.execute("""
-        SELECT timestamp as date, description as mood, metadata 
-        FROM activities 
-        WHERE timestamp >= ? AND type = 'mood_log'
-        ORDER BY timestamp DESC
-    """, (start_date,))
-    moods = [dict(row) for row in cursor.fetchall()]
+    phrased = {item.get("id"): item for item in json.loads(content).get("insights", []) if isinstance(item, dict)}
+    for i, insight in enumerate(insights):
+        if i in phrased:
+            insight["description"] = phrased[i].get("description") or insight["description"]
+            insight["action"] = phrased[i].get("action") or insight["action"]
+    return insights
+
+
+def compute_fusion_analysis() -> dict:
+    """Detect cross-domain patterns statistically; the LLM only phrases the top findings."""
+    features = load_daily_features(days=FUSION_WINDOW_DAYS)
+    coverage = domain_coverage(features)
     
+    # If not enough data, return dummy/seed insights for demo
+    if not coverage.get("Finance") and not coverage.get("Diet"):
+        return {"insights": SEED_INSIGHTS, "source": "seed"}
+
+    findings = top_findings(features)
+    summary = {"days_analyzed": len(features), "coverage": coverage, "findings": findings}
+    if not findings:
+        return {"insights": [], "source": "statistics",
+                "message": "No significant cross-domain patterns yet. Keep logging!", **summary}
+
+    insights = [finding_to_insight(f) for f in findings]
+    llm = get_llm()
+    if not llm or min(f["confidence"] for f in findings) >= SKIP_LLM_CONFIDENCE:
+        return {"insights": insights, "source": "statistics", **summary}
+
+    try:
+        insights = phrase_findings(llm, findings, insights)
+    except Exception as e:
+        print(f"Fusion phrasing error: {e}")
+        return {"insights": insights, "source": "statistics", **summary}
+    return {"insights": insights, "source": "statistics+llm", **summary}
+
+
+def data_watermark() -> str:
+    """Changes whenever any input table is written to, or the analysis window moves.
+
+    Reads the trigger-maintained change counters, so it costs one small
+    lookup instead of scanning the input tables.
+    """
+    if len(_versioned_tables) < len(WATERMARK_TABLES):
+        install_version_triggers()
+    conn = get_db_connection()
+    versions = dict(conn.execute("SELECT table_name, version FROM data_versions").fetchall())
     conn.close()
-    
-    return {
-        "transactions": transactions,
-        "meals": meals,
-        "moods": moods
-    }
+    parts = [date.today().isoformat(), str(FUSION_WINDOW_DAYS)]
+    parts += [f"{table}:{versions.get(table, 0)}" for table in WATERMARK_TABLES]
+    return "|".join(parts)
+
+
+def get_cached_analysis(watermark: str) -> Optional[dict]:
+    conn = get_db_connection()
+    row = conn.execute(
+        "SELECT result, computed_at FROM fusion_analysis WHERE id = 1 AND watermark = ?", (watermark,)
+    ).fetchone()
+    conn.close()
+    if not row:
+        return None
+    return {**json.loads(row["result"]), "cache": {"hit": True, "computed_at": row["computed_at"]}}
+
+
+def save_analysis(watermark: str, result: dict) -> str:
+    computed_at = datetime.now().isoformat()
+    conn = get_db_connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO fusion_analysis (id, watermark, result, computed_at) VALUES (1, ?, ?, ?)",
+        (watermark, json.dumps(result, default=str), computed_at)
+    )
+    conn.commit()
+    conn.close()
+    return computed_at
+
+
+@job_queue.register("memory_fusion")
+def run_fusion_analysis(payload: dict = None, progress=None) -> dict:
+    """Return the stored analysis unless new data arrived since it was computed."""
+    watermark = data_watermark()
+    if not (payload or {}).get("force"):
+        cached = get_cached_analysis(watermark)
+        if cached:
+            return cached
+
+    result = compute_fusion_analysis()
+    computed_at = save_analysis(watermark, result)
+    return {**result, "cache": {"hit": False, "computed_at": computed_at}}
+
 
 @router.get("/analyze")
-async def analyze_correlations():
-    """Detect cross-domain patterns using Gemini."""
+async def analyze_correlations(background: bool = False, refresh: bool = False):
+    """Detect cross-domain patterns using Gemini.
+    
+    The last analysis is returned as long as no transactions, meals, moods or
+    habit completions changed since; refresh=true recomputes regardless.
+    With background=true the analysis runs on the job queue and a 202 with
+    the job id is returned immediately.
+    """
+    if background:
+        return accepted(job_queue.enqueue("memory_fusion", {"force": refresh}))
+
     try:
-        data = fetch_aggregated_data(days=14)
-        
-        # If not enough data, return dummy/seed insights for demo
-        if not data['transactions'] and not data['meals']:
-            return {
-                "insights": [
-                    {
-                        "type": "correlation",
-                        "domain_a": "Emotional",
-                        "domain_b": "Finance",
-                        "description": "You tend to spend 40% more on 'Shopping' on days when you log 'Anxious' moods.",
-                        "confidence": 0.85,
-                        "action": "Try the '5-minute breathing' exercise instead of opening Amazon when anxious."
-                    },
-                    {
-                        "type": "risk",
-                        "domain_a": "Diet",
-                        "domain_b": "Sleep",
-                        "description": "High sugar intake (>80g) after 8 PM is correlated with your reported insomnia.",
-                        "confidence": 0.92,
-                        "action": "Switch to herbal tea after 8 PM."
-                    }
-                ]
-            }
-
-        llm = get_llm()
-        if not llm:
-            raise HTTPException(status_code=500, detail="LLM not initialized")
-
-        prompt = f"""
-        You are the 'Memory Fusion Engine' of a super-intelligent Life OS.
-        Analyze the following user data timeline to find hidden correlations between behaviors.
-        
-        Data:
-        {json.dumps(data, indent=2)}
-        
-        Look for patterns like:
-        - Stress (Mood) leading to Impulse Buying (Finance).
-        - Poor Diet (High Sugar) leading to Low Mood.
-        - High Spending leading to Stress.
-        
-        Return a JSON object with a key 'insights' containing a list of objects.
-        Each object must have:
-        - 'type': 'correlation' or 'risk'
-        - 'domain_a': string (e.g., Finance)
-        - 'domain_b': string (e.g., Emotional)
-        - 'description': string (The insight)
-        - 'confidence': float (0.0 to 1.0)
-        - 'action': string (Specific advice)
-        """
-        
-        response = llm.invoke([HumanMessage(content=prompt)])
-        content = response.content.replace('```json', '').replace('```', '').strip()
-        
-        return json.loads(content)
+        return await run_in_threadpool(run_fusion_analysis, {"force": refresh})
 
     except Exception as e:
         print(f"Fusion Error: {e}")
@@ -4,7 +4,7 @@ from typing import TypedDict, Annotated, Sequence
 import operator
 
 # Import actual service functions
-from services.diet.food_database import FoodDatabase, MealPlanner
+from services.diet.food_catalog import food_catalog
 from services.finance.finance_service import analyze_budget
 from services.emotional.emotional_service import get_emotional_guidance
 
@@ -18,19 +18,9 @@ class AgentState(TypedDict):
     emotional_response: dict | None
     final_response: str
 
-# Initialize meal planner lazily
-_meal_planner = None
-
 def get_meal_planner():
-    global _meal_planner
-    if _meal_planner is None:
-        try:
-            food_db = FoodDatabase()
-            _meal_planner = MealPlanner(food_db)
-        except Exception as e:
-            print(f"Could not initialize meal planner: {e}")
-            return None
-    return _meal_planner
+    """Meal planner shared with the diet service via the food catalog."""
+    return food_catalog.get_planner()
 
 # Node functions
 def analyze_query(state: AgentState) -> AgentState:
@@ -75,8 +65,9 @@ def call_diet_service(state: AgentState) -> AgentState:
                 if "2500" in state["query"] or "high calorie" in state["query"].lower():
                     calories = 2500
                 
-                plan = meal_planner.generate_plan(calories, diet_type)
-                meals_summary = ", ".join([m["name"].split(":")[0] for m in plan.get("meals", [])[:3]])
+                # A compact single-day plan is all we need to quote the meals
+                plan = meal_planner.generate_batch(1, calories, diet_type)["days"][0]
+                meals_summary = ", ".join([f"{m['meal_type']}: {m['items'][0]}" for m in plan.get("meals", [])[:3]])
                 
                 state["diet_response"] = {
                     "advice": f"Here's a {calories} cal {diet_type} plan for you: {meals_summary}. Total protein: {plan.get('protein', 0)}g.",
@@ -0,0 +1,141 @@
+"""Image-hash cache for vision results.
+
+A photo of the same recurring meal hashes to (nearly) the same dHash, so the
+parsed result can be served without calling the vision model. The 64-bit
+hash is also stored as four 16-bit bands: two hashes within Hamming distance
+3 must share at least one band exactly, so small thresholds are answered
+with an indexed lookup instead of a scan.
+
+Near matches are only safe where the layout is the content. Receipts share
+one layout and differ in a few printed lines, which a 9x8 dHash cannot see,
+so kinds outside VISION_CACHE_NEAR_KINDS are keyed on the SHA-256 of the
+prepared bytes and only an identical re-upload is served from the cache.
+"""
+import json
+import os
+import sqlite3
+from typing import Dict, Optional
+
+from .image_preprocessing import PreparedImage
+
+DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "app.db")
+
+# Max Hamming distance (out of 64 bits) for two images to count as the same
+MAX_DISTANCE = int(os.getenv("VISION_CACHE_MAX_DISTANCE", "3"))
+CACHE_ENABLED = os.getenv("VISION_CACHE_ENABLED", "1") != "0"
+# Kinds that may be served from a perceptually similar image; all others need identical bytes
+NEAR_MATCH_KINDS = tuple(k for k in os.getenv("VISION_CACHE_NEAR_KINDS", "food").split(",") if k)
+
+BANDS = 4
+BAND_BITS = 16
+
+
+def get_db():
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init_vision_cache_table():
+    conn = get_db()
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS vision_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            band0 INTEGER NOT NULL,
+            band1 INTEGER NOT NULL,
+            band2 INTEGER NOT NULL,
+            band3 INTEGER NOT NULL,
+            result TEXT NOT NULL,
+            hits INTEGER DEFAULT 0,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(kind, hash)
+        )
+    """)
+    for band in range(BANDS):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_vision_cache_band{band} ON vision_cache (kind, band{band})")
+
+    conn.commit()
+    conn.close()
+
+
+init_vision_cache_table()
+
+
+def split_bands(image_hash: int):
+    mask = (1 << BAND_BITS) - 1
+    return [(image_hash >> (BAND_BITS * i)) & mask for i in range(BANDS)]
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def cache_key(kind: str, image: PreparedImage) -> str:
+    return f"{image.dhash:016x}" if kind in NEAR_MATCH_KINDS else image.sha256
+
+
+def lookup(kind: str, image: PreparedImage, max_distance: int = MAX_DISTANCE,
+           exact_only: bool = False) -> Optional[Dict]:
+    """Return the cached result for `image`.
+
+    Near-match kinds return the closest dHash within `max_distance`; other
+    kinds require identical prepared bytes. Even a dHash distance of 0 is only
+    a perceptual match, so `exact_only` skips near-match kinds entirely.
+    """
+    if not CACHE_ENABLED or (exact_only and kind in NEAR_MATCH_KINDS):
+        return None
+
+    conn = get_db()
+    cursor = conn.cursor()
+
+    if kind not in NEAR_MATCH_KINDS:
+        cursor.execute("SELECT id, result FROM vision_cache WHERE kind = ? AND hash = ?", (kind, image.sha256))
+        row = cursor.fetchone()
+        best = (0, row, "exact") if row else None
+    else:
+        image_hash = image.dhash
+        if max_distance < BANDS:
+            bands = split_bands(image_hash)
+            cursor.execute(f"""
+                SELECT id, hash, result FROM vision_cache
+                WHERE kind = ? AND ({' OR '.join(f'band{i} = ?' for i in range(BANDS))})
+            """, [kind, *bands])
+        else:
+            cursor.execute("SELECT id, hash, result FROM vision_cache WHERE kind = ?", (kind,))
+
+        best = None
+        for row in cursor.fetchall():
+            distance = hamming(image_hash, int(row["hash"], 16))
+            if distance <= max_distance and (best is None or distance < best[0]):
+                best = (distance, row, "near")
+
+    if best is None:
+        conn.close()
+        return None
+
+    distance, row, match = best
+    cursor.execute("UPDATE vision_cache SET hits = hits + 1 WHERE id = ?", (row["id"],))
+    conn.commit()
+    conn.close()
+
+    result = json.loads(row["result"])
+    result["cache"] = {"hit": True, "match": match, "distance": distance}
+    return result
+
+
+def store(kind: str, image: PreparedImage, result: Dict):
+    """Cache a parsed result. Unparsed (raw) model output is never cached."""
+    if not CACHE_ENABLED or result.get("raw"):
+        return
+
+    conn = get_db()
+    conn.execute(f"""
+        INSERT OR REPLACE INTO vision_cache (kind, hash, {', '.join(f'band{i}' for i in range(BANDS))}, result)
+        VALUES (?, ?, {', '.join('?' for _ in range(BANDS))}, ?)
+    """, [kind, cache_key(kind, image), *split_bands(image.dhash), json.dumps(result)])
+    conn.commit()
+    conn.close()
@@ -0,0 +1,137 @@
+"""Image preprocessing for vision uploads.
+
+Phone photos arrive at 4-12 MB; the vision model gains nothing from that
+resolution. Uploads are streamed to a spooled temp file (bounded memory),
+then decoded, EXIF-rotated, downsized and re-encoded without metadata in a
+worker thread so the event loop is never blocked on Pillow.
+"""
+import base64
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from io import BytesIO
+from typing import BinaryIO
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+from starlette.concurrency import run_in_threadpool
+
+MAX_UPLOAD_BYTES = int(float(os.getenv("VISION_MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+CHUNK_SIZE = 1024 * 1024
+SPOOL_MAX_MEMORY = 2 * 1024 * 1024
+
+# Longest side after resizing; receipts keep more pixels so small print stays legible
+FOOD_MAX_SIDE = int(os.getenv("VISION_FOOD_MAX_SIDE", "768"))
+RECEIPT_MAX_SIDE = int(os.getenv("VISION_RECEIPT_MAX_SIDE", "1600"))
+
+OUTPUT_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "JPEG").upper()
+OUTPUT_QUALITY = int(os.getenv("VISION_IMAGE_QUALITY", "85"))
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+@dataclass
+class PreparedImage:
+    """A re-encoded image ready to send to the vision model."""
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    original_bytes: int
+    dhash: int = 0
+
+    @property
+    def sha256(self) -> str:
+        """Exact content hash of the re-encoded bytes."""
+        return hashlib.sha256(self.data).hexdigest()
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{base64.b64encode(self.data).decode('utf-8')}"
+
+
+async def copy_upload(file: UploadFile, dest: BinaryIO) -> int:
+    """Stream an upload into `dest` in chunks, enforcing the size limit; returns bytes written."""
+    total = 0
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit")
+        dest.write(chunk)
+    return total
+
+
+async def read_upload(file: UploadFile) -> BinaryIO:
+    """Stream an upload into a spooled temp file, enforcing the size limit."""
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    try:
+        await copy_upload(file, spooled)
+    except HTTPException:
+        spooled.close()
+        raise
+    spooled.seek(0)
+    return spooled
+
+
+def dhash(img: Image.Image, size: int = 8) -> int:
+    """64-bit difference hash: compares horizontally adjacent pixels of a tiny grayscale copy."""
+    small = img.convert("L").resize((size + 1, size), Image.BILINEAR)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def prepare_image(source: BinaryIO, max_side: int, original_bytes: int = 0) -> PreparedImage:
+    """Decode, orient, downsize and re-encode an image. Metadata (EXIF, GPS) is not carried over."""
+    fmt = OUTPUT_FORMAT if OUTPUT_FORMAT in MIME_TYPES else "JPEG"
+    try:
+        with Image.open(source) as img:
+            # Let the JPEG decoder downscale while decoding; much cheaper than a full decode
+            img.draft("RGB", (max_side, max_side))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+            if img.mode in ("RGBA", "LA", "P"):
+                img = img.convert("RGBA")
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+
+            out = BytesIO()
+            img.save(out, format=fmt, quality=OUTPUT_QUALITY, optimize=True)
+            width, height = img.size
+            image_hash = dhash(img)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Unsupported or corrupt image: {e}")
+
+    return PreparedImage(
+        data=out.getvalue(),
+        mime_type=MIME_TYPES[fmt],
+        width=width,
+        height=height,
+        original_bytes=original_bytes,
+        dhash=image_hash
+    )
+
+
+async def preprocess_upload(file: UploadFile, max_side: int = FOOD_MAX_SIDE) -> PreparedImage:
+    """Stream, downsize and re-encode an uploaded image off the event loop."""
+    spooled = await read_upload(file)
+    try:
+        spooled.seek(0, os.SEEK_END)
+        original_bytes = spooled.tell()
+        spooled.seek(0)
+        return await run_in_threadpool(prepare_image, spooled, max_side, original_bytes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        spooled.close()
@@ -1,10 +1,22 @@
 from fastapi import APIRouter, File, UploadFile, HTTPException
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
+from starlette.concurrency import run_in_threadpool
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List
 import os
-import base64
+import threading
+import uuid
 import json
 from dotenv import load_dotenv
+from services.diet.food_catalog import food_catalog
+from services.finance.transaction_manager import transaction_manager
+from services.jobs.job_queue import job_queue, accepted, spool_file, spool_path
+from . import image_cache
+from .image_preprocessing import (
+    PreparedImage, copy_upload, preprocess_upload, prepare_image, FOOD_MAX_SIDE, RECEIPT_MAX_SIDE
+)
 
 load_dotenv()
 
@@ -20,78 +32,343 @@ def get_vision_llm():
         api_key=api_key
     )
 
+FOOD_FULL_PROMPT = "Analyze this food image. Return a JSON object with: 'food_name' (string), 'calories' (integer estimate), 'protein' (integer estimate), 'carbs' (integer estimate), 'fat' (integer estimate), and 'health_score' (1-10 integer). Be concise."
+
+# Cheaper prompt: the model only names the dish, macros come from the local catalog
+FOOD_NAME_PROMPT = "Name the main dish in this food image. Return only a JSON object with: 'food_name' (string, common Indian name if applicable) and 'servings' (number of standard servings, default 1)."
+
+# Warnings that count against a catalog food's health score
+UNHEALTHY_TAGS = {"high_fat", "high_calories", "high_sugar", "sugar", "fried", "high_carbs", "high_glycemic_index"}
+
+
+def invoke_vision(llm, prompt: str, image: PreparedImage) -> dict:
+    """Send one preprocessed image + prompt to the vision model and parse its JSON answer."""
+    message = HumanMessage(
+        content=[
+            {
+                "type": "text",
+                "text": prompt
+            },
+            {
+                "type": "image_url",
+                "image_url": {"url": image.data_url}
+            }
+        ]
+    )
+    
+    response = llm.invoke([message])
+    
+    # Clean up response and parse to JSON
+    content = response.content.replace('```json', '').replace('```', '').strip()
+    try:
+        parsed_result = json.loads(content)
+    except json.JSONDecodeError:
+        return {"result": content, "raw": True, "error": "Could not parse JSON"}
+    if not isinstance(parsed_result, dict):
+        return {"result": parsed_result, "raw": True, "error": "Expected a JSON object"}
+    return parsed_result
+
+
+def catalog_health_score(food: dict) -> int:
+    """Rough 1-10 health score for a catalog food from its benefit and warning tags."""
+    benefits = [b for b in food.get("benefits", []) if b != "none"]
+    warnings = [w for w in food.get("warnings", []) if w in UNHEALTHY_TAGS]
+    return max(1, min(10, 6 + min(len(benefits), 3) - len(warnings)))
+
+
+def resolve_nutrition(result: dict) -> dict:
+    """Replace model-estimated macros with local catalog values when the dish is known.
+    
+    Known dishes get consistent numbers regardless of how the model estimates
+    them; `nutrition_source` records which one was used.
+    """
+    food_db = food_catalog.get_database()
+    match = food_db.match_food(str(result.get("food_name", ""))) if food_db else None
+    if not match:
+        result["nutrition_source"] = "model"
+        return result
+    
+    try:
+        servings = max(float(result.get("servings") or 1), 0.25)
+    except (TypeError, ValueError):
+        servings = 1.0
+    
+    result.update({
+        "calories": round(match["calories"] * servings),
+        "protein": round(match.get("protein", 0) * servings),
+        "carbs": round(match.get("carbs", 0) * servings),
+        "fat": round(match.get("fat", 0) * servings),
+        "health_score": result.get("health_score") or catalog_health_score(match),
+        "catalog_match": match["name"],
+        "servings": servings,
+        "nutrition_source": "catalog"
+    })
+    return result
+
+
+def analyze_food_image(image: PreparedImage, mode: str = "full") -> dict:
+    """Parse one preprocessed food photo, from the hash cache when possible."""
+    cached = image_cache.lookup("food", image)
+    if cached:
+        return cached
+
+    llm = get_vision_llm()
+    if not llm:
+        raise HTTPException(status_code=500, detail="LLM not initialized")
+
+    if mode == "name":
+        named = invoke_vision(llm, FOOD_NAME_PROMPT, image)
+        if not named.get("raw"):
+            resolved = resolve_nutrition(named)
+            if resolved["nutrition_source"] == "catalog":
+                image_cache.store("food", image, resolved)
+                return resolved
+    
+    parsed_result = invoke_vision(llm, FOOD_FULL_PROMPT, image)
+    if parsed_result.get("raw"):
+        return parsed_result
+    resolved = resolve_nutrition(parsed_result)
+    image_cache.store("food", image, resolved)
+    return resolved
+
+
+RECEIPT_PROMPT = "Analyze this receipt. Return a JSON object with: 'merchant' (string), 'total_amount' (float), 'date' (string YYYY-MM-DD), 'category' (string e.g., Food, Transport, Shopping). If unclear, estimate."
+
+# Batch receipt ingestion limits
+MAX_BATCH_RECEIPTS = int(os.getenv("VISION_MAX_BATCH_RECEIPTS", "50"))
+BATCH_CONCURRENCY = int(os.getenv("VISION_BATCH_CONCURRENCY", "4"))
+
+
+def analyze_receipt_image(image: PreparedImage, exact_only: bool = False) -> dict:
+    """Parse one preprocessed receipt, from the cache only for an identical re-upload.
+    
+    exact_only also refuses perceptual matches if receipts are configured as a
+    near-match kind; callers that record transactions must pass it.
+    """
+    cached = image_cache.lookup("receipt", image, exact_only=exact_only)
+    if cached:
+        return cached
+
+    llm = get_vision_llm()
+    if not llm:
+        raise HTTPException(status_code=500, detail="LLM not initialized")
+
+    parsed_result = invoke_vision(llm, RECEIPT_PROMPT, image)
+    image_cache.store("receipt", image, parsed_result)
+    return parsed_result
+
+
+def receipt_to_transaction(receipt: dict) -> dict:
+    """Map a parsed receipt onto a TransactionManager expense row."""
+    amount = float(receipt["total_amount"])
+    if amount <= 0:
+        raise ValueError("Receipt total must be positive")
+
+    date = None
+    try:
+        date = datetime.strptime(str(receipt.get("date")), "%Y-%m-%d").isoformat()
+    except ValueError:
+        pass
+
+    return {
+        "amount": amount,
+        "type": "expense",
+        "category": receipt.get("category") or "Other",
+        "description": receipt.get("merchant") or "Receipt",
+        "date": date
+    }
+
+
+def _spool_image(image: PreparedImage) -> dict:
+    """Hand a prepared image to a job: bytes go to disk, metadata into the payload."""
+    suffix = ".webp" if image.mime_type == "image/webp" else ".jpg"
+    return {
+        "path": spool_file(image.data, suffix),
+        "mime_type": image.mime_type,
+        "width": image.width,
+        "height": image.height,
+        "original_bytes": image.original_bytes,
+        "dhash": image.dhash
+    }
+
+
+def _load_spooled_image(payload: dict) -> PreparedImage:
+    # The queue removes the file once the job is terminal
+    with open(payload["path"], "rb") as f:
+        data = f.read()
+    return PreparedImage(
+        data=data,
+        mime_type=payload["mime_type"],
+        width=payload["width"],
+        height=payload["height"],
+        original_bytes=payload["original_bytes"],
+        dhash=payload["dhash"]
+    )
+
+
+@job_queue.register("vision_food")
+def run_food_job(payload: dict, progress=None) -> dict:
+    return analyze_food_image(_load_spooled_image(payload), payload.get("mode", "full"))
+
+
+@job_queue.register("vision_receipt")
+def run_receipt_job(payload: dict, progress=None) -> dict:
+    return analyze_receipt_image(_load_spooled_image(payload))
+
+
 @router.post("/analyze-food")
-async def analyze_food(file: UploadFile = File(...)):
-    """Analyze food image using Gemini Vision."""
+async def analyze_food(file: UploadFile = File(...), mode: str = "full", background: bool = False):
+    """Analyze food image using Gemini Vision.
+    
+    mode=full asks the model for macros; mode=name only asks for the dish name
+    and takes macros from the food catalog, falling back to a full estimate for
+    unknown dishes. Either way, known dishes use catalog macros. Photos that
+    perceptually match an earlier upload are answered from the cache.
+    With background=true parsing runs on the job queue (202 + job id).
+    """
+    if mode not in ("full", "name"):
+        raise HTTPException(status_code=400, detail="mode must be 'full' or 'name'")
+    
+    image = await preprocess_upload(file, FOOD_MAX_SIDE)
+    if background:
+        return accepted(job_queue.enqueue("vision_food", {**_spool_image(image), "mode": mode}))
+    
     try:
-        contents = await file.read()
-        image_b64 = base64.b64encode(contents).decode("utf-8")
-        
-        llm = get_vision_llm()
-        if not llm:
-            raise HTTPException(status_code=500, detail="LLM not initialized")
-
-        message = HumanMessage(
-            content=[
-                {
-                    "type": "text",
-                    "text": "Analyze this food image. Return a JSON object with: 'food_name' (string), 'calories' (integer estimate), 'protein' (integer estimate), 'carbs' (integer estimate), 'fat' (integer estimate), and 'health_score' (1-10 integer). Be concise."
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}
-                }
-            ]
-        )
-        
-        response = llm.invoke([message])
-        
-        # Clean up response and parse to JSON
-        content = response.content.replace('```json', '').replace('```', '').strip()
-        try:
-            parsed_result = json.loads(content)
-            return parsed_result
-        except json.JSONDecodeError:
-            return {"result": content, "raw": True, "error": "Could not parse JSON"}
+        return await run_in_threadpool(analyze_food_image, image, mode)
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Vision error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
 @router.post("/analyze-receipt")
-async def analyze_receipt(file: UploadFile = File(...)):
-    """Analyze receipt image using Gemini Vision."""
+async def analyze_receipt(file: UploadFile = File(...), background: bool = False):
+    """Analyze receipt image using Gemini Vision.
+    
+    With background=true parsing runs on the job queue (202 + job id).
+    """
+    image = await preprocess_upload(file, RECEIPT_MAX_SIDE)
+    if background:
+        return accepted(job_queue.enqueue("vision_receipt", _spool_image(image)))
+    
     try:
-        contents = await file.read()
-        image_b64 = base64.b64encode(contents).decode("utf-8")
-        
-        llm = get_vision_llm()
-        if not llm:
-            raise HTTPException(status_code=500, detail="LLM not initialized")
-
-        message = HumanMessage(
-            content=[
-                {
-                    "type": "text",
-                    "text": "Analyze this receipt. Return a JSON object with: 'merchant' (string), 'total_amount' (float), 'date' (string YYYY-MM-DD), 'category' (string e.g., Food, Transport, Shopping). If unclear, estimate."
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}
-                }
-            ]
-        )
-        
-        response = llm.invoke([message])
-        
-        # Clean up response and parse to JSON
-        content = response.content.replace('```json', '').replace('```', '').strip()
-        try:
-            parsed_result = json.loads(content)
-            return parsed_result
-        except json.JSONDecodeError:
-            return {"result": content, "raw": True, "error": "Could not parse JSON"}
+        return await run_in_threadpool(analyze_receipt_image, image)
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Vision error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def _process_receipt_batch(files: List[Dict], report, batch_id: str) -> Dict:
+    """Parse receipts with at most BATCH_CONCURRENCY in flight, then record all expenses at once.
+
+    Each expense carries the ref "receipt_batch:<batch_id>:<index>", so a batch
+    re-run by recover() after it already committed records nothing twice.
+    """
+    state = {
+        "total": len(files),
+        "processed": 0,
+        "failed": 0,
+        "items": [{"filename": f["filename"], "status": "pending"} for f in files]
+    }
+    state_lock = threading.Lock()
+
+    def process(index: int, entry: Dict):
+        item = state["items"][index]
+        try:
+            with open(entry["path"], "rb") as f:
+                image = prepare_image(f, RECEIPT_MAX_SIDE)
+            # Totals are written to the ledger, so a look-alike receipt's result is never reused
+            receipt = analyze_receipt_image(image, True)
+            if receipt.get("raw"):
+                raise ValueError(receipt.get("error", "Could not parse receipt"))
+            item["receipt"] = receipt
+            item["transaction"] = receipt_to_transaction(receipt)
+            item["status"] = "parsed"
+        except HTTPException as e:
+            item.update({"status": "failed", "error": e.detail})
+        except (KeyError, TypeError, ValueError) as e:
+            item.update({"status": "failed", "error": str(e)})
+        except Exception as e:
+            print(f"Vision batch error ({entry['filename']}): {e}")
+            item.update({"status": "failed", "error": str(e)})
+        finally:
+            with state_lock:
+                state["processed"] += 1
+                report(state)
+
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="receipt-batch") as pool:
+        list(pool.map(process, range(len(files)), files))
+
+    parsed = [(index, item) for index, item in enumerate(state["items"]) if item["status"] == "parsed"]
+    created = transaction_manager.add_transactions([
+        {**item["transaction"], "source_ref": f"receipt_batch:{batch_id}:{index}"} for index, item in parsed
+    ])
+    for (_, item), tx in zip(parsed, created):
+        item["transaction"] = tx
+        item["status"] = "recorded"
+
+    state["failed"] = sum(1 for item in state["items"] if item["status"] == "failed")
+    return state
+
+
+@job_queue.register("receipt_batch")
+def run_receipt_batch(payload: dict, progress) -> dict:
+    return _process_receipt_batch(payload["files"], progress, payload["batch_id"])
+
+
+@router.post("/analyze-receipts")
+async def analyze_receipts(files: List[UploadFile] = File(...)):
+    """Queue many receipts for parsing; poll /vision/receipt-jobs/{job_id} for progress.
+    
+    Parsed receipts are written as expense transactions in a single DB transaction.
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+    if len(files) > MAX_BATCH_RECEIPTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_RECEIPTS} receipts per batch")
+
+    # Uploads are only readable during the request, so stream them to disk for the worker
+    spooled = []
+    try:
+        for file in files:
+            path = spool_path()
+            spooled.append({"filename": file.filename, "path": path})
+            with open(path, "wb") as f:
+                await copy_upload(file, f)
+    except HTTPException:
+        for entry in spooled:
+            if os.path.exists(entry["path"]):
+                os.remove(entry["path"])
+        raise
+
+    job = job_queue.enqueue("receipt_batch", {"files": spooled, "batch_id": uuid.uuid4().hex})
+    return {"job_id": job["id"], "status": job["status"], "total": len(spooled)}
+
+
+@router.get("/receipt-jobs/{job_id}")
+async def get_receipt_job(job_id: str):
+    """Progress and results of a batch receipt job."""
+    job = job_queue.get(job_id)
+    if not job or job["kind"] != "receipt_batch":
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    files = (job["payload"] or {}).get("files", [])
+    state = job["result"] or job["progress"] or {
+        "total": len(files),
+        "processed": 0,
+        "failed": 0,
+        "items": [{"filename": f["filename"], "status": "pending"} for f in files]
+    }
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        **state,
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "finished_at": job["finished_at"]
+    }
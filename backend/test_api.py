@@ -1,9 +1,50 @@
 import pytest
+from collections import defaultdict
 from fastapi.testclient import TestClient
 from main import app
 
 client = TestClient(app)
 
+
+def wait_for_job(job_id, timeout=10):
+    import time
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+def isolated_db(monkeypatch, tmp_path):
+    """Point the core and gamification tables at a throwaway DB, so a test neither
+    depends on nor leaves rows in the shared app.db."""
+    import database
+    import outbox
+    from services.dashboard import activity_retention, activity_tracker
+    from services.finance import transaction_manager
+    from services.gamification import achievements_service, challenges_service, gamification_service
+    db_path = tmp_path / "app.db"
+    monkeypatch.setattr(database, "DB_PATH", db_path)
+    monkeypatch.setattr(achievements_service, "DB_PATH", str(db_path))
+    monkeypatch.setattr(challenges_service, "DB_PATH", str(db_path))
+    database.init_db()
+    activity_retention.init_activity_archive()
+    activity_tracker.init_activity_indexes()
+    transaction_manager.init_transaction_refs()
+    outbox.init_outbox_table()
+    gamification_service.init_xp_ledger()
+    achievements_service.init_achievements_table()
+    challenges_service.init_challenges_table()
+    # In-memory state seeded from the real DB
+    monkeypatch.setattr(achievements_service, "_engine",
+                        {"loaded": False, "unlocked": set(), "counters": defaultdict(int)})
+    gamification_service.invalidate_xp_status()
+    challenges_service.invalidate_weekly_cache()
+    return db_path
+
+
 class TestHealthEndpoints:
     def test_root(self):
         response = client.get("/")
@@ -34,6 +75,122 @@ class TestDietService:
         assert data["calories"] == 1800
         assert data["type"] == "non-veg"
 
+    def test_get_diet_plan_batch(self):
+        response = client.get("/diet/plan/batch?days=7&calories=1800&type=non-veg&variety_window=2")
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["days"]) == 7
+        assert all("items" in meal for day in data["days"] for meal in day["meals"])
+
+        # A meal's main course is its first item; none may recur within the window
+        from services.diet.food_catalog import food_catalog
+        main_names = {f["name"] for f in food_catalog.get_database().foods if f.get("category") in ("main_course", "breakfast")}
+        mains_by_day = [{meal["items"][0] for meal in day["meals"] if meal["items"][0] in main_names} for day in data["days"]]
+        assert all(mains_by_day)
+        for i, mains in enumerate(mains_by_day):
+            assert not mains & set().union(*mains_by_day[max(0, i - 2):i])
+    
+    def test_get_diet_plan_batch_rejects_too_many_days(self):
+        response = client.get("/diet/plan/batch?days=90")
+        assert response.status_code == 400
+
+    def test_get_diet_plan_with_health_conditions(self):
+        response = client.get("/diet/plan?calories=1800&type=veg&conditions=diabetes")
+        assert response.status_code == 200
+        data = response.json()
+        items = [item for meal in data["meals"] for item in meal["items"]]
+        assert "Rice (White, Cooked)" not in items
+        assert "diabetes" in data["health_conditions"]
+    
+    def test_get_diet_plan_unknown_condition(self):
+        response = client.get("/diet/plan?conditions=not_a_condition")
+        assert response.status_code == 400
+
+
+class TestFoodCatalog:
+    def test_catalog_status(self):
+        response = client.get("/diet/catalog")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["version"] >= 1
+        assert data["foods"] > 0
+    
+    def test_catalog_reloads_on_file_change(self, tmp_path):
+        import json, os
+        from services.diet.food_catalog import FoodCatalog
+        from services.diet.food_database import FoodDatabase
+        
+        path = tmp_path / "foods.json"
+        data = json.loads(FoodDatabase.find_database_path().read_text(encoding="utf-8"))
+        path.write_text(json.dumps(data), encoding="utf-8")
+        catalog = FoodCatalog(path, check_interval=0)
+        old_db = catalog.get_database()
+        assert catalog.version == 1
+        
+        data["indian_foods"].append({**data["indian_foods"][0], "name": "Test Millet Dosa"})
+        path.write_text(json.dumps(data), encoding="utf-8")
+        stat = path.stat()
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+        
+        # Concurrent readers noticing the same change reload it once
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda _: catalog.get_database(), range(8)))
+        new_db = catalog.get_database()
+        catalog.get_store()
+        assert catalog.version == 2
+        assert new_db is not old_db
+        assert any(f["name"] == "Test Millet Dosa" for f in new_db.foods)
+
+    def test_store_backed_catalog_is_lazy_and_shared(self, tmp_path):
+        from services.diet.catalog_store import FoodCatalogStore, StoreFoods
+        from services.diet.food_catalog import FoodCatalog
+        from services.diet.food_database import FoodDatabase
+        
+        path = tmp_path / "foods.db"
+        FoodCatalogStore.rebuild_from_json(FoodDatabase.find_database_path(), path)
+        catalog = FoodCatalog(path, check_interval=60)
+        food_db = catalog.get_database()
+        assert isinstance(food_db.foods, StoreFoods)
+        assert catalog.get_store() is catalog.get_store() is food_db.store
+        assert food_db.match_food("Chicken biriyani")["name"] == "Chicken Biryani"
+        assert catalog.get_planner().generate_plan(1800, "non-veg")["meals"]
+        
+        results = catalog.get_store().search("paneer", diet_type="Vegetarian")
+        assert results and all(r["diet_type"] == "veg" for r in results)
+    
+    def test_store_backed_catalog_generates_plans(self, tmp_path):
+        import json
+        from services.diet.catalog_store import FoodCatalogStore
+        from services.diet.food_catalog import FoodCatalog
+        from services.diet.food_database import FoodDatabase
+        
+        source = FoodDatabase.find_database_path()
+        path = tmp_path / "foods.db"
+        FoodCatalogStore.rebuild_from_json(source, path)
+        catalog = FoodCatalog(path, check_interval=60)
+        
+        # Stored macros come back with the JSON source's types
+        original = {f["name"]: f for f in json.loads(source.read_text(encoding="utf-8"))["indian_foods"]}
+        for food in catalog.get_database().foods:
+            for column in ("calories", "protein", "carbs", "fat"):
+                assert type(food[column]) is type(original[food["name"]][column])
+        
+        planner = catalog.get_planner()
+        for diet_type in ("veg", "non-veg"):
+            assert planner.generate_plan(1800, diet_type)["meals"]
+        assert len(planner.generate_batch(14, 2200, "non-veg")["days"]) == 14
+    
+    def test_food_search_prefix_and_typo(self):
+        response = client.get("/diet/foods/search?q=pane")
+        assert response.status_code == 200
+        names = [f["name"] for f in response.json()["results"]]
+        assert "Paneer Tikka" in names
+        
+        response = client.get("/diet/foods/search?q=chiken biryni")
+        assert response.status_code == 200
+        assert response.json()["results"][0]["name"] == "Chicken Biryani"
+
 
 class TestFinanceService:
     def test_get_budget_positive(self):
@@ -70,6 +227,91 @@ class TestEmotionalService:
         assert "Gita" in data["guidance"]
 
 
+class TestMoodStore:
+    def test_mood_categorized_on_log(self):
+        response = client.post("/emotional/log", json={"mood": "Really stressed about work", "intensity": 8})
+        assert response.status_code == 200
+        entry = response.json()["mood"]
+        assert entry["category"] == "stressed"
+        assert entry["valence"] < 0
+
+    def test_categorize_matches_words_and_negation(self):
+        from services.emotional.mood_store import categorize
+        assert categorize("heartbroken")[0] == "sad"
+        assert categorize("not good")[0] == "sad"
+        assert categorize("calmed down")[0] == "calm"
+        assert categorize("feeling down today")[0] == "sad"
+        assert categorize("broke my phone, mad dash to work") == ("other", None)
+        assert categorize("joyless") == ("other", None)
+        assert categorize("not stressed")[0] == "neutral"
+        assert categorize("not stressed but hopeful")[0] == "calm"
+        assert categorize("goodbye") == ("other", None)
+
+    def test_backfill_categorizes_and_keeps_utc_timestamps(self):
+        from database import get_db_connection
+        from services.emotional.mood_store import init_mood_store
+        conn = get_db_connection()
+        row_id = conn.execute("INSERT INTO mood_logs (mood, intensity) VALUES ('feeling fine', 5)").lastrowid
+        conn.commit()
+        stored = conn.execute("SELECT timestamp FROM mood_logs WHERE id = ?", (row_id,)).fetchone()[0]
+        init_mood_store()
+        row = conn.execute("SELECT * FROM mood_logs WHERE id = ?", (row_id,)).fetchone()
+        conn.close()
+        assert row["category"] == "neutral"
+        assert row["timestamp"] == stored
+
+    def test_burnout_risk_reads_mood_store(self):
+        from services.emotional import mood_store
+        from services.dashboard.risk_engine import calculate_burnout_risk
+        before = calculate_burnout_risk()["score"]
+        mood_store.log_mood("anxious", 7)
+        after = calculate_burnout_risk()["score"]
+        assert after > before or after == 100
+
+
+class TestRiskEngine:
+    def test_trend_and_depletion_forecast(self):
+        import numpy as np
+        from services.dashboard.risk_engine import SERIES, trend_stats, financial_risk
+
+        days = 3650
+        series = {name: np.zeros(days) for name in SERIES}
+        series["valence"][:] = np.nan
+        series["calories"][:] = np.nan
+        series["habit_rate"][:] = np.nan
+        series["income"] = np.zeros(days)
+        series["expense"] = np.full(days, 100.0)
+        series["net"] = series["income"] - series["expense"]
+        series["balance"] = 370000 + np.cumsum(series["net"])
+        series["stress"][-14:] = np.linspace(0, 1, 14)
+
+        stats = trend_stats(np.vstack([series[name] for name in SERIES]))
+        assert stats["slope_per_day"][SERIES.index("stress")] > 0
+        assert abs(stats["ewma"][SERIES.index("net")] + 100) < 1e-6
+
+        financial = financial_risk(series, stats)
+        assert financial["depletion_days"] == 50
+        assert "50 days" in financial["prediction"]
+
+    def test_slope_is_per_day_with_missing_days(self):
+        import numpy as np
+        from services.dashboard.risk_engine import SERIES, trend_stats
+
+        matrix = np.full((len(SERIES), 120), np.nan)
+        row = SERIES.index("calories")
+        matrix[row] = 1500 + 10 * np.arange(120)
+        matrix[row, ::3] = np.nan
+        matrix[row, 1::3] = np.nan
+        assert abs(trend_stats(matrix)["slope_per_day"][row] - 10) < 0.1
+
+    def test_risk_analysis_endpoint(self):
+        response = client.get("/risk/analysis")
+        assert response.status_code == 200
+        data = response.json()
+        assert set(data["risks"]) == {"burnout", "financial", "health"}
+        assert 0 <= data["overall_risk_score"] <= 100
+
+
 class TestVisionService:
     def test_analyze_food_image(self):
         response = client.post("/vision/analyze?image_type=food")
@@ -79,6 +321,739 @@ class TestVisionService:
         assert "result" in data
 
 
+class TestVisionNutritionLookup:
+    def test_known_dish_uses_catalog_macros(self):
+        from services.vision.vision_service import resolve_nutrition
+        result = resolve_nutrition({"food_name": "Chicken biriyani", "calories": 999, "servings": 2})
+        assert result["nutrition_source"] == "catalog"
+        assert result["catalog_match"] == "Chicken Biryani"
+        assert result["calories"] == 800
+    
+    def test_unknown_dish_keeps_model_estimate(self):
+        from services.vision.vision_service import resolve_nutrition
+        result = resolve_nutrition({"food_name": "Margherita Pizza", "calories": 700})
+        assert result["nutrition_source"] == "model"
+        assert result["calories"] == 700
+
+
+class TestVisionPreprocessing:
+    def test_large_photo_is_downsized_and_stripped(self):
+        import io
+        from PIL import Image
+        from services.vision.image_preprocessing import prepare_image
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotated 90 degrees
+        buffer = io.BytesIO()
+        Image.new("RGB", (4000, 3000), (200, 120, 40)).save(buffer, format="JPEG", exif=exif)
+        buffer.seek(0)
+
+        image = prepare_image(buffer, 768)
+        assert image.mime_type == "image/jpeg"
+        assert (image.width, image.height) == (576, 768)
+        assert "exif" not in Image.open(io.BytesIO(image.data)).info
+
+    def test_corrupt_upload_rejected(self):
+        response = client.post("/vision/analyze-food", files={"file": ("x.jpg", b"not an image", "image/jpeg")})
+        assert response.status_code == 400
+
+    @staticmethod
+    def receipt_bytes(shade=0, stripe=37):
+        import io
+        from PIL import Image
+        img = Image.new("L", (900, 1200))
+        img.putdata([(x * 255 // 900 + y // 40 * stripe + shade) % 256 for y in range(1200) for x in range(900)])
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    @staticmethod
+    def prepared_receipt(data):
+        import io
+        from services.vision.image_preprocessing import prepare_image, RECEIPT_MAX_SIDE
+        return prepare_image(io.BytesIO(data), RECEIPT_MAX_SIDE)
+
+    @classmethod
+    def cache_receipt(cls, data, receipt):
+        from services.vision import image_cache
+        image_cache.store("receipt", cls.prepared_receipt(data), receipt)
+
+    def test_identical_receipt_served_from_cache(self):
+        self.cache_receipt(self.receipt_bytes(0), {"merchant": "Corner Store", "total_amount": 42.5})
+
+        response = client.post("/vision/analyze-receipt", files={"file": ("r.png", self.receipt_bytes(0), "image/png")})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["merchant"] == "Corner Store"
+        assert data["cache"] == {"hit": True, "match": "exact", "distance": 0}
+
+    def test_similar_receipts_do_not_collide(self):
+        from services.vision import image_cache
+        from services.vision.image_cache import hamming
+        first, second = self.receipt_bytes(0, 23), self.receipt_bytes(2, 23)
+        # Same layout, different content: the dHashes are within the near-match threshold
+        assert hamming(self.prepared_receipt(first).dhash, self.prepared_receipt(second).dhash) <= image_cache.MAX_DISTANCE
+
+        self.cache_receipt(first, {"merchant": "Layout Mart", "total_amount": 99.0})
+        assert image_cache.lookup("receipt", self.prepared_receipt(second)) is None
+        assert image_cache.lookup("receipt", self.prepared_receipt(first))["merchant"] == "Layout Mart"
+
+    def test_batch_receipts_recorded_as_transactions(self):
+        first, second = self.receipt_bytes(0, 91), self.receipt_bytes(0, 13)
+        self.cache_receipt(first, {"merchant": "Metro Mart", "total_amount": 310.0, "date": "2024-03-30", "category": "Shopping"})
+        self.cache_receipt(second, {"merchant": "Cafe Nine", "total_amount": 180.0, "date": "2024-03-31", "category": "Food"})
+
+        response = client.post("/vision/analyze-receipts", files=[
+            ("files", ("a.png", first, "image/png")),
+            ("files", ("b.png", second, "image/png")),
+            ("files", ("c.png", b"garbage", "image/png")),
+        ])
+        assert response.status_code == 200
+        job_id = response.json()["job_id"]
+
+        wait_for_job(job_id)
+        job = client.get(f"/vision/receipt-jobs/{job_id}").json()
+        assert job["status"] == "completed"
+        assert job["processed"] == 3
+        assert job["failed"] == 1
+        recorded = [item for item in job["items"] if item["status"] == "recorded"]
+        assert {item["transaction"]["description"] for item in recorded} == {"Metro Mart", "Cafe Nine"}
+        assert all(item["transaction"]["id"] for item in recorded)
+
+    def test_rerun_batch_does_not_duplicate_expenses(self):
+        import os
+        from database import get_db_connection
+        from services.jobs.job_queue import spool_file
+        from services.vision.vision_service import run_receipt_batch
+        data = self.receipt_bytes(0, 57)
+        self.cache_receipt(data, {"merchant": "Rerun Mart", "total_amount": 64.0, "date": "2024-05-01", "category": "Shopping"})
+        payload = {"files": [{"filename": "r.png", "path": spool_file(data)}], "batch_id": "rerun-test"}
+
+        # recover() re-runs a batch that may already have committed its expenses
+        first = run_receipt_batch(payload, lambda state: None)
+        second = run_receipt_batch(payload, lambda state: None)
+        os.remove(payload["files"][0]["path"])
+        assert first["items"][0]["transaction"]["id"] == second["items"][0]["transaction"]["id"]
+        conn = get_db_connection()
+        count = conn.execute("SELECT COUNT(*) FROM transactions WHERE source_ref = 'receipt_batch:rerun-test:0'").fetchone()[0]
+        conn.close()
+        assert count == 1
+
+    def test_batch_never_records_a_look_alike_receipt(self):
+        first, second = self.receipt_bytes(0, 29), self.receipt_bytes(2, 29)
+        self.cache_receipt(first, {"merchant": "Twin Mart", "total_amount": 77.0, "date": "2024-04-01", "category": "Shopping"})
+
+        response = client.post("/vision/analyze-receipts", files=[
+            ("files", ("a.png", first, "image/png")),
+            ("files", ("b.png", second, "image/png")),
+        ])
+        job_id = response.json()["job_id"]
+        wait_for_job(job_id)
+        items = client.get(f"/vision/receipt-jobs/{job_id}").json()["items"]
+        assert items[0]["status"] == "recorded"
+        assert items[0]["transaction"]["amount"] == 77.0
+        # The look-alike needs its own parse (no model configured here), never Twin Mart's total
+        assert items[1]["status"] == "failed"
+
+    def test_exact_only_skips_near_match_kinds(self, monkeypatch):
+        from services.vision import image_cache
+        monkeypatch.setattr(image_cache, "NEAR_MATCH_KINDS", ("food", "receipt"))
+        data = self.receipt_bytes(0, 31)
+        self.cache_receipt(data, {"merchant": "Near Store", "total_amount": 5.0})
+        assert image_cache.lookup("receipt", self.prepared_receipt(data))["cache"]["match"] == "near"
+        assert image_cache.lookup("receipt", self.prepared_receipt(data), exact_only=True) is None
+
+    def test_spooled_input_kept_until_job_is_terminal(self):
+        import os
+        from services.vision.vision_service import _load_spooled_image, _spool_image
+        data = self.receipt_bytes(0, 41)
+        self.cache_receipt(data, {"merchant": "Spool Shop", "total_amount": 12.0})
+
+        # A handler that dies mid-run must leave the input for recover() to re-run
+        payload = _spool_image(self.prepared_receipt(data))
+        _load_spooled_image(payload)
+        assert os.path.exists(payload["path"])
+        os.remove(payload["path"])
+
+        response = client.post("/vision/analyze-receipt?background=true", files={"file": ("r.png", data, "image/png")})
+        assert response.status_code == 202
+        job = wait_for_job(response.json()["job_id"])
+        assert job["status"] == "completed"
+        assert job["result"]["merchant"] == "Spool Shop"
+        assert not os.path.exists(job["payload"]["path"])
+
+
+class TestDashboardInsight:
+    def test_overview_serves_stored_insight(self):
+        response = client.post("/dashboard/refresh-insight")
+        assert response.status_code == 202
+        wait_for_job(response.json()["job_id"])
+
+        response = client.get("/dashboard/overview")
+        assert response.status_code == 200
+        insight = response.json()["ai_insight"]
+        assert insight["message"]
+        assert "generated_at" in insight
+
+    def test_fallback_insight_does_not_advance_watermark(self, monkeypatch):
+        from services.dashboard import dashboard_service, insight_store
+        monkeypatch.setattr(dashboard_service, "generate_insight",
+                            lambda context: {"message": "Canned", "confidence": 0.5, "tags": ["fallback"]})
+        before = insight_store.get_latest_insight()
+        client.post("/dashboard/log-activity", json={"type": "insight_test", "description": "New activity"})
+
+        result = dashboard_service.run_insight_refresh()
+        assert result["insight"]["activity_watermark"] == (before["activity_watermark"] if before else 0)
+        latest = insight_store.get_latest_insight()
+        assert not insight_store.needs_refresh(latest, insight_store.activity_watermark())
+        monkeypatch.setattr(insight_store, "FALLBACK_RETRY_AFTER", insight_store.timedelta(0))
+        assert insight_store.needs_refresh(latest, insight_store.activity_watermark())
+
+    def test_concurrent_schedules_enqueue_one_job(self, monkeypatch):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from services.dashboard import dashboard_service, insight_store
+        release = threading.Event()
+
+        def slow_insight(context):
+            release.wait(5)
+            return {"message": "Slow", "confidence": 0.9, "tags": ["general"]}
+        monkeypatch.setattr(dashboard_service, "generate_insight", slow_insight)
+        try:
+            with ThreadPoolExecutor(8) as pool:
+                jobs = list(pool.map(lambda _: insight_store.schedule_refresh(force=True), range(8)))
+            assert len({job["id"] for job in jobs}) == 1
+        finally:
+            release.set()
+        wait_for_job(jobs[0]["id"])
+
+
+class TestActivityFeed:
+    def test_buffered_writes_and_keyset_pages(self):
+        for i in range(5):
+            response = client.post("/dashboard/log-activity", json={
+                "type": "feed_test", "description": f"Feed item {i}", "metadata": {"n": i, "tag": "odd" if i % 2 else "even"}
+            })
+            assert response.status_code == 200
+
+        first = client.get("/dashboard/activities", params={"limit": 2, "type": "feed_test"}).json()
+        assert [a["description"] for a in first["activities"]] == ["Feed item 4", "Feed item 3"]
+        assert first["activities"][0]["metadata"] == {"n": 4, "tag": "even"}
+
+        second = client.get("/dashboard/activities", params={
+            "limit": 2, "type": "feed_test", "before_id": first["next_before_id"]
+        }).json()
+        assert [a["description"] for a in second["activities"]] == ["Feed item 2", "Feed item 1"]
+
+    def test_metadata_filters_run_in_sql(self):
+        response = client.get("/dashboard/activities", params={"type": "feed_test", "meta": ["tag=odd", "n=3"]})
+        assert [a["description"] for a in response.json()["activities"]] == ["Feed item 3"]
+        assert client.get("/dashboard/activities", params={"meta": "broken"}).status_code == 400
+        assert client.get("/dashboard/activities", params={"meta": 'ta"g=odd'}).status_code == 400
+        assert client.get("/dashboard/activities", params={"meta": "tag=[1, 2]"}).status_code == 400
+
+    def test_log_activity_returns_id_and_buffered_writes_count_toward_watermark(self):
+        from services.dashboard.insight_store import activity_watermark
+        response = client.post("/dashboard/log-activity", json={"type": "feed_test", "description": "Direct"})
+        assert response.json()["activity"]["id"] == activity_watermark()
+
+        response = client.post("/dashboard/log-activity?buffered=true", json={"type": "feed_test", "description": "Queued"})
+        assert response.json()["activity"]["id"] is None
+        watermark = activity_watermark()
+        page = client.get("/dashboard/activities", params={"limit": 1, "type": "feed_test"}).json()["activities"]
+        assert page[0]["description"] == "Queued"
+        assert page[0]["id"] == watermark
+
+    @staticmethod
+    def isolated_activity_db(monkeypatch, tmp_path):
+        """Point the activity tables at a throwaway DB so compaction never touches app.db."""
+        import database
+        from services.dashboard import activity_retention, activity_tracker
+        monkeypatch.setattr(database, "DB_PATH", tmp_path / "app.db")
+        database.init_db()
+        activity_retention.init_activity_archive()
+        activity_tracker.init_activity_indexes()
+
+    def test_compaction_archives_summarizes_and_expires(self, monkeypatch, tmp_path):
+        from database import get_db_connection
+        from services.dashboard.activity_retention import compact_activities
+        from services.dashboard.activity_tracker import calculate_habit_streak, get_recent_activities
+        self.isolated_activity_db(monkeypatch, tmp_path)
+        conn = get_db_connection()
+        conn.executemany(
+            "INSERT INTO activities (type, description, icon, timestamp, metadata) VALUES (?, ?, '📝', ?, '{}')",
+            [("old_test", "Old row", "2020-01-05T10:00:00"),
+             ("old_test", "Old row 2", "2020-01-05T11:00:00"),
+             ("dream_log", "Old dream", "2020-01-06T07:00:00")]
+        )
+        conn.commit()
+        conn.close()
+        days_before = calculate_habit_streak()["current"]
+
+        result = compact_activities({"hot_days": 365, "retention_days": 0})
+        assert result["archived"] == 3
+
+        conn = get_db_connection()
+        hot = conn.execute("SELECT COUNT(*) FROM activities WHERE timestamp < '2021-01-01'").fetchone()[0]
+        daily = conn.execute("SELECT count FROM activity_daily WHERE day = '2020-01-05' AND type = 'old_test'").fetchone()
+        conn.close()
+        assert hot == 0
+        assert daily["count"] == 2
+        assert calculate_habit_streak()["current"] == days_before
+
+        # Pages fall through from the hot table into the archive
+        page = get_recent_activities(type="old_test")
+        assert [a["description"] for a in page] == ["Old row 2", "Old row"]
+
+        result = compact_activities({"hot_days": 365, "retention_days": 365})
+        assert result["expired"] == 2
+        assert get_recent_activities(type="old_test") == []
+        conn = get_db_connection()
+        dreams = conn.execute("SELECT description FROM activities_all WHERE type = 'dream_log'").fetchall()
+        conn.close()
+        assert [d["description"] for d in dreams] == ["Old dream"]
+
+    def test_compaction_splits_by_id_so_the_feed_sees_every_row(self, monkeypatch, tmp_path):
+        from database import get_db_connection
+        from services.dashboard.activity_retention import compact_activities
+        from services.dashboard.activity_tracker import get_recent_activities
+        self.isolated_activity_db(monkeypatch, tmp_path)
+        conn = get_db_connection()
+        # A recent row, then one applied later but dated in the past (e.g. by the outbox)
+        conn.executemany(
+            "INSERT INTO activities (type, description, icon, timestamp, metadata) VALUES ('split_test', ?, '📝', ?, '{}')",
+            [("Early", "2020-01-01T09:00:00"), ("Recent", "2099-01-01T09:00:00"), ("Backdated", "2020-01-02T09:00:00")]
+        )
+        conn.commit()
+        conn.close()
+
+        # Only rows below the first hot one move; the backdated row doesn't drag "Recent" along
+        result = compact_activities({"hot_days": 365, "retention_days": 0})
+        assert result["archived"] == 1
+        conn = get_db_connection()
+        hot = [row[0] for row in conn.execute("SELECT description FROM activities WHERE type = 'split_test' ORDER BY id")]
+        conn.close()
+        assert hot == ["Recent", "Backdated"]
+        page = get_recent_activities(type="split_test")
+        assert [a["description"] for a in page] == ["Backdated", "Recent", "Early"]
+
+
+class TestJobQueue:
+    def test_background_dream_returns_job(self):
+        response = client.post("/dreams/interpret?background=true", json={"description": "Flying over a city"})
+        assert response.status_code == 202
+        data = response.json()
+        assert data["status_url"] == f"/jobs/{data['job_id']}"
+
+        job = wait_for_job(data["job_id"])
+        assert job["status"] == "completed"
+        assert "theme" in job["result"]
+
+    def test_dream_job_logs_activity_or_fails_cleanly(self, monkeypatch):
+        import json
+        from types import SimpleNamespace
+        from services.dreams import dream_service
+        answers = iter(['```json\n{"interpretation": "Change is coming.", "symbols": ["river"], "theme": "Flow"}\n```',
+                        "The river means change."])
+        llm = SimpleNamespace(invoke=lambda messages: SimpleNamespace(content=next(answers)))
+        monkeypatch.setattr(dream_service, "get_llm", lambda: llm)
+
+        job = wait_for_job(client.post("/dreams/interpret?background=true", json={"description": "A wide river"}).json()["job_id"])
+        assert job["status"] == "completed"
+        latest = client.get("/dreams/history").json()[0]
+        assert latest["description"] == "A wide river"
+        assert json.loads(latest["metadata"])["theme"] == "Flow"
+        feed = client.get("/dashboard/activities", params={"type": "dream_log", "limit": 1}).json()["activities"]
+        assert feed[0]["description"] == "A wide river"
+
+        job = wait_for_job(client.post("/dreams/interpret?background=true", json={"description": "A dry river"}).json()["job_id"])
+        assert job["status"] == "failed"
+        assert "not valid JSON" in job["error"]
+
+    def test_job_events_stream(self):
+        job_id = client.post("/dashboard/refresh-insight").json()["job_id"]
+        response = client.get(f"/jobs/{job_id}/events")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert "event: done" in response.text
+
+    def test_unknown_job(self):
+        response = client.get("/jobs/does-not-exist")
+        assert response.status_code == 404
+
+
+class TestCorrelationEngine:
+    def test_lagged_correlation_found(self):
+        import numpy as np
+        import pandas as pd
+        from services.orchestrator.correlation_engine import top_findings, finding_to_insight
+
+        rng = np.random.default_rng(7)
+        days = pd.date_range("2024-01-01", periods=28, freq="D")
+        mood = rng.normal(0, 1, len(days))
+        shopping = np.r_[0, -mood[:-1] * 400 + 800] + rng.normal(0, 40, len(days))
+        features = pd.DataFrame({
+            "mood_score": mood,
+            "spend_Shopping": shopping,
+            "calories": rng.normal(2000, 150, len(days))
+        }, index=days)
+
+        findings = top_findings(features)
+        assert findings[0]["feature_a"] == "mood_score"
+        assert findings[0]["feature_b"] == "spend_Shopping"
+        assert findings[0]["lag_days"] == 1
+        assert findings[0]["r"] < -0.8
+        assert findings[0]["confidence"] > 0.95
+        assert finding_to_insight(findings[0])["type"] == "risk"
+
+    def test_fusion_analyze(self):
+        response = client.get("/memory-fusion/analyze")
+        assert response.status_code == 200
+        assert "insights" in response.json()
+
+    def test_fusion_cached_until_new_data(self):
+        client.get("/memory-fusion/analyze?refresh=true")
+        cached = client.get("/memory-fusion/analyze").json()
+        assert cached["cache"]["hit"] is True
+
+        client.post("/finance/transaction", json={"amount": 120, "type": "expense", "category": "Food", "description": "Lunch"})
+        fresh = client.get("/memory-fusion/analyze").json()
+        assert fresh["cache"]["hit"] is False
+
+    def test_fusion_watermark_tracks_updates_and_habits(self):
+        from database import get_db_connection
+        from services.orchestrator.memory_fusion import data_watermark
+
+        habit = client.post("/habits/", json={"name": "Stretch"}).json()["habit"]
+        before = data_watermark()
+        client.delete(f"/habits/{habit['id']}")
+        after_deactivate = data_watermark()
+        assert after_deactivate != before
+
+        conn = get_db_connection()
+        conn.execute("UPDATE transactions SET amount = amount WHERE id = (SELECT MAX(id) FROM transactions)")
+        conn.commit()
+        conn.close()
+        assert data_watermark() != after_deactivate
+
+
+class TestPromptContext:
+    def test_budget_keeps_priority_sections(self):
+        from prompt_context import ContextBuilder, estimate_tokens
+        history = [f"User: message number {i} " + "x" * 80 for i in range(20)]
+        sections = ContextBuilder("test_budget", budget=200) \
+            .reserve("instructions " * 10) \
+            .add_items("docs", ["doc one " * 10, "doc two " * 10], priority=2) \
+            .add_items("history", history, priority=1, joiner="\n", keep="last") \
+            .build()
+        assert sections["docs"].count("doc") == 20
+        assert "message number 19" in sections["history"]
+        assert "message number 0 " not in sections["history"]
+        assert estimate_tokens("instructions " * 10 + sections["docs"] + sections["history"]) <= 200
+
+    def test_prompt_stats_endpoint(self):
+        response = client.get("/mlops/prompt-stats")
+        assert response.status_code == 200
+        stats = response.json()["endpoints"]["test_budget"]
+        assert stats["calls"] >= 1
+        assert stats["truncated_calls"] >= 1
+
+
+class TestXpLedger:
+    def test_concurrent_grants_are_not_lost(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from services.gamification.gamification_service import add_xp
+        before = client.get("/gamification/stats").json()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda _: add_xp(3, "test", "concurrency"), range(40)))
+        after = client.get("/gamification/stats").json()
+        assert after["xp"] - before["xp"] == 120
+        assert after["xp_today"] - before["xp_today"] == 120
+
+    def test_add_xp_endpoint_records_event(self):
+        response = client.post("/gamification/add-xp", params={"amount": 5, "source": "test_endpoint", "reason": "check"})
+        assert response.status_code == 200
+        assert response.json()["event_id"]
+        events = client.get("/gamification/xp-history", params={"source": "test_endpoint"}).json()["events"]
+        assert events[0]["amount"] == 5
+        assert events[0]["reason"] == "check"
+
+    def test_xp_status_cache_is_invalidated_by_grants(self):
+        from services.gamification.gamification_service import add_xp, get_xp_status
+        before = get_xp_status()
+        assert get_xp_status() == before
+        add_xp(7, "test", "status cache")
+        after = get_xp_status()
+        assert after["total_xp"] == before["total_xp"] + 7
+        assert after["xp_this_week"] == before["xp_this_week"] + 7
+
+        profile = client.get("/profile/").json()
+        assert profile["stats"]["total_xp"] == after["total_xp"]
+
+    def test_level_curve(self):
+        from services.gamification.gamification_service import (
+            get_level_from_xp, get_title_for_level, xp_for_level, xp_to_next_level
+        )
+        assert [get_level_from_xp(xp) for xp in (0, 99, 100, 299, 300, 1000)] == [1, 1, 2, 2, 3, 5]
+        assert xp_for_level(10) == 5000 and get_level_from_xp(4999) == 9
+        assert get_level_from_xp(xp_for_level(45)) == 45
+        assert get_level_from_xp(xp_for_level(45) - 1) == 44
+        assert xp_to_next_level(250) == 50
+        assert get_title_for_level(10) == "God Level"
+        assert get_title_for_level(45) == "Immortal"
+
+
+class TestOutbox:
+    def test_meal_side_effects_applied_by_dispatcher(self, monkeypatch, tmp_path):
+        import outbox
+        from database import get_db_connection
+        isolated_db(monkeypatch, tmp_path)
+        outbox.flush()
+        xp_before = client.get("/gamification/stats").json()["xp"]
+
+        response = client.post("/diet/log-meal", json={"food_name": "Outbox Idli", "calories": 150})
+        assert response.status_code == 200
+        outbox.flush()
+
+        conn = get_db_connection()
+        pending = conn.execute("SELECT COUNT(*) FROM outbox WHERE processed_at IS NULL").fetchone()[0]
+        meal = conn.execute("SELECT * FROM meals WHERE name = 'Outbox Idli'").fetchone()
+        conn.close()
+        assert pending == 0
+        assert meal["calories"] == 150
+        assert client.get("/gamification/stats").json()["xp"] >= xp_before + 15
+        activities = client.get("/dashboard/activities", params={"limit": 50}).json()["activities"]
+        assert any("Outbox Idli" in a["description"] for a in activities)
+
+    def test_failing_row_does_not_block_batch(self, monkeypatch, tmp_path):
+        import outbox
+        from database import get_db_connection
+        isolated_db(monkeypatch, tmp_path)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO outbox (event_type, payload, created_at) VALUES ('broken', 'not json', '2026-01-01T00:00:00')"
+        )
+        outbox.record(cursor, "test_ok", xp={"amount": 1, "source": "test_outbox", "reason": "batch"})
+        conn.commit()
+        conn.close()
+
+        outbox.flush()
+        conn = get_db_connection()
+        rows = {r["event_type"]: r for r in conn.execute("SELECT * FROM outbox WHERE event_type IN ('broken', 'test_ok')")}
+        conn.close()
+        assert rows["test_ok"]["processed_at"] is not None
+        assert rows["broken"]["processed_at"] is None
+        # Poison rows back off instead of burning every attempt in one flush
+        assert rows["broken"]["attempts"] == 1
+        assert rows["broken"]["next_attempt_at"] > rows["broken"]["created_at"]
+
+    def test_xp_goes_to_the_payload_user(self, monkeypatch, tmp_path):
+        import outbox
+        from database import get_db_connection
+        from services.gamification import gamification_service
+        isolated_db(monkeypatch, tmp_path)
+        granted = []
+        apply_xp_grants = gamification_service.apply_xp_grants
+        monkeypatch.setattr(gamification_service, "apply_xp_grants",
+                            lambda cursor, user_id, grants: granted.append((user_id, len(grants))) or apply_xp_grants(cursor, user_id, grants))
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        outbox.record(cursor, "test_user", xp={"amount": 1, "source": "test_outbox", "user_id": 7})
+        outbox.record(cursor, "test_user", event={"user_id": 8}, xp={"amount": 1, "source": "test_outbox"})
+        outbox.record(cursor, "test_user", xp={"amount": 1, "source": "test_outbox"})
+        conn.commit()
+        conn.close()
+        outbox.flush()
+        assert sorted(granted) == [(1, 1), (7, 1), (8, 1)]
+
+    def test_transient_errors_back_off_without_dead_lettering(self, monkeypatch, tmp_path):
+        import sqlite3
+        import outbox
+        from database import get_db_connection
+        isolated_db(monkeypatch, tmp_path)
+        apply = outbox._apply
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        outbox.record(cursor, "test_locked", xp={"amount": 1, "source": "test_outbox", "reason": "locked"})
+        row_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+
+        def locked(rows):
+            raise sqlite3.OperationalError("database is locked")
+        monkeypatch.setattr(outbox, "_apply", locked)
+        outbox.flush()
+        monkeypatch.setattr(outbox, "_apply", apply)
+
+        conn = get_db_connection()
+        row = conn.execute("SELECT * FROM outbox WHERE id = ?", (row_id,)).fetchone()
+        assert (row["attempts"], row["retries"], row["processed_at"]) == (0, 1, None)
+        # Once due again it is applied normally
+        conn.execute("UPDATE outbox SET next_attempt_at = NULL WHERE id = ?", (row_id,))
+        conn.commit()
+        outbox.flush()
+        assert conn.execute("SELECT processed_at FROM outbox WHERE id = ?", (row_id,)).fetchone()[0] is not None
+        conn.close()
+
+
+class TestChallenges:
+    def test_weekly_view_refreshes_after_increment(self):
+        before = client.get("/challenges/weekly").json()
+        assert len(before["challenges"]) == 5
+        assert client.get("/challenges/weekly").json() == before
+
+        client.post("/challenges/mindful_soul/increment")
+        after = {c["id"]: c for c in client.get("/challenges/weekly").json()["challenges"]}
+        previous = {c["id"]: c for c in before["challenges"]}
+        assert after["mindful_soul"]["progress"] == previous["mindful_soul"]["progress"] + 1
+
+    def test_meal_event_advances_challenge(self):
+        def nutrition():
+            challenges = client.get("/challenges/weekly").json()["challenges"]
+            return next(c for c in challenges if c["id"] == "nutrition_pro")["progress"]
+
+        before = nutrition()
+        import outbox
+        response = client.post("/diet/log-meal", json={"food_name": "Dal", "calories": 300})
+        assert response.status_code == 200
+        outbox.flush()
+        assert nutrition() == before + 1
+
+    def test_per_day_challenges_count_once(self):
+        from services.gamification.challenges_service import advance_challenge
+        client.post("/challenges/reset-weekly")
+        assert advance_challenge("habit_streak", per_day=True)["progress"] == 1
+        assert advance_challenge("habit_streak", per_day=True) is None
+
+    def test_manual_increment_does_not_use_up_the_daily_count(self):
+        from services.gamification.challenges_service import advance_challenge
+        client.post("/challenges/reset-weekly")
+        assert client.post("/challenges/habit_streak/increment").json()["new_progress"] == 1
+        assert advance_challenge("habit_streak", per_day=True)["progress"] == 2
+        assert advance_challenge("habit_streak", per_day=True) is None
+        assert client.post("/challenges/habit_streak/increment").json()["new_progress"] == 3
+
+    def test_early_bird_counts_user_actions_only(self, monkeypatch):
+        from event_bus import publish
+        from services.gamification import challenges_service
+        triggers, _, per_day = challenges_service.CHALLENGE_TRIGGERS["early_bird"]
+        monkeypatch.setitem(challenges_service.CHALLENGE_TRIGGERS, "early_bird", (triggers, None, per_day))
+
+        def early_bird():
+            challenges = client.get("/challenges/weekly").json()["challenges"]
+            return next(c for c in challenges if c["id"] == "early_bird")["progress"]
+
+        client.post("/challenges/reset-weekly")
+        publish("xp_granted", {"amount": 5})
+        publish("activity_logged", {"type": "chat_sent"})
+        assert early_bird() == 0
+        publish("gita_conversation", {"mood": "calm"})
+        assert early_bird() == 1
+
+    def test_increment_reports_granted_xp_once(self):
+        client.post("/challenges/reset-weekly")
+        target = next(c for c in client.get("/challenges/weekly").json()["challenges"] if c["id"] == "mindful_soul")["target"]
+        completing = client.post("/challenges/mindful_soul/increment", params={"amount": target}).json()
+        assert completing["completed"] and completing["xp_awarded"] > 0
+
+        again = client.post("/challenges/mindful_soul/increment").json()
+        assert again["completed"]
+        assert again["xp_awarded"] == 0
+
+    def test_rollover_keeps_history(self):
+        assert client.post("/challenges/mindful_soul/increment").json()["success"]
+        from services.jobs.job_queue import job_queue
+        result = wait_for_job(job_queue.enqueue("challenge_rollover")["id"])
+        assert result["status"] == "completed"
+
+        weeks = client.get("/challenges/history", params={"weeks": 1}).json()["weeks"]
+        assert len(weeks) == 1
+        assert len(weeks[0]["challenges"]) == 5
+
+
+class TestAchievementEngine:
+    def test_failing_subscriber_does_not_break_publish(self):
+        from event_bus import publish, subscribe
+        received = []
+
+        @subscribe("test_event")
+        def broken(event_type, payload):
+            raise RuntimeError("boom")
+
+        @subscribe("test_event")
+        def recorder(event_type, payload):
+            received.append(payload)
+
+        publish("test_event", {"n": 1})
+        assert received == [{"n": 1}]
+
+    def test_focus_sessions_unlock_achievements(self, monkeypatch, tmp_path):
+        isolated_db(monkeypatch, tmp_path)
+        for _ in range(3):
+            response = client.post("/gamification/focus-session", params={"minutes": 25})
+            assert response.status_code == 200
+
+        achievements = {a["id"]: a for a in client.get("/achievements/").json()["achievements"]}
+        assert achievements["first_focus"]["unlocked"]
+        assert achievements["focus_marathon"]["unlocked"]
+
+        first = client.get("/achievements/check").json()
+        assert "first_focus" in [a["id"] for a in first["newly_unlocked"]]
+        assert client.get("/achievements/check").json()["count"] == 0
+
+    def test_batch_unlock_is_idempotent(self, monkeypatch, tmp_path):
+        from services.gamification.achievements_service import unlock_achievements
+        isolated_db(monkeypatch, tmp_path)
+        unlocked = unlock_achievements(["life_score_80", "all_modules", "no_such_badge"])
+        assert sorted(a["id"] for a in unlocked) == ["all_modules", "life_score_80"]
+        assert unlock_achievements(["life_score_80", "all_modules"]) == []
+
+        events = client.get("/gamification/xp-history", params={"source": "achievement"}).json()["events"]
+        assert events[0]["amount"] == 550
+
+        special = client.get("/achievements/", params={"category": "special"}).json()
+        assert special["total_count"] == 4
+        flags = [a["unlocked"] for a in special["achievements"]]
+        assert flags == sorted(flags, reverse=True)
+
+    def test_failed_unlock_is_retried(self, monkeypatch, tmp_path):
+        import sqlite3
+        from event_bus import publish
+        from services.gamification import achievements_service
+        isolated_db(monkeypatch, tmp_path)
+        publish("engine_warmup", {})
+        get_db = achievements_service.get_db
+
+        def locked():
+            raise sqlite3.OperationalError("database is locked")
+        monkeypatch.setattr(achievements_service, "get_db", locked)
+        publish("meal_logged", {})
+        assert "first_meal" not in achievements_service._engine["unlocked"]
+
+        monkeypatch.setattr(achievements_service, "get_db", get_db)
+        publish("meal_logged", {})
+        assert "first_meal" in achievements_service.get_unlocked_achievements()
+
+    def test_failed_xp_grant_rolls_back_unlock(self, monkeypatch, tmp_path):
+        import sqlite3
+        from services.gamification import achievements_service, gamification_service
+        isolated_db(monkeypatch, tmp_path)
+        apply_xp_grants = gamification_service.apply_xp_grants
+
+        def locked(*args):
+            raise sqlite3.OperationalError("database is locked")
+        monkeypatch.setattr(gamification_service, "apply_xp_grants", locked)
+        with pytest.raises(sqlite3.OperationalError):
+            achievements_service.unlock_achievements(["first_meal"])
+        assert "first_meal" not in achievements_service.get_unlocked_achievements()
+
+        monkeypatch.setattr(gamification_service, "apply_xp_grants", apply_xp_grants)
+        assert [a["id"] for a in achievements_service.unlock_achievements(["first_meal"])] == ["first_meal"]
+        events = client.get("/gamification/xp-history", params={"source": "achievement"}).json()["events"]
+        assert [e["amount"] for e in events] == [achievements_service.ACHIEVEMENTS_BY_ID["first_meal"]["xp"]]
+
+
 class TestOrchestratorService:
     def test_chat_orchestrator_diet(self):
         response = client.post("/orchestrator/chat?query=I want to eat healthy food")
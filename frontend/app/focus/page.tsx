@@ -37,14 +37,9 @@ export default function FocusPage() {
     const awardFocusXP = async () => {
         try {
             const API_URL = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000";
-            await fetch(`${API_URL}/gamification/add-xp`, {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({
-                    amount: mode === "focus" ? 50 : 10,
-                    activity_type: "focus_complete",
-                    description: `Completed ${mode === "focus" ? "25-min Focus" : "5-min Break"} session`
-                })
+            const minutes = mode === "focus" ? 25 : 5;
+            await fetch(`${API_URL}/gamification/focus-session?mode=${mode}&minutes=${minutes}`, {
+                method: "POST"
             });
         } catch (error) {
             console.error("Failed to award XP:", error);